@@ -0,0 +1,471 @@
+import math
+from abc import ABC
+from typing import Tuple
+
+import numpy as np
+from scipy import sparse
+from phe import EncryptedNumber, EncodedNumber, PaillierPublicKey
+
+from ppc_common.ppc_crypto.crypto_utils import powmod, mulmod
+from ppc_common.ppc_crypto.ihc_batch_engine import LIMB_BITS, limb_toeplitz, carry_limbs, \
+    ints_to_limbs, limbs_to_ints
+from ppc_common.ppc_crypto.ihc_cipher import IhcCiphertext, NumberCodec
+
+try:
+    import gmpy2
+
+    IS_GMP = True
+except ImportError:
+    IS_GMP = False
+
+# encrypted_bincount 单次展开的最大元素个数
+BINCOUNT_CHUNK_SIZE = 1 << 22
+
+
+class CipherArray(ABC):
+    """密文数组
+
+    以连续内存存放一批密文, 同态加法、标量乘法、索引选择、按组求和都以数组为单位完成,
+    不再为每个密文创建Python对象。
+    """
+
+    @staticmethod
+    def from_ciphers(ciphers) -> 'CipherArray':
+        if isinstance(ciphers, CipherArray):
+            return ciphers
+        if len(ciphers) > 0 and isinstance(ciphers[0], EncryptedNumber):
+            return PaillierCipherArray.from_ciphers(ciphers)
+        return IhcCipherArray.from_ciphers(ciphers)
+
+    @staticmethod
+    def concatenate(arrays: list) -> 'CipherArray':
+        return type(arrays[0]).concatenate(arrays)
+
+    @staticmethod
+    def _normalize_index(index):
+        # 单个下标也返回数组
+        if isinstance(index, (int, np.integer)):
+            return [index]
+        return index
+
+    def __len__(self) -> int:
+        pass
+
+    def __getitem__(self, index) -> 'CipherArray':
+        pass
+
+    def __add__(self, other: 'CipherArray') -> 'CipherArray':
+        pass
+
+    def __mul__(self, scalar: int) -> 'CipherArray':
+        pass
+
+    def segment_sum(self, group_ids: np.ndarray, group_num: int, order: np.ndarray = None) -> 'CipherArray':
+        """按组求和, 结果第g个密文为所有group_ids == g的密文之和, 空组为0的密文
+
+        group_ids为二维 (row_num, n) 时, 每一行都对全部n个密文分组一次, 各行的组号不能重叠。
+        order为展开后的group_ids按组号排序的下标(组内顺序任意), 已知时可省去排序。
+        """
+        pass
+
+    def sum(self) -> 'CipherArray':
+        return self.segment_sum(np.zeros(len(self), dtype=np.int64), 1)
+
+    def matmul(self, matrix: np.ndarray) -> 'CipherArray':
+        """明文整数矩阵 (m, n) 乘以本密文向量 (n,), 返回长度为m的密文向量, 第i个为 sum_j matrix[i, j] * c_j
+
+        matrix 可以是scipy稀疏矩阵, 此时只计算非零系数
+        """
+        pass
+
+    def to_ciphers(self) -> list:
+        pass
+
+    def encode(self, be_secure=True) -> Tuple[int, bytes, bytes]:
+        """与codec.encode_cipher_array相同的线上格式"""
+        pass
+
+    @property
+    def nbytes(self) -> int:
+        pass
+
+
+class IhcCipherArray(CipherArray):
+    """IHC密文数组, c_left/c_right 以 (limb_num, n) 的uint16 limb数组存放
+
+    IHC的解密是 mod 2^L 的线性运算, 同态运算的结果可以随时对 2^L 取模。
+    """
+
+    def __init__(self, left: np.ndarray, right: np.ndarray, key_length: int = 256) -> None:
+        self.left = left
+        self.right = right
+        self.key_length = key_length
+        self.limb_num = left.shape[0]
+        self.byte_num = self.limb_num * LIMB_BITS // 8
+        self.top_mask = (1 << (key_length - LIMB_BITS *
+                         (self.limb_num - 1))) - 1
+        self.number_codec = NumberCodec(key_length)
+
+    @classmethod
+    def from_ciphers(cls, ciphers, key_length: int = None) -> 'IhcCipherArray':
+        if key_length is None:
+            key_length = ciphers[0].number_codec.key_length if len(
+                ciphers) > 0 else 256
+        left = ints_to_limbs([cipher.c_left for cipher in ciphers], key_length)
+        right = ints_to_limbs(
+            [cipher.c_right for cipher in ciphers], key_length)
+        return cls(left, right, key_length)
+
+    @classmethod
+    def zeros(cls, size: int, key_length: int = 256) -> 'IhcCipherArray':
+        limb_num = math.ceil(key_length / LIMB_BITS)
+        return cls(np.zeros((limb_num, size), dtype=np.uint16),
+                   np.zeros((limb_num, size), dtype=np.uint16), key_length)
+
+    @classmethod
+    def concatenate(cls, arrays: list) -> 'IhcCipherArray':
+        return cls(np.hstack([array.left for array in arrays]),
+                   np.hstack([array.right for array in arrays]), arrays[0].key_length)
+
+    @classmethod
+    def decode(cls, buffer, count: int, width: int, key_length: int = 256) -> 'IhcCipherArray':
+        """从 c_left|c_right 定长大端格式直接还原limb数组"""
+        limb_num = math.ceil(key_length / LIMB_BITS)
+        byte_num = limb_num * LIMB_BITS // 8
+        half_width = width // 2
+        data = np.frombuffer(buffer, dtype=np.uint8,
+                             count=count * width).reshape(count, 2, half_width)
+        # 大端转小端, 超过 2^L 的高位直接截断
+        data = data[:, :, ::-1][:, :, :byte_num]
+        little = np.zeros((count, 2, byte_num), dtype=np.uint8)
+        little[:, :, :data.shape[2]] = data
+        limbs = little.view('<u2').transpose(1, 2, 0)
+        array = cls(np.ascontiguousarray(limbs[0]),
+                    np.ascontiguousarray(limbs[1]), key_length)
+        array.left[-1] &= array.top_mask
+        array.right[-1] &= array.top_mask
+        return array
+
+    def encode(self, be_secure=True) -> Tuple[int, bytes, bytes]:
+        limbs = np.stack([self.left, self.right]).astype('<u2')
+        # (2, limb_num, n) -> (n, 2, byte_num) 的大端字节
+        data = limbs.transpose(2, 0, 1).copy().view(np.uint8)[:, :, ::-1]
+        return 2 * self.byte_num, np.ascontiguousarray(data).tobytes(), bytes()
+
+    def to_ciphers(self) -> list:
+        return [IhcCiphertext(c_left, c_right, self.number_codec)
+                for c_left, c_right in zip(limbs_to_ints(self.left), limbs_to_ints(self.right))]
+
+    def __len__(self) -> int:
+        return self.left.shape[1]
+
+    def __getitem__(self, index) -> 'IhcCipherArray':
+        index = self._normalize_index(index)
+        return IhcCipherArray(self.left[:, index], self.right[:, index], self.key_length)
+
+    def __add__(self, other: 'IhcCipherArray') -> 'IhcCipherArray':
+        acc = np.stack([self.left, self.right]).astype(np.int64)
+        acc += np.stack([other.left, other.right])
+        result = carry_limbs(acc, self.top_mask)
+        return IhcCipherArray(result[0], result[1], self.key_length)
+
+    def __mul__(self, scalar: int) -> 'IhcCipherArray':
+        matrix = limb_toeplitz(self.number_codec.encode(
+            int(scalar)), self.limb_num)
+        acc = np.dot(matrix, np.hstack(
+            [self.left, self.right]).astype(np.int64))
+        acc = carry_limbs(acc, self.top_mask)
+        return IhcCipherArray(acc[:, :len(self)], acc[:, len(self):], self.key_length)
+
+    def segment_sum(self, group_ids: np.ndarray, group_num: int, order: np.ndarray = None) -> 'IhcCipherArray':
+        # 每个limb各自按组累加, 不需要排序, float64在 n * 2^16 < 2^53 时是精确的
+        group_ids = np.asarray(group_ids)
+        row_num = group_ids.shape[0] if group_ids.ndim == 2 else 1
+        group_ids = group_ids.ravel()
+        limbs = np.vstack([self.left, self.right])
+        acc = np.empty((limbs.shape[0], group_num), dtype=np.int64)
+        for k in range(limbs.shape[0]):
+            weights = np.tile(limbs[k], row_num) if row_num > 1 else limbs[k]
+            acc[k] = np.bincount(group_ids, weights=weights,
+                                 minlength=group_num)
+        acc = carry_limbs(acc.reshape(2, self.limb_num, group_num), self.top_mask)
+        return IhcCipherArray(acc[0], acc[1], self.key_length)
+
+    def matmul(self, matrix: np.ndarray) -> 'IhcCipherArray':
+        # 系数拆分为16bit的有符号数字 a = sum_k d_k * 2^(16k), d_k in [-2^15, 2^15),
+        # 每个数字矩阵与limb数组做一次int64矩阵乘法, 按k错位累加后统一进位
+        matrix = int64_matrix(matrix)
+        limbs = np.vstack([self.left, self.right]).astype(np.int64)
+        acc = np.zeros((2, self.limb_num, matrix.shape[0]), dtype=np.int64)
+        for k, digit in enumerate(matrix_digits(matrix)[:self.limb_num]):
+            product = np.asarray(digit @ limbs.T).T.reshape(2, self.limb_num, -1)
+            acc[:, k:, :] += product[:, :self.limb_num - k, :]
+        acc = carry_limbs(acc, self.top_mask)
+        return IhcCipherArray(acc[0], acc[1], self.key_length)
+
+    @property
+    def nbytes(self) -> int:
+        return self.left.nbytes + self.right.nbytes
+
+
+class PaillierCipherArray(CipherArray):
+    """Paillier密文数组, 密文以gmpy2整数的object数组存放, 所有密文共用一个指数"""
+
+    def __init__(self, public_key: PaillierPublicKey, values: np.ndarray,
+                 exponent: int = 0, is_obfuscated: bool = False) -> None:
+        self.public_key = public_key
+        self.values = values
+        self.exponent = exponent
+        self.is_obfuscated = is_obfuscated
+
+    @staticmethod
+    def _to_mpz(value):
+        return gmpy2.mpz(value) if IS_GMP else int(value)
+
+    @classmethod
+    def _from_ints(cls, public_key, ints, exponents, is_obfuscated) -> 'PaillierCipherArray':
+        values = np.empty(len(ints), dtype=object)
+        values[:] = [cls._to_mpz(value) for value in ints]
+        exponent = min(exponents, default=0)
+        array = cls(public_key, values, exponent, is_obfuscated)
+        for i, value_exponent in enumerate(exponents):
+            if value_exponent != exponent:
+                # 与phe一致, 指数不同时对齐到较小的指数
+                array.values[i] = array._raw_mul(
+                    array.values[i], pow(EncodedNumber.BASE, value_exponent - exponent))
+        return array
+
+    @classmethod
+    def from_ciphers(cls, ciphers) -> 'PaillierCipherArray':
+        return cls._from_ints(ciphers[0].public_key,
+                              [cipher.ciphertext(be_secure=False)
+                               for cipher in ciphers],
+                              [cipher.exponent for cipher in ciphers],
+                              all(getattr(cipher, '_EncryptedNumber__is_obfuscated')
+                                  for cipher in ciphers))
+
+    @classmethod
+    def concatenate(cls, arrays: list) -> 'PaillierCipherArray':
+        exponent = min(array.exponent for array in arrays)
+        values = np.concatenate([array._decrease_exponent_to(exponent).values
+                                 for array in arrays])
+        return cls(arrays[0].public_key, values, exponent,
+                   all(array.is_obfuscated for array in arrays))
+
+    @classmethod
+    def decode(cls, public_key, buffer, count: int, width: int,
+               exponent_buffer=None) -> 'PaillierCipherArray':
+        buffer = memoryview(buffer)
+        ints = [int.from_bytes(buffer[i * width:(i + 1) * width], 'big')
+                for i in range(count)]
+        if exponent_buffer:
+            exponents = np.frombuffer(exponent_buffer, dtype='>i4').tolist()
+        else:
+            exponents = [0] * count
+        return cls._from_ints(public_key, ints, exponents, False)
+
+    def encode(self, be_secure=True) -> Tuple[int, bytes, bytes]:
+        values = self.values
+        if be_secure and not self.is_obfuscated:
+            values = self._obfuscate().values
+        width = (self.public_key.nsquare.bit_length() + 7) // 8
+        buffer = b''.join(int(value).to_bytes(width, 'big') for value in values)
+        exponent_buffer = bytes()
+        if self.exponent != 0:
+            exponent_buffer = np.full(len(self), self.exponent, dtype='>i4').tobytes()
+        return width, buffer, exponent_buffer
+
+    def to_ciphers(self) -> list:
+        ciphers = []
+        for value in self.values:
+            cipher = EncryptedNumber(self.public_key, int(value), self.exponent)
+            if self.is_obfuscated:
+                setattr(cipher, '_EncryptedNumber__is_obfuscated', True)
+            ciphers.append(cipher)
+        return ciphers
+
+    def _obfuscate(self) -> 'PaillierCipherArray':
+        n, nsquare = self.public_key.n, self.public_key.nsquare
+        values = np.empty(len(self), dtype=object)
+        values[:] = [mulmod(int(value), powmod(self.public_key.get_random_lt_n(), n, nsquare), nsquare)
+                     for value in self.values]
+        return PaillierCipherArray(self.public_key, values, self.exponent, True)
+
+    def _raw_mul(self, value, plaintext: int):
+        # 同phe的raw_mul, 负数标量使用逆元
+        n, nsquare = self.public_key.n, self.public_key.nsquare
+        plaintext = plaintext % n
+        if plaintext >= n - self.public_key.max_int:
+            value = gmpy2.invert(value, nsquare) if IS_GMP else pow(int(value), -1, nsquare)
+            plaintext = n - plaintext
+        if IS_GMP:
+            return gmpy2.powmod(value, plaintext, nsquare)
+        return pow(value, plaintext, nsquare)
+
+    def _decrease_exponent_to(self, exponent: int) -> 'PaillierCipherArray':
+        if exponent == self.exponent:
+            return self
+        factor = pow(EncodedNumber.BASE, self.exponent - exponent)
+        values = np.empty(len(self), dtype=object)
+        values[:] = [self._raw_mul(value, factor) for value in self.values]
+        return PaillierCipherArray(self.public_key, values, exponent)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, index) -> 'PaillierCipherArray':
+        index = self._normalize_index(index)
+        return PaillierCipherArray(self.public_key, self.values[index],
+                                   self.exponent, self.is_obfuscated)
+
+    def __add__(self, other: 'PaillierCipherArray') -> 'PaillierCipherArray':
+        if self.public_key != other.public_key:
+            raise ValueError("Attempted to add numbers encrypted against "
+                             "different public keys!")
+        exponent = min(self.exponent, other.exponent)
+        a = self._decrease_exponent_to(exponent)
+        b = other._decrease_exponent_to(exponent)
+        values = a.values * b.values % self.public_key.nsquare
+        return PaillierCipherArray(self.public_key, values, exponent)
+
+    def __mul__(self, scalar: int) -> 'PaillierCipherArray':
+        encoding = EncodedNumber.encode(self.public_key, int(scalar))
+        values = np.empty(len(self), dtype=object)
+        values[:] = [self._raw_mul(value, encoding.encoding)
+                     for value in self.values]
+        return PaillierCipherArray(self.public_key, values,
+                                   self.exponent + encoding.exponent)
+
+    def segment_sum(self, group_ids: np.ndarray, group_num: int, order: np.ndarray = None) -> 'PaillierCipherArray':
+        group_ids = np.asarray(group_ids)
+        values = self.values
+        if group_ids.ndim == 2:
+            values = np.tile(values, group_ids.shape[0])
+            group_ids = group_ids.ravel()
+        # 排序后每个组是一段连续区间, 逐段累乘
+        if order is None:
+            order = np.argsort(group_ids, kind='stable')
+        bounds = np.searchsorted(group_ids[order], np.arange(group_num + 1))
+        values = values[order]
+        nsquare = self._to_mpz(self.public_key.nsquare)
+        result = np.empty(group_num, dtype=object)
+        for group in range(group_num):
+            # 空组为 r=1 的0的密文
+            acc = self._to_mpz(1)
+            for value in values[bounds[group]:bounds[group + 1]]:
+                acc = acc * value % nsquare
+            result[group] = acc
+        return PaillierCipherArray(self.public_key, result, self.exponent)
+
+    def matmul(self, matrix: np.ndarray) -> 'PaillierCipherArray':
+        nsquare = self._to_mpz(self.public_key.nsquare)
+        matrix = int64_matrix(matrix)
+        values = np.empty(matrix.shape[0], dtype=object)
+        values[:] = paillier_matmul(self.values, matrix, nsquare)
+        return PaillierCipherArray(self.public_key, values, self.exponent)
+
+    @property
+    def nbytes(self) -> int:
+        width = (self.public_key.nsquare.bit_length() + 7) // 8
+        return len(self) * width
+
+
+def signed_digits(matrix: np.ndarray) -> list:
+    """int64矩阵拆分为16bit有符号数字, matrix = sum_k digits[k] * 2^(16k)"""
+    rest = np.asarray(matrix, dtype=np.int64)
+    digits = []
+    half = 1 << (LIMB_BITS - 1)
+    while np.any(rest != 0):
+        digit = ((rest + half) & ((1 << LIMB_BITS) - 1)) - half
+        digits.append(digit)
+        rest = (rest - digit) >> LIMB_BITS
+    return digits
+
+
+def int64_matrix(matrix):
+    """转为int64矩阵, 稀疏矩阵转为CSR格式"""
+    if sparse.issparse(matrix):
+        return sparse.csr_matrix(matrix, dtype=np.int64)
+    return np.asarray(matrix, dtype=np.int64)
+
+
+def matrix_digits(matrix) -> list:
+    """稀疏矩阵只拆分非零元素, 每个数字矩阵保持原有的稀疏结构"""
+    if not sparse.issparse(matrix):
+        return signed_digits(matrix)
+    return [sparse.csr_matrix((digit, matrix.indices, matrix.indptr), shape=matrix.shape)
+            for digit in signed_digits(matrix.data)]
+
+
+def _power_product(values, coefficients, nsquare):
+    # prod c_j^a_j, a_j > 0: 系数从大到小排序, 相同系数的密文先相乘,
+    # 累积乘积依次乘以相邻系数的差值次幂, 每个不同的系数只做一次(较小指数的)模幂
+    result = PaillierCipherArray._to_mpz(1)
+    if len(coefficients) == 0:
+        return result
+    order = np.argsort(-coefficients, kind='stable')
+    coefficients = coefficients[order]
+    values = values[order]
+    ends = np.append(np.flatnonzero(np.diff(coefficients)) + 1, len(coefficients))
+    running = PaillierCipherArray._to_mpz(1)
+    start = 0
+    for end in ends:
+        for value in values[start:end]:
+            running = running * value % nsquare
+        next_coefficient = coefficients[end] if end < len(coefficients) else 0
+        exponent = int(coefficients[start] - next_coefficient)
+        result = result * (gmpy2.powmod(running, exponent, nsquare) if IS_GMP
+                           else pow(running, exponent, nsquare)) % nsquare
+        start = end
+    return result
+
+
+def paillier_dot(values: np.ndarray, row: np.ndarray, nsquare):
+    """Paillier密文向量与整数向量的内积 prod c_j^row_j mod n^2, 负系数部分求一次逆元"""
+    positive, negative = row > 0, row < 0
+    result = _power_product(values[positive], row[positive], nsquare)
+    if np.any(negative):
+        inverse = _power_product(values[negative], -row[negative], nsquare)
+        inverse = gmpy2.invert(inverse, nsquare) if IS_GMP else pow(int(inverse), -1, nsquare)
+        result = result * inverse % nsquare
+    return result
+
+
+def paillier_matmul(values: np.ndarray, matrix, nsquare) -> list:
+    """逐行计算内积, CSR矩阵只取每行的非零系数和对应密文"""
+    if not sparse.issparse(matrix):
+        return [paillier_dot(values, row, nsquare) for row in matrix]
+    return [paillier_dot(values[matrix.indices[start:end]], matrix.data[start:end], nsquare)
+            for start, end in zip(matrix.indptr[:-1], matrix.indptr[1:])]
+
+
+def encrypted_bincount(bin_ids: np.ndarray, ciphers, n_bins, order: np.ndarray = None):
+    """密文按分箱求和, 相当于以密文为权重的np.bincount
+
+    bin_ids为一维 (n,) 时返回长度为n_bins的CipherArray;
+    为二维 (row_num, n) 时每一行(如每个特征)对同一组密文独立分箱, n_bins为整数或每行的分箱数,
+    返回每行的CipherArray列表。没有样本的分箱为0的密文。
+    order为展开后的bin_ids按(行, 分箱)排序的下标, 可选, 见CipherArray.segment_sum。
+    """
+    array = CipherArray.from_ciphers(ciphers)
+    bin_ids = np.asarray(bin_ids, dtype=np.int64)
+    if bin_ids.ndim == 1:
+        return array.segment_sum(bin_ids, int(n_bins), order)
+
+    row_num = bin_ids.shape[0]
+    n_bins = np.broadcast_to(np.asarray(n_bins, dtype=np.int64), (row_num,))
+    offsets = np.concatenate([[0], np.cumsum(n_bins)])
+    hist_list = []
+    # 按行分块, 限制展开后的组号数组大小
+    chunk_rows = max(1, BINCOUNT_CHUNK_SIZE // max(1, len(array)))
+    for start in range(0, row_num, chunk_rows):
+        end = min(start + chunk_rows, row_num)
+        group_ids = bin_ids[start:end] + \
+            (offsets[start:end] - offsets[start])[:, np.newaxis]
+        chunk_order = None if order is None else \
+            order[start * len(array):end * len(array)] - start * len(array)
+        hist = array.segment_sum(group_ids, int(
+            offsets[end] - offsets[start]), chunk_order)
+        hist_list.extend([hist[offsets[i] - offsets[start]:offsets[i + 1] - offsets[start]]
+                          for i in range(start, end)])
+    return hist_list
@@ -0,0 +1,189 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+LIMB_BITS = 16
+LIMB_MASK = (1 << LIMB_BITS) - 1
+
+
+def limb_toeplitz(value: int, limb_num: int, cols: int = None) -> np.ndarray:
+    # T[k, j] = limb[k - j], 只保留低limb_num个limb, 即 mod 2^L 截断
+    cols = limb_num if cols is None else cols
+    limbs = [(value >> (LIMB_BITS * i)) & LIMB_MASK for i in range(limb_num)]
+    matrix = np.zeros((limb_num, cols), dtype=np.int64)
+    for k in range(limb_num):
+        for j in range(min(k + 1, cols)):
+            matrix[k, j] = limbs[k - j]
+    return matrix
+
+
+def carry_limbs(acc: np.ndarray, top_mask: int) -> np.ndarray:
+    # acc: (..., limb_num, n) 的int64累加结果, 允许为负数(算术右移即向下取整)
+    for k in range(acc.shape[-2] - 1):
+        acc[..., k + 1, :] += acc[..., k, :] >> LIMB_BITS
+    acc &= LIMB_MASK
+    acc[..., -1, :] &= top_mask
+    return acc.astype(np.uint16)
+
+
+def ints_to_limbs(values, key_length: int) -> np.ndarray:
+    """整数 mod 2^L 后按limb展开, 返回 (limb_num, n) 的uint16数组"""
+    limb_num = math.ceil(key_length / LIMB_BITS)
+    byte_num = limb_num * LIMB_BITS // 8
+    mask = (1 << key_length) - 1
+    buffer = b''.join((value & mask).to_bytes(byte_num, 'little')
+                      for value in values)
+    return np.frombuffer(buffer, dtype='<u2').reshape(-1, limb_num).T
+
+
+def limbs_to_ints(limbs: np.ndarray) -> list:
+    buffer = np.ascontiguousarray(limbs.T, dtype='<u2').tobytes()
+    step = limbs.shape[0] * LIMB_BITS // 8
+    return [int.from_bytes(buffer[i:i + step], 'little')
+            for i in range(0, len(buffer), step)]
+
+
+class IhcBatchEngine:
+    """IHC批量加解密引擎
+
+    IHC每一轮迭代 x_next = key * x_this - x_last (mod 2^L) 都是线性变换,
+    iter_round轮迭代可以合并为一个2x2的转移矩阵, 加密/解密只需要一次矩阵乘法。
+    大整数按16bit拆分为limb, 以 (limb_num, n) 的数组存储, 与常量系数的乘法转换为
+    int64的Toeplitz矩阵乘法, 再做一次进位, 结果与逐轮迭代的标量实现完全一致。
+    """
+
+    def __init__(self, key: int, key_length: int, iter_round: int, number_codec) -> None:
+        self.key = key
+        self.key_length = key_length
+        self.iter_round = iter_round
+        self.number_codec = number_codec
+        self.max_mod = 1 << key_length
+        self.limb_num = math.ceil(key_length / LIMB_BITS)
+        self.byte_num = self.limb_num * LIMB_BITS // 8
+        self.top_mask = (1 << (key_length - LIMB_BITS *
+                         (self.limb_num - 1))) - 1
+
+        # 加密: (c_left, c_right) = M^iter_round * (x, u)
+        self._enc_coeffs = self._transfer_matrix(iter_round)
+        self._enc_u_matrix = np.vstack([self._toeplitz(self._enc_coeffs[1]),
+                                        self._toeplitz(self._enc_coeffs[3])])
+        # 解密: x = M^(iter_round-1) * (c_right, c_left) 的第一项
+        a, b, _, _ = self._transfer_matrix(iter_round - 1)
+        self._dec_matrix = np.hstack([self._toeplitz(a), self._toeplitz(b)])
+
+    def _transfer_matrix(self, rounds):
+        # M = [[key, -1], [1, 0]], 返回 M^rounds mod 2^L
+        a, b, c, d = 1, 0, 0, 1
+        for _ in range(rounds):
+            a, b, c, d = (self.key * a - c) % self.max_mod, \
+                (self.key * b - d) % self.max_mod, a, b
+        return a, b, c, d
+
+    def _toeplitz(self, value: int, cols: int = None) -> np.ndarray:
+        return limb_toeplitz(value, self.limb_num, cols)
+
+    def _carry(self, acc: np.ndarray) -> np.ndarray:
+        return carry_limbs(acc, self.top_mask)
+
+    def random_limbs(self, n: int) -> np.ndarray:
+        limbs = np.frombuffer(os.urandom(self.byte_num * n), dtype='<u2')
+        limbs = limbs.reshape(self.limb_num, n).copy()
+        limbs[-1] &= self.top_mask
+        return limbs
+
+    def encode_limbs(self, numbers) -> np.ndarray:
+        """明文按有符号limb展开, 返回 (m, n) 的int64数组, 最高位limb带符号
+
+        明文通常远小于2^L, 只展开必要的m个limb, 可以减少矩阵乘法的计算量。
+        """
+        if isinstance(numbers, np.ndarray) and numbers.dtype.kind == 'i' and self.limb_num > 4:
+            values = numbers.astype(np.int64)
+            limbs = np.empty((4, len(values)), dtype=np.int64)
+            for k in range(3):
+                limbs[k] = (values >> (LIMB_BITS * k)) & LIMB_MASK
+            # 最高位limb使用算术右移保留符号
+            limbs[3] = values >> (LIMB_BITS * 3)
+            return limbs
+        values = [int(number) for number in numbers]
+        for value in values:
+            # 与标量加密一致的范围校验
+            self.number_codec.encode(value)
+        if len(values) == 0:
+            return np.zeros((1, 0), dtype=np.int64)
+        bits = max(abs(value).bit_length() for value in values) + 1
+        m = math.ceil(bits / LIMB_BITS)
+        if m >= self.limb_num:
+            return self.ints_to_limbs(values).astype(np.int64)
+        buffer = b''.join(value.to_bytes(m * LIMB_BITS // 8, 'little', signed=True)
+                          for value in values)
+        limbs = np.frombuffer(buffer, dtype='<u2').reshape(-1, m).T
+        limbs = limbs.astype(np.int64)
+        limbs[-1][limbs[-1] > (LIMB_MASK >> 1)] -= (1 << LIMB_BITS)
+        return limbs
+
+    def ints_to_limbs(self, values) -> np.ndarray:
+        return ints_to_limbs(values, self.key_length)
+
+    def limbs_to_ints(self, limbs: np.ndarray) -> list:
+        return limbs_to_ints(limbs)
+
+    def encrypt_limbs(self, x_limbs: np.ndarray, u_limbs: np.ndarray = None):
+        """返回 (c_left, c_right) 的limb数组"""
+        if u_limbs is None:
+            u_limbs = self.random_limbs(x_limbs.shape[1])
+        m = x_limbs.shape[0]
+        x_matrix = np.vstack([self._toeplitz(self._enc_coeffs[0], m),
+                              self._toeplitz(self._enc_coeffs[2], m)])
+        matrix = np.hstack([x_matrix, self._enc_u_matrix])
+        acc = np.dot(matrix, np.vstack([x_limbs, u_limbs]).astype(np.int64))
+        acc = self._carry(acc.reshape(2, self.limb_num, -1))
+        return acc[0], acc[1]
+
+    def decrypt_limbs(self, left_limbs: np.ndarray, right_limbs: np.ndarray) -> np.ndarray:
+        acc = np.dot(self._dec_matrix,
+                     np.vstack([right_limbs, left_limbs]).astype(np.int64))
+        return self._carry(acc)
+
+    def decode_limbs(self, limbs: np.ndarray) -> list:
+        """limb数组解码为有符号整数, 64位以内的结果直接向量化还原"""
+        if self.limb_num <= 4:
+            return [self.number_codec.decode(value) for value in self.limbs_to_ints(limbs)]
+        low = np.zeros(limbs.shape[1], dtype=np.uint64)
+        for k in range(4):
+            low |= limbs[k].astype(np.uint64) << np.uint64(LIMB_BITS * k)
+        low = low.view(np.int64)
+        high_ones = np.full((self.limb_num - 4, 1), LIMB_MASK, dtype=np.uint16)
+        high_ones[-1] = self.top_mask
+        fast = ((limbs[4:] == 0).all(axis=0) & (low >= 0)) | \
+            ((limbs[4:] == high_ones).all(axis=0) & (low < 0))
+        result = low.tolist()
+        slow_idx = np.flatnonzero(~fast)
+        if len(slow_idx) > 0:
+            values = self.limbs_to_ints(limbs[:, slow_idx])
+            for i, value in zip(slow_idx.tolist(), values):
+                result[i] = self.number_codec.decode(value)
+        return result
+
+    def encrypt(self, numbers):
+        """返回 (c_left列表, c_right列表)"""
+        left, right = self.encrypt_limbs(self.encode_limbs(numbers))
+        return self.limbs_to_ints(left), self.limbs_to_ints(right)
+
+    def decrypt(self, ciphers) -> list:
+        left = self.ints_to_limbs([cipher.c_left for cipher in ciphers])
+        right = self.ints_to_limbs([cipher.c_right for cipher in ciphers])
+        return self.decode_limbs(self.decrypt_limbs(left, right))
+
+    @staticmethod
+    def run_parallel(func, items, min_chunk_size=8192):
+        """按块切分多线程执行, numpy矩阵运算部分会释放GIL"""
+        num_cores = os.cpu_count() or 1
+        chunk_size = max(min_chunk_size, math.ceil(len(items) / num_cores))
+        if len(items) <= chunk_size:
+            return [func(items)]
+        chunks = [items[i:i + chunk_size]
+                  for i in range(0, len(items), chunk_size)]
+        with ThreadPoolExecutor(max_workers=num_cores) as executor:
+            return list(executor.map(func, chunks))
@@ -4,6 +4,7 @@ from dataclasses import dataclass
 
 import struct
 from ppc_common.ppc_crypto.phe_cipher import PheCipher
+from ppc_common.ppc_crypto.ihc_batch_engine import IhcBatchEngine
 import secrets
 
 
@@ -87,6 +88,8 @@ class IhcCipher(PheCipher):
 
         self.max_mod = 1 << key_length
         self.number_codec = NumberCodec(self.key_length)
+        self.batch_engine = IhcBatchEngine(
+            self.private_key, self.key_length, self.iter_round, self.number_codec)
 
     def encrypt(self, number: int) -> IhcCiphertext:
         random_u = secrets.randbits(self.key_length)
@@ -112,13 +115,17 @@ class IhcCipher(PheCipher):
         return result
 
     def encrypt_batch(self, numbers) -> list:
-        return [self.encrypt(num) for num in numbers]
+        c_left_list, c_right_list = self.batch_engine.encrypt(numbers)
+        return [IhcCiphertext(c_left, c_right, self.number_codec)
+                for c_left, c_right in zip(c_left_list, c_right_list)]
 
     def decrypt_batch(self, ciphers) -> list:
-        return [self.decrypt(cipher) for cipher in ciphers]
+        return self.batch_engine.decrypt(ciphers)
 
     def encrypt_batch_parallel(self, numbers: list) -> list:
-        return self.encrypt_batch(numbers)
+        result = IhcBatchEngine.run_parallel(self.encrypt_batch, numbers)
+        return [item for sublist in result for item in sublist]
 
     def decrypt_batch_parallel(self, ciphers: list) -> list:
-        return self.decrypt_batch(ciphers)
+        result = IhcBatchEngine.run_parallel(self.decrypt_batch, ciphers)
+        return [item for sublist in result for item in sublist]
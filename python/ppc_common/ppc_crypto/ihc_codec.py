@@ -1,6 +1,7 @@
 from typing import Tuple
 
-from ppc_common.ppc_crypto.ihc_cipher import IhcCiphertext
+from ppc_common.ppc_crypto.cipher_array import CipherArray, IhcCipherArray
+from ppc_common.ppc_crypto.ihc_cipher import IhcCiphertext, NumberCodec
 
 
 class IhcCodec:
@@ -27,3 +28,25 @@ class IhcCodec:
     @staticmethod
     def decode_cipher(enc_key, ciphertext: bytes, exponent) -> IhcCiphertext:
         return IhcCiphertext.decode(ciphertext)
+
+    @staticmethod
+    def encode_cipher_array(ciphers, be_secure=True) -> Tuple[int, bytes, bytes]:
+        """每个密文按 c_left|c_right 定长大端拼接, IHC没有指数"""
+        if isinstance(ciphers, CipherArray):
+            return ciphers.encode(be_secure)
+        values = [value for cipher in ciphers for value in (cipher.c_left, cipher.c_right)]
+        half_width = max([(value.bit_length() + 7) // 8 for value in values], default=0)
+        buffer = b''.join(value.to_bytes(half_width, 'big') for value in values)
+        return 2 * half_width, buffer, bytes()
+
+    @staticmethod
+    def decode_cipher_array(enc_key, buffer, count: int, width: int,
+                            exponent_buffer=None, key_length: int = 256, as_array=False):
+        if as_array:
+            return IhcCipherArray.decode(buffer, count, width, key_length)
+        buffer = memoryview(buffer)
+        half_width = width // 2
+        number_codec = NumberCodec(key_length)
+        return [IhcCiphertext(int.from_bytes(buffer[i * width:i * width + half_width], 'big'),
+                              int.from_bytes(buffer[i * width + half_width:(i + 1) * width], 'big'),
+                              number_codec) for i in range(count)]
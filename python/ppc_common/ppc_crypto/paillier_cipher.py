@@ -1,24 +1,119 @@
 import math
 import os
+import threading
 from concurrent.futures import ProcessPoolExecutor
 
-from phe import paillier, EncryptedNumber
+import numpy as np
+from phe import paillier, EncryptedNumber, EncodedNumber
 
+from ppc_common.ppc_crypto.cipher_array import PaillierCipherArray, paillier_matmul, int64_matrix
+from ppc_common.ppc_crypto.crypto_utils import powmod, mulmod
+from ppc_common.ppc_crypto.paillier_obfuscator import PaillierObfuscatorPool
 from ppc_common.ppc_crypto.phe_cipher import PheCipher
 
+# 进程池中每个worker持有的密钥, 由进程池的initializer安装一次
+_worker_public_key = None
+_worker_private_key = None
+
+
+def _init_worker(public_key_n, p=None, q=None):
+    global _worker_public_key, _worker_private_key
+    _worker_public_key = paillier.PaillierPublicKey(n=public_key_n)
+    _worker_private_key = None
+    if p is not None and q is not None:
+        _worker_private_key = paillier.PaillierPrivateKey(
+            _worker_public_key, p, q)
+
+
+def _crt_decrypt(private_key: paillier.PaillierPrivateKey, ciphertext: int, exponent: int):
+    # 分别在 mod p^2 和 mod q^2 下做模幂, 再用CRT合并, 模幂运算走gmpy2
+    p, q = private_key.p, private_key.q
+    m_p = mulmod((powmod(ciphertext, p - 1, private_key.psquare) - 1) // p,
+                 private_key.hp, p)
+    m_q = mulmod((powmod(ciphertext, q - 1, private_key.qsquare) - 1) // q,
+                 private_key.hq, q)
+    encoded = m_p + mulmod((m_q - m_p) % q, private_key.p_inverse, q) * p
+    return EncodedNumber(private_key.public_key, encoded, exponent).decode()
+
+
+def _encrypt_chunk(numbers):
+    result = []
+    for number in numbers:
+        cipher = _worker_public_key.encrypt(number)
+        result.append((cipher.ciphertext(be_secure=False), cipher.exponent))
+    return result
+
+
+def _decrypt_chunk(raw_ciphers):
+    return [_crt_decrypt(_worker_private_key, ciphertext, exponent)
+            for ciphertext, exponent in raw_ciphers]
+
+
+def _matmul_chunk(args):
+    # 密文可能属于对方的公钥, 模数随任务传入
+    values, rows, nsquare = args
+    return paillier_matmul(values, rows, nsquare)
+
 
 class PaillierCipher(PheCipher):
+    # 小于该规模的批量直接在当前进程计算
+    PARALLEL_MIN_SIZE = 1000
+    # 每个worker平均分到的任务块数
+    CHUNKS_PER_WORKER = 4
 
-    def __init__(self, key_length: int = 2048) -> None:
+    def __init__(self, key_length: int = 2048, max_workers: int = None,
+                 obfuscator_pool_size: int = 0) -> None:
         super().__init__(key_length)
         self.public_key, self.private_key = paillier.generate_paillier_keypair(
             n_length=self.key_length)
+        self.max_workers = max_workers or os.cpu_count()
+        # 预计算混淆因子的数量, 为0时不启用
+        self.obfuscator_pool_size = obfuscator_pool_size
+        self._obfuscator_pool = None
+        self._executor = None
+        self._executor_key = None
+        self._executor_lock = threading.Lock()
+        # 启用时在构造时开始预计算, 第一次加密前的空闲时间也用于填充
+        self._get_obfuscator_pool()
+
+    def __getstate__(self):
+        # 进程池不可序列化, 传给子进程时只保留密钥
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        state['_executor_key'] = None
+        state['_executor_lock'] = None
+        state['_obfuscator_pool'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._executor_lock = threading.Lock()
+
+    def _get_obfuscator_pool(self):
+        if self.obfuscator_pool_size <= 0:
+            return None
+        with self._executor_lock:
+            pool = self._obfuscator_pool
+            if pool is not None and pool.public_key != self.public_key:
+                pool.stop()
+                pool = None
+            if pool is None:
+                pool = PaillierObfuscatorPool(
+                    self.public_key, self.obfuscator_pool_size)
+                self._obfuscator_pool = pool
+            return pool
 
     def encrypt(self, number) -> EncryptedNumber:
+        pool = self._get_obfuscator_pool()
+        if pool is not None:
+            return pool.encrypt(int(number))
         return self.public_key.encrypt(int(number))
 
     def decrypt(self, cipher: EncryptedNumber) -> int:
-        return self.private_key.decrypt(cipher)
+        if cipher.public_key != self.private_key.public_key:
+            raise ValueError('encrypted_number was encrypted against a '
+                             'different key!')
+        return _crt_decrypt(self.private_key, cipher.ciphertext(be_secure=False), cipher.exponent)
 
     def encrypt_batch(self, numbers) -> list:
         return [self.encrypt(num) for num in numbers]
@@ -26,24 +121,96 @@ class PaillierCipher(PheCipher):
     def decrypt_batch(self, ciphers) -> list:
         return [self.decrypt(cipher) for cipher in ciphers]
 
+    def _key_fingerprint(self):
+        # 对方的公钥可能会替换self.public_key, 此时只安装公钥
+        if self.private_key is not None and self.private_key.public_key == self.public_key:
+            return self.public_key.n, self.private_key.p, self.private_key.q
+        return self.public_key.n, None, None
+
+    def _get_executor(self):
+        key = self._key_fingerprint()
+        with self._executor_lock:
+            if self._executor is not None and self._executor_key != key:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     initializer=_init_worker,
+                                                     initargs=key)
+                self._executor_key = key
+            return self._executor
+
+    def _map_chunks(self, func, items):
+        chunk_num = self.max_workers * self.CHUNKS_PER_WORKER
+        chunk_size = math.ceil(len(items) / chunk_num)
+        chunks = [items[i:i + chunk_size]
+                  for i in range(0, len(items), chunk_size)]
+        executor = self._get_executor()
+        return [item for sublist in executor.map(func, chunks) for item in sublist]
+
+    def _restore_cipher(self, ciphertext, exponent) -> EncryptedNumber:
+        cipher = EncryptedNumber(self.public_key, ciphertext, exponent)
+        # worker中已经完成混淆, 避免序列化时重复混淆
+        setattr(cipher, '_EncryptedNumber__is_obfuscated', True)
+        return cipher
+
     def encrypt_batch_parallel(self, numbers) -> list:
-        num_cores = os.cpu_count()
-        batch_size = math.ceil(len(numbers) / num_cores)
-        batches = [numbers[i:i + batch_size]
-                   for i in range(0, len(numbers), batch_size)]
-        with ProcessPoolExecutor(max_workers=num_cores) as executor:
-            futures = [executor.submit(self.encrypt_batch, batch)
-                       for batch in batches]
-            result = [future.result() for future in futures]
-        return [item for sublist in result for item in sublist]
+        if len(numbers) < self.PARALLEL_MIN_SIZE:
+            return self.encrypt_batch(numbers)
+        numbers = [int(num) for num in numbers]
+        result = []
+        pool = self._get_obfuscator_pool()
+        if pool is not None:
+            # 优先使用已经预计算好的混淆因子, 其余部分交给进程池
+            obfuscators = pool.take(len(numbers))
+            result = [pool.encrypt(num, obfuscator)
+                      for num, obfuscator in zip(numbers, obfuscators)]
+            numbers = numbers[len(obfuscators):]
+            pool.record_misses(len(numbers))
+        if len(numbers) == 0:
+            return result
+        raw_ciphers = self._map_chunks(_encrypt_chunk, numbers)
+        result.extend(self._restore_cipher(ciphertext, exponent)
+                      for ciphertext, exponent in raw_ciphers)
+        return result
 
     def decrypt_batch_parallel(self, ciphers) -> list:
-        num_cores = os.cpu_count()
-        batch_size = math.ceil(len(ciphers) / num_cores)
-        batches = [ciphers[i:i + batch_size]
-                   for i in range(0, len(ciphers), batch_size)]
-        with ProcessPoolExecutor(max_workers=num_cores) as executor:
-            futures = [executor.submit(self.decrypt_batch, batch)
-                       for batch in batches]
-            result = [future.result() for future in futures]
-        return [item for sublist in result for item in sublist]
+        if len(ciphers) < self.PARALLEL_MIN_SIZE:
+            return self.decrypt_batch(ciphers)
+        raw_ciphers = [(cipher.ciphertext(be_secure=False), cipher.exponent)
+                       for cipher in ciphers]
+        return self._map_chunks(_decrypt_chunk, raw_ciphers)
+
+    def matmul_parallel(self, matrix, array: PaillierCipherArray) -> PaillierCipherArray:
+        matrix = int64_matrix(matrix)
+        # 稀疏矩阵按非零元素个数计算规模
+        size = matrix.nnz if hasattr(matrix, 'nnz') else matrix.size
+        row_num = matrix.shape[0]
+        if size < self.PARALLEL_MIN_SIZE or row_num < 2:
+            return array.matmul(matrix)
+        # 按行分块, 每块携带一份密文向量
+        nsquare = PaillierCipherArray._to_mpz(array.public_key.nsquare)
+        chunk_size = math.ceil(row_num / self.max_workers)
+        tasks = [(array.values, matrix[i:i + chunk_size], nsquare)
+                 for i in range(0, row_num, chunk_size)]
+        executor = self._get_executor()
+        values = np.empty(row_num, dtype=object)
+        values[:] = [value for sublist in executor.map(_matmul_chunk, tasks)
+                     for value in sublist]
+        return PaillierCipherArray(array.public_key, values, array.exponent)
+
+    def metrics(self) -> dict:
+        pool = self._obfuscator_pool
+        if pool is None:
+            return {}
+        return {'obfuscator_pool': pool.metrics()}
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+                self._executor_key = None
+            if self._obfuscator_pool is not None:
+                self._obfuscator_pool.stop()
+                self._obfuscator_pool = None
@@ -1,7 +1,10 @@
 from typing import Tuple
 
+import numpy as np
 from phe import PaillierPublicKey, paillier, EncryptedNumber
 
+from ppc_common.ppc_crypto.cipher_array import CipherArray, PaillierCipherArray
+
 
 class PaillierCodec:
     @staticmethod
@@ -32,3 +35,32 @@ class PaillierCodec:
                                         PaillierCodec._bytes_to_int(
                                             ciphertext),
                                         PaillierCodec._bytes_to_int(exponent))
+
+    @staticmethod
+    def encode_cipher_array(ciphers, be_secure=True) -> Tuple[int, bytes, bytes]:
+        """密文按定长大端拼接, 返回 (每个密文的字节数, 密文buffer, 指数buffer)
+
+        指数全为0(整数明文)时指数buffer为空。
+        """
+        if isinstance(ciphers, CipherArray):
+            return ciphers.encode(be_secure)
+        values = [cipher.ciphertext(be_secure=be_secure) for cipher in ciphers]
+        width = max([(value.bit_length() + 7) // 8 for value in values], default=0)
+        buffer = b''.join(value.to_bytes(width, 'big') for value in values)
+        exponents = np.array([cipher.exponent for cipher in ciphers], dtype='>i4')
+        exponent_buffer = exponents.tobytes() if exponents.any() else bytes()
+        return width, buffer, exponent_buffer
+
+    @staticmethod
+    def decode_cipher_array(public_key: PaillierPublicKey, buffer, count: int,
+                            width: int, exponent_buffer=None, as_array=False):
+        if as_array:
+            return PaillierCipherArray.decode(public_key, buffer, count, width, exponent_buffer)
+        buffer = memoryview(buffer)
+        if exponent_buffer:
+            exponents = np.frombuffer(exponent_buffer, dtype='>i4').tolist()
+        else:
+            exponents = [0] * count
+        return [paillier.EncryptedNumber(public_key,
+                                         int.from_bytes(buffer[i * width:(i + 1) * width], 'big'),
+                                         exponents[i]) for i in range(count)]
@@ -0,0 +1,87 @@
+import queue
+import threading
+
+from phe import EncryptedNumber, PaillierPublicKey
+from phe.util import powmod, mulmod
+
+
+class PaillierObfuscatorPool:
+    """Paillier混淆因子预计算池
+
+    加密的主要开销是混淆因子 r^n mod n^2 的模幂运算。后台线程在空闲时(例如等待对方消息时)
+    预先计算混淆因子放入有界队列, 在线加密只需要一次模乘。队列为空时退化为现场计算。
+    """
+
+    def __init__(self, public_key: PaillierPublicKey, pool_size: int) -> None:
+        self.public_key = public_key
+        self.pool_size = pool_size
+        self.hits = 0
+        self.misses = 0
+        self._queue = queue.Queue(maxsize=pool_size)
+        self._stopped = threading.Event()
+        self._metrics_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _new_obfuscator(self) -> int:
+        r = self.public_key.get_random_lt_n()
+        return powmod(r, self.public_key.n, self.public_key.nsquare)
+
+    def _fill(self):
+        while not self._stopped.is_set():
+            obfuscator = self._new_obfuscator()
+            # 队列满时阻塞, 定期检查是否已停止
+            while not self._stopped.is_set():
+                try:
+                    self._queue.put(obfuscator, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+
+    def take(self, size: int) -> list:
+        """取出最多size个已经预计算好的混淆因子, 不阻塞"""
+        obfuscators = []
+        while len(obfuscators) < size:
+            try:
+                obfuscators.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._metrics_lock:
+            self.hits += len(obfuscators)
+        return obfuscators
+
+    def get(self) -> int:
+        obfuscators = self.take(1)
+        if obfuscators:
+            return obfuscators[0]
+        with self._metrics_lock:
+            self.misses += 1
+        return self._new_obfuscator()
+
+    def record_misses(self, size: int):
+        with self._metrics_lock:
+            self.misses += size
+
+    def encrypt(self, number, obfuscator: int = None) -> EncryptedNumber:
+        if obfuscator is None:
+            obfuscator = self.get()
+        # r_value=1 时phe只计算未混淆的密文
+        nude = self.public_key.encrypt(number, r_value=1)
+        ciphertext = mulmod(nude.ciphertext(be_secure=False),
+                            obfuscator, self.public_key.nsquare)
+        cipher = EncryptedNumber(self.public_key, ciphertext, nude.exponent)
+        setattr(cipher, '_EncryptedNumber__is_obfuscated', True)
+        return cipher
+
+    def metrics(self) -> dict:
+        with self._metrics_lock:
+            total = self.hits + self.misses
+            return {'pool_size': self.pool_size,
+                    'available': self._queue.qsize(),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / total if total > 0 else 0.0}
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
@@ -23,3 +23,26 @@ class PheCipher(ABC):
 
     def decrypt_batch_parallel(self, ciphers: list) -> list:
         pass
+
+    def decrypt_matrix(self, cipher_matrix: list) -> list:
+        # 二维密文(每行长度可以不同)展开后一次性并行解密, 再按行还原
+        sizes = [len(row) for row in cipher_matrix]
+        plains = self.decrypt_batch_parallel(
+            [cipher for row in cipher_matrix for cipher in row])
+        result = []
+        start = 0
+        for size in sizes:
+            result.append(plains[start:start + size])
+            start += size
+        return result
+
+    def matmul_parallel(self, matrix, array):
+        # 明文矩阵乘以密文向量(CipherArray), 默认直接调用向量化实现
+        return array.matmul(matrix)
+
+    def metrics(self) -> dict:
+        return {}
+
+    def shutdown(self):
+        # 释放加解密使用的进程池等资源
+        pass
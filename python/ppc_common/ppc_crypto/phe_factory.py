@@ -7,11 +7,11 @@ from ppc_common.ppc_crypto.paillier_codec import PaillierCodec
 class PheCipherFactory(object):
 
     @staticmethod
-    def build_phe(homo_algorithm=0, key_length=2048):
+    def build_phe(homo_algorithm=0, key_length=2048, obfuscator_pool_size=0):
         if homo_algorithm == 0:
             return IhcCipher()
         if homo_algorithm == 1:
-            return PaillierCipher(key_length)
+            return PaillierCipher(key_length, obfuscator_pool_size=obfuscator_pool_size)
         else:
             raise ValueError("Unsupported homo algorithm")
 
@@ -0,0 +1,77 @@
+import math
+
+from ppc_common.ppc_crypto.ihc_cipher import IhcCiphertext
+
+
+class SlotPackingCodec:
+    """明文槽位打包编码
+
+    一个明文按固定宽度的槽位存放多个有符号整数: packed = v_0 + v_1 * B + v_2 * B^2 + ...,
+    B = 2^slot_bits。槽位宽度由聚合结果的绝对值上界sum_bound决定, 槽位数由密钥的明文空间决定。
+    打包后的密文之间做同态加法、与同一个明文标量相乘, 各个槽位互不影响。
+    """
+    # 预留的明文空间位数, 保证打包结果落在 Paillier/IHC 的有符号编码范围内
+    RESERVED_BITS = 3
+
+    def __init__(self, key_length: int, sum_bound: int) -> None:
+        self.key_length = key_length
+        self.sum_bound = int(sum_bound)
+        # 槽位取值范围 [-B/2, B/2), 需要容纳 [-sum_bound, sum_bound]
+        self.slot_bits = (2 * self.sum_bound + 1).bit_length()
+        plaintext_bits = key_length - self.RESERVED_BITS
+        if self.slot_bits > plaintext_bits:
+            raise ValueError(f"The sum bound {sum_bound} out of range "
+                             f"for key length {key_length}")
+        self.slot_num = plaintext_bits // self.slot_bits
+        self.base = 1 << self.slot_bits
+
+    @staticmethod
+    def cipher_key_length(cipher) -> int:
+        if isinstance(cipher, IhcCiphertext):
+            return cipher.number_codec.key_length
+        return cipher.public_key.n.bit_length()
+
+    @classmethod
+    def from_cipher(cls, cipher, sum_bound: int):
+        return cls(cls.cipher_key_length(cipher), sum_bound)
+
+    def packed_size(self, size: int) -> int:
+        return math.ceil(size / self.slot_num)
+
+    def pack(self, values) -> list:
+        """明文整数打包, 第i个值放在第 i // slot_num 个明文的第 i % slot_num 个槽位"""
+        values = [int(value) for value in values]
+        packed = []
+        for start in range(0, len(values), self.slot_num):
+            number = 0
+            for value in reversed(values[start:start + self.slot_num]):
+                number = number * self.base + value
+            packed.append(number)
+        return packed
+
+    def pack_ciphers(self, ciphers) -> list:
+        """密文同态打包, 与对明文调用pack后再加密的结果解密一致"""
+        packed = []
+        for start in range(0, len(ciphers), self.slot_num):
+            group = ciphers[start:start + self.slot_num]
+            # Horner法则, 每一步只需要乘以较小的常数B
+            cipher = group[-1]
+            for item in reversed(group[:-1]):
+                cipher = cipher * self.base + item
+            packed.append(cipher)
+        return packed
+
+    def unpack(self, packed, size: int) -> list:
+        """拆解打包后的(聚合)明文, 返回前size个槽位的值"""
+        half = self.base >> 1
+        mask = self.base - 1
+        values = []
+        for number in packed:
+            number = int(number)
+            for _ in range(self.slot_num):
+                value = number & mask
+                if value >= half:
+                    value -= self.base
+                values.append(value)
+                number = (number - value) >> self.slot_bits
+        return values[:size]
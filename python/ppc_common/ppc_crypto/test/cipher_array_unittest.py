@@ -0,0 +1,196 @@
+import time
+import unittest
+
+import numpy as np
+from scipy import sparse
+
+from ppc_common.ppc_crypto import cipher_array
+from ppc_common.ppc_crypto.cipher_array import CipherArray, IhcCipherArray, PaillierCipherArray, \
+    encrypted_bincount
+from ppc_common.ppc_crypto.ihc_cipher import IhcCipher
+from ppc_common.ppc_crypto.ihc_codec import IhcCodec
+from ppc_common.ppc_crypto.paillier_cipher import PaillierCipher
+from ppc_common.ppc_crypto.paillier_codec import PaillierCodec
+
+
+class CipherArrayTest:
+    def __init__(self, ut, phe, codec, size):
+        self.ut = ut
+        self.phe = phe
+        self.codec = codec
+        self.inputs = np.random.randint(-10**6, 10**6, size=size)
+        self.ciphers = [phe.encrypt(int(value)) for value in self.inputs]
+        self.array = CipherArray.from_ciphers(self.ciphers)
+
+    def decrypt(self, array: CipherArray):
+        return self.phe.decrypt_batch(array.to_ciphers())
+
+    def test_ops(self):
+        ut, inputs, array = self.ut, self.inputs, self.array
+        ut.assertEqual(len(inputs), len(array))
+        ut.assertListEqual(list(inputs), self.decrypt(array))
+        ut.assertListEqual(list(inputs + inputs), self.decrypt(array + array))
+        ut.assertListEqual(list(inputs * -3), self.decrypt(array * -3))
+        ut.assertListEqual([int(inputs.sum())], self.decrypt(array.sum()))
+
+        # 索引和掩码选择
+        mask = inputs > 0
+        ut.assertListEqual(list(inputs[mask]), self.decrypt(array[mask]))
+        index = np.array([3, 0, 3, 1])
+        ut.assertListEqual(list(inputs[index]), self.decrypt(array[index]))
+        ut.assertListEqual([inputs[2]], self.decrypt(array[2]))
+        ut.assertListEqual(list(inputs[1:4]), self.decrypt(array[1:4]))
+
+        concat = CipherArray.concatenate([array[:2], array[2:]])
+        ut.assertListEqual(list(inputs), self.decrypt(concat))
+
+    def test_segment_sum(self):
+        ut, inputs, array = self.ut, self.inputs, self.array
+        group_num = 7
+        # 第6组没有样本
+        group_ids = np.random.randint(0, group_num - 1, size=len(inputs))
+        expected = [int(inputs[group_ids == g].sum()) for g in range(group_num)]
+        ut.assertListEqual(expected, self.decrypt(
+            array.segment_sum(group_ids, group_num)))
+        # 组内顺序不影响结果
+        order = np.lexsort((-np.arange(len(inputs)), group_ids))
+        ut.assertListEqual(expected, self.decrypt(
+            array.segment_sum(group_ids, group_num, order)))
+
+    def test_matmul(self):
+        ut, inputs, array = self.ut, self.inputs, self.array
+        # 包含负数、重复值、大系数和全零行
+        matrix = np.random.randint(-3, 4, size=(6, len(inputs)))
+        matrix[1] = np.random.randint(-2**40, 2**40, size=len(inputs))
+        matrix[2] = 0
+        matrix[3, ::2] = 7
+        expected = [sum(int(a) * int(b) for a, b in zip(row, inputs)) for row in matrix]
+        ut.assertListEqual(expected, self.decrypt(array.matmul(matrix)))
+        ut.assertListEqual(expected, self.decrypt(self.phe.matmul_parallel(matrix, array)))
+
+        # 稀疏矩阵只计算非零系数, 结果与稠密矩阵一致
+        matrix[:, np.random.rand(len(inputs)) < 0.8] = 0
+        expected = [sum(int(a) * int(b) for a, b in zip(row, inputs)) for row in matrix]
+        ut.assertListEqual(expected, self.decrypt(array.matmul(sparse.csr_matrix(matrix))))
+        ut.assertListEqual(expected, self.decrypt(
+            self.phe.matmul_parallel(sparse.csc_matrix(matrix), array)))
+
+    def test_bincount(self):
+        ut, inputs = self.ut, self.inputs
+        n_bins = [3, 1, 5, 4]
+        bin_ids = np.array([np.random.randint(0, max(1, k - 1), size=len(inputs))
+                            for k in n_bins])
+        expected = [[int(inputs[bin_ids[i] == b].sum()) for b in range(k)]
+                    for i, k in enumerate(n_bins)]
+        hist = encrypted_bincount(bin_ids, self.ciphers, n_bins)
+        ut.assertListEqual(expected, [self.decrypt(row) for row in hist])
+        ut.assertListEqual(expected[2], self.decrypt(
+            encrypted_bincount(bin_ids[2], self.array, n_bins[2])))
+
+        # 按行分块时结果不变
+        chunk_size = cipher_array.BINCOUNT_CHUNK_SIZE
+        cipher_array.BINCOUNT_CHUNK_SIZE = len(inputs) * 3
+        try:
+            hist = encrypted_bincount(bin_ids, self.array, n_bins)
+        finally:
+            cipher_array.BINCOUNT_CHUNK_SIZE = chunk_size
+        ut.assertListEqual(expected, [self.decrypt(row) for row in hist])
+
+    def test_wire(self, be_secure):
+        width, buffer, exponent_buffer = self.codec.encode_cipher_array(
+            self.array, be_secure=be_secure)
+        decoded = self.codec.decode_cipher_array(self.phe.public_key, buffer, len(self.array),
+                                                 width, exponent_buffer, as_array=True)
+        self.ut.assertListEqual(list(self.inputs), self.decrypt(decoded))
+        # 与对象列表的编码格式一致
+        ciphers = self.codec.decode_cipher_array(self.phe.public_key, buffer, len(self.array),
+                                                 width, exponent_buffer)
+        self.ut.assertListEqual(list(self.inputs), self.phe.decrypt_batch(ciphers))
+
+
+class IhcCipherArrayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.phe = IhcCipher()
+        self.test = CipherArrayTest(self, self.phe, IhcCodec, 1000)
+
+    def test_ops(self):
+        self.assertIsInstance(self.test.array, IhcCipherArray)
+        self.test.test_ops()
+
+    def test_segment_sum(self):
+        self.test.test_segment_sum()
+
+    def test_matmul(self):
+        self.test.test_matmul()
+
+    def test_bincount(self):
+        self.test.test_bincount()
+
+    def test_wire(self):
+        self.test.test_wire(True)
+        # 同态运算后未取模的密文
+        cipher = self.test.ciphers[0] + self.test.ciphers[1]
+        width, buffer, _ = IhcCodec.encode_cipher_array([cipher])
+        decoded = IhcCodec.decode_cipher_array(None, buffer, 1, width, as_array=True)
+        self.assertListEqual([int(self.test.inputs[0] + self.test.inputs[1])],
+                             self.test.decrypt(decoded))
+
+    def test_segment_sum_performance(self):
+        inputs = np.random.randint(-10**6, 10**6, size=200000)
+        ciphers = self.phe.encrypt_batch(inputs)
+        array = CipherArray.from_ciphers(ciphers)
+        bins = np.random.randint(0, 32, size=len(inputs))
+
+        start_time = time.time()
+        hist = array.segment_sum(bins, 32)
+        print("segment_sum:", time.time() - start_time, "seconds")
+
+        objects = np.array(ciphers)
+        start_time = time.time()
+        expected = [objects[bins == v].sum() for v in range(32)]
+        print("object sum:", time.time() - start_time, "seconds")
+        self.assertListEqual(self.phe.decrypt_batch(expected),
+                             self.test.phe.decrypt_batch(hist.to_ciphers()))
+        print("nbytes:", array.nbytes, "vs", len(IhcCodec.encode_cipher_array(ciphers)[1]))
+
+
+class PaillierCipherArrayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.phe = PaillierCipher(key_length=512)
+        self.test = CipherArrayTest(self, self.phe, PaillierCodec, 50)
+
+    def test_ops(self):
+        self.assertIsInstance(self.test.array, PaillierCipherArray)
+        self.test.test_ops()
+
+    def test_segment_sum(self):
+        self.test.test_segment_sum()
+
+    def test_matmul(self):
+        self.test.test_matmul()
+        # 按行分块交给进程池
+        self.phe.PARALLEL_MIN_SIZE = 0
+        try:
+            self.test.test_matmul()
+        finally:
+            self.phe.shutdown()
+
+    def test_bincount(self):
+        self.test.test_bincount()
+
+    def test_wire(self):
+        self.test.test_wire(True)
+        self.test.test_wire(False)
+
+    def test_mixed_exponent(self):
+        inputs = [0.5, -1.25, 3]
+        array = CipherArray.from_ciphers(
+            [self.phe.public_key.encrypt(value) for value in inputs])
+        self.assertListEqual(inputs, self.phe.decrypt_batch(array.to_ciphers()))
+        self.assertListEqual([2.25], self.phe.decrypt_batch(array.sum().to_ciphers()))
+
+
+if __name__ == '__main__':
+    unittest.main()
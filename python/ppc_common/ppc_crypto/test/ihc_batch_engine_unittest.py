@@ -0,0 +1,80 @@
+import unittest
+
+import numpy as np
+
+from ppc_common.ppc_crypto.ihc_cipher import IhcCipher, IhcCiphertext
+
+
+def scalar_encrypt(ihc: IhcCipher, number: int, random_u: int):
+    x_this = ihc.number_codec.encode(number)
+    x_last = random_u
+    for _ in range(ihc.iter_round):
+        x_tmp = (ihc.private_key * x_this - x_last) % ihc.max_mod
+        x_last = x_this
+        x_this = x_tmp
+    return x_this, x_last
+
+
+class IhcBatchEngineTest(unittest.TestCase):
+
+    def _check_bit_identical(self, ihc: IhcCipher, numbers):
+        engine = ihc.batch_engine
+        u_limbs = engine.random_limbs(len(numbers))
+        left, right = engine.encrypt_limbs(
+            engine.encode_limbs(numbers), u_limbs)
+        left = engine.limbs_to_ints(left)
+        right = engine.limbs_to_ints(right)
+        for i, (number, random_u) in enumerate(zip(numbers, engine.limbs_to_ints(u_limbs))):
+            self.assertEqual(scalar_encrypt(ihc, int(number), random_u),
+                             (left[i], right[i]))
+
+    def test_bit_identical_with_scalar(self):
+        for key_length in [256, 1024, 250]:
+            ihc = IhcCipher(key_length=key_length)
+            self._check_bit_identical(
+                ihc, np.random.randint(-10**9, 10**9, size=1000))
+            self._check_bit_identical(
+                ihc, np.array([0, 1, -1, 2**63 - 1, -2**63], dtype=np.int64))
+            # packing_gh 产生的大整数
+            self._check_bit_identical(
+                ihc, np.array([429496329600000000000000002000, -(2**90), 7], dtype=object))
+
+    def test_batch_decrypt(self):
+        ihc = IhcCipher(key_length=256)
+        inputs = np.random.randint(-10**6, 10**6, size=5000)
+        ciphers = ihc.encrypt_batch(inputs)
+        self.assertListEqual(list(inputs), ihc.decrypt_batch(ciphers))
+        self.assertListEqual([ihc.decrypt(cipher) for cipher in ciphers],
+                             ihc.decrypt_batch_parallel(ciphers))
+
+        scalar_ciphers = [ihc.encrypt(int(num)) for num in inputs[:100]]
+        self.assertListEqual(list(inputs[:100]), ihc.decrypt_batch(scalar_ciphers))
+
+        # 同态运算后的密文不再小于 2^L
+        mixed = [ciphers[i] + scalar_ciphers[i] for i in range(100)]
+        mixed.append(ciphers[0] * -3)
+        expected = [2 * int(num) for num in inputs[:100]] + [-3 * int(inputs[0])]
+        self.assertListEqual(expected, ihc.decrypt_batch(mixed))
+
+    def test_batch_decrypt_big_values(self):
+        ihc = IhcCipher(key_length=256)
+        inputs = [2**100, -(2**100), 2**63, -(2**63) - 1, 0]
+        ciphers = ihc.encrypt_batch(np.array(inputs, dtype=object))
+        self.assertListEqual(inputs, ihc.decrypt_batch(ciphers))
+        self.assertIsInstance(ihc.decrypt_batch(ciphers)[0], int)
+
+    def test_out_of_range(self):
+        ihc = IhcCipher(key_length=256)
+        with self.assertRaises(Exception):
+            ihc.encrypt_batch([ihc.number_codec.non_negative_range + 1])
+
+    def test_parallel_order(self):
+        ihc = IhcCipher(key_length=256)
+        inputs = np.arange(-20000, 20000)
+        ciphers = ihc.encrypt_batch_parallel(inputs)
+        self.assertTrue(isinstance(ciphers[0], IhcCiphertext))
+        self.assertListEqual(list(inputs), ihc.decrypt_batch_parallel(ciphers))
+
+
+if __name__ == '__main__':
+    unittest.main()
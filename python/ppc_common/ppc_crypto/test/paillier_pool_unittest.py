@@ -0,0 +1,137 @@
+import pickle
+import time
+import unittest
+
+import numpy as np
+from phe import paillier
+
+from ppc_common.ppc_crypto.paillier_cipher import PaillierCipher
+
+
+class PaillierPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.paillier = PaillierCipher(key_length=512, max_workers=2)
+        self.paillier.PARALLEL_MIN_SIZE = 16
+
+    def tearDown(self):
+        self.paillier.shutdown()
+
+    def test_pool_reused(self):
+        inputs = np.random.randint(-10**6, 10**6, size=200)
+        ciphers = self.paillier.encrypt_batch_parallel(inputs)
+        executor = self.paillier._executor
+        self.assertListEqual(list(inputs),
+                             self.paillier.decrypt_batch_parallel(ciphers))
+        self.assertIs(executor, self.paillier._executor)
+        # worker中已完成混淆, 序列化时不再重复混淆
+        cipher = ciphers[0]
+        self.assertEqual(cipher.ciphertext(), cipher.ciphertext())
+
+    def test_key_changed(self):
+        self.paillier.encrypt_batch_parallel(list(range(32)))
+        executor = self.paillier._executor
+        partner = PaillierCipher(key_length=512)
+        self.paillier.public_key = partner.public_key
+        ciphers = self.paillier.encrypt_batch_parallel(list(range(32)))
+        self.assertIsNot(executor, self.paillier._executor)
+        self.assertListEqual(list(range(32)), partner.decrypt_batch(ciphers))
+
+    def test_pickle_without_pool(self):
+        self.paillier.encrypt_batch_parallel(list(range(32)))
+        restored = pickle.loads(pickle.dumps(self.paillier))
+        self.assertIsNone(restored._executor)
+        cipher = restored.encrypt(7)
+        self.assertEqual(7, self.paillier.decrypt(cipher))
+        self.assertIsInstance(cipher, paillier.EncryptedNumber)
+
+    def test_shutdown(self):
+        self.paillier.encrypt_batch_parallel(list(range(32)))
+        self.paillier.shutdown()
+        self.assertIsNone(self.paillier._executor)
+        self.assertEqual(3, self.paillier.decrypt_batch_parallel(
+            self.paillier.encrypt_batch_parallel([3] * 32))[0])
+
+
+class PaillierObfuscatorPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.paillier = PaillierCipher(key_length=512, max_workers=2,
+                                       obfuscator_pool_size=64)
+        self.paillier.PARALLEL_MIN_SIZE = 16
+
+    def tearDown(self):
+        self.paillier.shutdown()
+
+    def _wait_pool_full(self):
+        pool = self.paillier._get_obfuscator_pool()
+        while pool.metrics()['available'] < pool.pool_size:
+            time.sleep(0.01)
+        return pool
+
+    def test_start_on_construction(self):
+        self.assertIsNotNone(self.paillier._obfuscator_pool)
+        self.assertIsNone(PaillierCipher(key_length=512)._obfuscator_pool)
+
+    def test_hits_and_misses(self):
+        pool = self._wait_pool_full()
+        # 停止后台填充, 命中数只取决于池中已有的混淆因子
+        pool.stop()
+        inputs = np.random.randint(-10**6, 10**6, size=100)
+        ciphers = self.paillier.encrypt_batch_parallel(inputs)
+        self.assertListEqual(list(inputs), self.paillier.decrypt_batch(ciphers))
+        metrics = self.paillier.metrics()['obfuscator_pool']
+        self.assertEqual(64, metrics['hits'])
+        self.assertEqual(36, metrics['misses'])
+        # 混淆因子不重复使用
+        self.assertEqual(100, len(set(cipher.ciphertext() for cipher in ciphers)))
+        self.assertIs(pool, self.paillier._obfuscator_pool)
+
+    def test_serial_encrypt(self):
+        self._wait_pool_full()
+        cipher = self.paillier.encrypt(-42)
+        self.assertEqual(-42, self.paillier.decrypt(cipher))
+        self.assertEqual(-84, self.paillier.decrypt(cipher + cipher))
+        self.assertEqual(1, self.paillier.metrics()['obfuscator_pool']['hits'])
+
+    def test_key_changed(self):
+        pool = self.paillier._get_obfuscator_pool()
+        partner = PaillierCipher(key_length=512)
+        self.paillier.public_key = partner.public_key
+        cipher = self.paillier.encrypt(5)
+        self.assertIsNot(pool, self.paillier._obfuscator_pool)
+        self.assertEqual(5, partner.decrypt(cipher))
+
+
+class PaillierDecryptMatrixTest(unittest.TestCase):
+
+    def setUp(self):
+        self.paillier = PaillierCipher(key_length=512, max_workers=2)
+        self.paillier.PARALLEL_MIN_SIZE = 16
+
+    def tearDown(self):
+        self.paillier.shutdown()
+
+    def test_crt_decrypt(self):
+        inputs = [0, 1, -1, 2**100, -(2**100), 0.5, -3.25]
+        for value in inputs:
+            cipher = self.paillier.public_key.encrypt(value)
+            self.assertEqual(self.paillier.private_key.decrypt(cipher),
+                             self.paillier.decrypt(cipher))
+        with self.assertRaises(ValueError):
+            self.paillier.decrypt(PaillierCipher(key_length=512).encrypt(1))
+
+    def test_decrypt_matrix(self):
+        matrix = [list(np.random.randint(-10**6, 10**6, size=size)) for size in [5, 0, 17, 30]]
+        cipher_matrix = [self.paillier.encrypt_batch(row) for row in matrix]
+        # 同态求和后的密文
+        cipher_matrix[0] = [cipher + cipher for cipher in cipher_matrix[0]]
+        matrix[0] = [2 * value for value in matrix[0]]
+        result = self.paillier.decrypt_matrix(cipher_matrix)
+        self.assertEqual(len(matrix), len(result))
+        for expected, row in zip(matrix, result):
+            self.assertListEqual(list(expected), list(row))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from ppc_common.ppc_crypto.ihc_cipher import IhcCipher
+from ppc_common.ppc_crypto.paillier_cipher import PaillierCipher
+from ppc_common.ppc_crypto.slot_packing_codec import SlotPackingCodec
+
+
+class SlotPackingCodecTest(unittest.TestCase):
+
+    def test_pack_and_unpack(self):
+        codec = SlotPackingCodec(key_length=256, sum_bound=1000)
+        self.assertEqual(11, codec.slot_bits)
+        self.assertEqual(23, codec.slot_num)
+        values = list(np.random.randint(-1000, 1001, size=100))
+        packed = codec.pack(values)
+        self.assertEqual(codec.packed_size(100), len(packed))
+        self.assertListEqual(values, codec.unpack(packed, len(values)))
+        self.assertListEqual([1000, -1000, 0],
+                             codec.unpack(codec.pack([1000, -1000, 0]), 3))
+
+    def test_aggregate_packed(self):
+        codec = SlotPackingCodec(key_length=256, sum_bound=10 * 200)
+        rows = np.random.randint(-200, 201, size=(10, 50))
+        packed_sum = np.array([codec.pack(row) for row in rows],
+                              dtype=object).sum(axis=0)
+        self.assertListEqual(list(rows.sum(axis=0)),
+                             codec.unpack(packed_sum, rows.shape[1]))
+
+    def test_out_of_range(self):
+        with self.assertRaises(ValueError):
+            SlotPackingCodec(key_length=256, sum_bound=2**254)
+
+    def _check_pack_ciphers(self, phe, encrypt_batch):
+        values = list(np.random.randint(-10**6, 10**6, size=37))
+        ciphers = encrypt_batch(values)
+        # 同态运算: 乘以明文标量后求和
+        ciphers = [cipher * 3 + cipher for cipher in ciphers]
+        codec = SlotPackingCodec.from_cipher(ciphers[0], 4 * 10**6)
+        packed = codec.pack_ciphers(ciphers)
+        self.assertEqual(codec.packed_size(len(values)), len(packed))
+        self.assertListEqual([4 * value for value in values],
+                             codec.unpack(phe.decrypt_batch(packed), len(values)))
+
+    def test_pack_ihc_ciphers(self):
+        ihc = IhcCipher(key_length=256)
+        self._check_pack_ciphers(ihc, ihc.encrypt_batch)
+
+    def test_pack_paillier_ciphers(self):
+        paillier = PaillierCipher(key_length=512)
+        self._check_pack_ciphers(
+            paillier, lambda values: [paillier.encrypt(value) for value in values])
+        self.assertEqual(512, SlotPackingCodec.cipher_key_length(
+            paillier.encrypt(1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
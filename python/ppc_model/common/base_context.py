@@ -24,6 +24,7 @@ class BaseContext:
 
     MODEL_FILE = "model.kpl"
     MODEL_ENC_FILE = "model_enc.kpl"
+    MODEL_FEATURE_FILE = "model_feature.npy"
 
     def __init__(self, job_id: str, job_temp_dir: str, user: str):
         self.job_id = job_id
@@ -82,6 +83,8 @@ class BaseContext:
             self.workspace, self.FEATURE_BIN_FILE)
         self.model_data_file = os.path.join(
             self.workspace, self.MODEL_DATA_FILE)
+        self.model_feature_file = os.path.join(
+            self.workspace, self.MODEL_FEATURE_FILE)
         self.test_model_result_file = os.path.join(
             self.workspace, self.TEST_MODEL_RESULT_FILE)
         self.test_model_output_file = os.path.join(
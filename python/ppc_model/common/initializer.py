@@ -30,6 +30,7 @@ class Initializer:
         self.mock_logger = None
         self.public_key_length = 2048
         self.homo_algorithm = 0
+        self.obfuscator_pool_size = 0
         self.init_config()
         self.job_cache_dir = common_func.get_config_value(
             "JOB_TEMP_DIR", "/tmp", self.config_data, False)
@@ -71,6 +72,8 @@ class Initializer:
                 "STORAGE_TYPE", "HDFS", self.config_data, False)
             if 'HOMO_ALGORITHM' in self.config_data:
                 self.homo_algorithm = self.config_data['HOMO_ALGORITHM']
+            if 'OBFUSCATOR_POOL_SIZE' in self.config_data:
+                self.obfuscator_pool_size = self.config_data['OBFUSCATOR_POOL_SIZE']
 
     def init_all(self):
         agency_id = common_func.get_config_value(
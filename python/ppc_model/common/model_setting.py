@@ -65,6 +65,10 @@ class CommonModelSetting:
             self.random_state = int(random_state_str)
         self.n_jobs = int(common_func.get_config_value(
             "n_jobs", 0, model_dict, False))
+        self.compact_dataset = common_func.get_config_value(
+            "compact_dataset", False, model_dict, False)
+        self.dataset_mmap = common_func.get_config_value(
+            "dataset_mmap", False, model_dict, False)
 
 
 class SecureLGBMSetting(CommonModelSetting):
@@ -78,6 +82,8 @@ class SecureLGBMSetting(CommonModelSetting):
             "max_depth", 3, model_dict, False))
         self.max_bin = int(common_func.get_config_value(
             "max_bin", 4, model_dict, False))
+        self.quantile_sketch = common_func.get_config_value(
+            "quantile_sketch", False, model_dict, False)
 
         self.subsample = float(common_func.get_config_value(
             "subsample", 1, model_dict, False))
@@ -105,6 +111,8 @@ class SecureLGBMSetting(CommonModelSetting):
             "threads", 8, model_dict, False))
         self.one_hot = common_func.get_config_value(
             "one_hot", 0, model_dict, False)
+        self.level_wise = common_func.get_config_value(
+            "level_wise", False, model_dict, False)
 
 
 class SecureLRSetting(CommonModelSetting):
@@ -116,6 +124,18 @@ class SecureLRSetting(CommonModelSetting):
             "batch_size", 16, model_dict, False))
         self.epochs = int(common_func.get_config_value(
             "epochs", 3, model_dict, False))
+        self.sparse_features = common_func.get_config_value(
+            "sparse_features", False, model_dict, False)
+        self.optimizer = common_func.get_config_value(
+            "optimizer", "sgd", model_dict, False)
+        self.max_iter = int(common_func.get_config_value(
+            "max_iter", 20, model_dict, False))
+        self.tol = float(common_func.get_config_value(
+            "tol", 1e-3, model_dict, False))
+        self.lbfgs_memory = int(common_func.get_config_value(
+            "lbfgs_memory", 10, model_dict, False))
+        self.shuffle = common_func.get_config_value(
+            "shuffle", False, model_dict, False)
 
 
 class ModelSetting(PreprocessingSetting, FeatureEngineeringEngineSetting, SecureLGBMSetting, SecureLRSetting):
@@ -1,5 +1,9 @@
+import struct
 from enum import Enum
 
+import numpy as np
+
+from ppc_common.ppc_crypto.cipher_array import CipherArray
 from ppc_common.ppc_protos.generated.ppc_model_pb2 import Cipher1DimList, Cipher2DimList
 from ppc_common.ppc_protos.generated.ppc_model_pb2 import CipherList, ModelCipher
 from ppc_common.ppc_utils import utils
@@ -34,9 +38,98 @@ class RpcType(Enum):
 
 
 class PheMessage:
+    # 定长二进制格式: header | 公钥 | 维度信息 | 定长大端密文buffer | 指数buffer(可选)
+    # 旧格式为protobuf, 首字节不会是0xff, 据此兼容解析旧格式
+    FLAT_MAGIC = b'\xffPHE'
+    FLAT_VERSION = 1
+    _FLAT_HEADER = struct.Struct('>4sBBBII')
+
+    @staticmethod
+    def _packing_flat_data(codec, public_key, cipher_list, row_sizes, be_secure):
+        width, buffer, exponent_buffer = codec.encode_cipher_array(
+            cipher_list, be_secure=be_secure)
+        key_bytes = codec.encode_enc_key(public_key)
+        dim = 1 if row_sizes is None else 2
+        header = PheMessage._FLAT_HEADER.pack(PheMessage.FLAT_MAGIC, PheMessage.FLAT_VERSION, dim,
+                                              int(len(exponent_buffer) > 0), len(key_bytes), width)
+        if row_sizes is None:
+            shape = struct.pack('>I', len(cipher_list))
+        else:
+            shape = struct.pack(f'>I{len(row_sizes)}I',
+                                len(row_sizes), *row_sizes)
+        return b''.join([header, key_bytes, shape, buffer, exponent_buffer])
+
+    @staticmethod
+    def _unpacking_flat_data(codec, data, as_array=False):
+        data = memoryview(data)
+        _, version, dim, has_exponent, key_len, width = \
+            PheMessage._FLAT_HEADER.unpack_from(data)
+        if version != PheMessage.FLAT_VERSION:
+            raise ValueError(f"Unsupported phe message version: {version}")
+        offset = PheMessage._FLAT_HEADER.size
+        public_key = codec.decode_enc_key(bytes(data[offset:offset + key_len]))
+        offset += key_len
+        (size,) = struct.unpack_from('>I', data, offset)
+        offset += 4
+        row_sizes = None
+        if dim == 2:
+            row_sizes = struct.unpack_from(f'>{size}I', data, offset)
+            offset += 4 * size
+            size = sum(row_sizes)
+        buffer = data[offset:offset + size * width]
+        offset += size * width
+        exponent_buffer = data[offset:offset + 4 * size] if has_exponent else None
+        enc_data = codec.decode_cipher_array(
+            public_key, buffer, size, width, exponent_buffer, as_array=as_array)
+        return public_key, enc_data, row_sizes
+
+    @staticmethod
+    def _is_flat_data(data):
+        return bytes(data[:len(PheMessage.FLAT_MAGIC)]) == PheMessage.FLAT_MAGIC
 
     @staticmethod
     def packing_data(codec, public_key, cipher_list):
+        if not isinstance(cipher_list, CipherArray):
+            cipher_list = list(cipher_list)
+        return PheMessage._packing_flat_data(codec, public_key, cipher_list, None, True)
+
+    @staticmethod
+    def unpacking_data(codec, data, as_array=False):
+        """as_array为True时返回CipherArray"""
+        if PheMessage._is_flat_data(data):
+            public_key, enc_data, _ = PheMessage._unpacking_flat_data(
+                codec, data, as_array)
+            return public_key, enc_data
+        public_key, enc_data = PheMessage.unpacking_legacy_data(codec, data)
+        if as_array and len(enc_data) > 0:
+            enc_data = CipherArray.from_ciphers(enc_data)
+        return public_key, enc_data
+
+    @staticmethod
+    def packing_2dim_data(codec, public_key, cipher_2d_list):
+        row_sizes = [len(cipher_list) for cipher_list in cipher_2d_list]
+        if len(cipher_2d_list) > 0 and isinstance(cipher_2d_list[0], CipherArray):
+            flat_list = CipherArray.concatenate(cipher_2d_list)
+        else:
+            flat_list = [
+                cipher for cipher_list in cipher_2d_list for cipher in cipher_list]
+        return PheMessage._packing_flat_data(codec, public_key, flat_list, row_sizes, False)
+
+    @staticmethod
+    def unpacking_2dim_data(codec, data):
+        if not PheMessage._is_flat_data(data):
+            return PheMessage.unpacking_legacy_2dim_data(codec, data)
+        public_key, flat_data, row_sizes = PheMessage._unpacking_flat_data(
+            codec, data)
+        enc_data = []
+        start = 0
+        for row_size in row_sizes:
+            enc_data.append(flat_data[start:start + row_size])
+            start += row_size
+        return public_key, enc_data
+
+    @staticmethod
+    def packing_legacy_data(codec, public_key, cipher_list):
         enc_data_pb = CipherList()
         enc_data_pb.public_key = codec.encode_enc_key(public_key)
 
@@ -49,7 +142,7 @@ class PheMessage:
         return utils.pb_to_bytes(enc_data_pb)
 
     @staticmethod
-    def unpacking_data(codec, data):
+    def unpacking_legacy_data(codec, data):
         enc_data_pb = CipherList()
         utils.bytes_to_pb(enc_data_pb, data)
         public_key = codec.decode_enc_key(enc_data_pb.public_key)
@@ -60,7 +153,7 @@ class PheMessage:
         return public_key, enc_data
 
     @staticmethod
-    def packing_2dim_data(codec, public_key, cipher_2d_list):
+    def packing_legacy_2dim_data(codec, public_key, cipher_2d_list):
         enc_data_pb = Cipher2DimList()
         enc_data_pb.public_key = codec.encode_enc_key(public_key)
 
@@ -76,7 +169,7 @@ class PheMessage:
         return utils.pb_to_bytes(enc_data_pb)
 
     @staticmethod
-    def unpacking_2dim_data(codec, data):
+    def unpacking_legacy_2dim_data(codec, data):
         enc_data_pb = Cipher2DimList()
         utils.bytes_to_pb(enc_data_pb, data)
         public_key = codec.decode_enc_key(enc_data_pb.public_key)
@@ -90,5 +183,120 @@ class PheMessage:
         return public_key, enc_data
 
 
+class MaskMessage:
+    """布尔掩码和样本下标的压缩编码, 按数据分布选择编码后最短的格式
+
+    格式: header(编码类型, 长度) | payload
+    掩码可选packbits、True(或False)位置的差分varint、交替游程长度的varint;
+    下标可选差分后zigzag的varint, 严格递增时也可以作为 [0, max] 上的掩码编码。
+    """
+    PACKBITS = 0
+    DELTA = 1
+    DELTA_INVERTED = 2
+    RUN_LENGTH = 3
+    INDEX_DELTA = 4
+    INDEX_MASK = 5
+    _HEADER = struct.Struct('>BQ')
+
+    @staticmethod
+    def _encode_varint(values):
+        # 每个值按7位一组从低到高输出, 除最后一组外最高位为1
+        values = np.asarray(values, dtype=np.uint64)
+        if len(values) == 0:
+            return bytes()
+        byte_num = np.ones(len(values), dtype=np.int64)
+        rest = values >> np.uint64(7)
+        while rest.any():
+            byte_num += rest > 0
+            rest >>= np.uint64(7)
+        positions = np.arange(byte_num.max())
+        groups = ((values[:, np.newaxis] >> (positions.astype(np.uint64) * np.uint64(7)))
+                  & np.uint64(0x7f)).astype(np.uint8)
+        groups[positions < byte_num[:, np.newaxis] - 1] |= 0x80
+        return groups[positions < byte_num[:, np.newaxis]].tobytes()
+
+    @staticmethod
+    def _decode_varint(data):
+        data = np.frombuffer(data, dtype=np.uint8)
+        if len(data) == 0:
+            return np.empty(0, dtype=np.uint64)
+        ends = np.flatnonzero(data < 0x80)
+        starts = np.concatenate([[0], ends[:-1] + 1])
+        positions = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+        groups = (data & 0x7f).astype(np.uint64) << (positions.astype(np.uint64) * np.uint64(7))
+        return np.add.reduceat(groups, starts)
+
+    @staticmethod
+    def encode_mask(mask) -> bytes:
+        mask = np.asarray(mask, dtype=bool)
+        n = len(mask)
+        candidates = [(MaskMessage.PACKBITS, np.packbits(mask).tobytes())]
+        # 稀疏时记录较少一方的位置, 每个位置至少1字节, 不少于n/8个时不必尝试
+        true_num = int(np.count_nonzero(mask))
+        if min(true_num, n - true_num) < n / 8:
+            if 2 * true_num <= n:
+                encoding, positions = MaskMessage.DELTA, np.flatnonzero(mask)
+            else:
+                encoding, positions = MaskMessage.DELTA_INVERTED, np.flatnonzero(~mask)
+            candidates.append((encoding, MaskMessage._encode_varint(
+                np.diff(positions, prepend=0))))
+        # 游程编码: 从False开始交替的游程长度
+        changes = np.flatnonzero(mask[1:] != mask[:-1]) + 1
+        if len(changes) < n / 8:
+            runs = np.diff(np.concatenate([[0], changes, [n]]))
+            if n > 0 and mask[0]:
+                runs = np.concatenate([[0], runs])
+            candidates.append(
+                (MaskMessage.RUN_LENGTH, MaskMessage._encode_varint(runs)))
+        encoding, payload = min(candidates, key=lambda item: len(item[1]))
+        return MaskMessage._HEADER.pack(encoding, n) + payload
+
+    @staticmethod
+    def decode_mask(data) -> np.ndarray:
+        encoding, n = MaskMessage._HEADER.unpack_from(data)
+        payload = memoryview(data)[MaskMessage._HEADER.size:]
+        if encoding == MaskMessage.PACKBITS:
+            return np.unpackbits(np.frombuffer(payload, dtype=np.uint8), count=n).view(bool)
+        if encoding in (MaskMessage.DELTA, MaskMessage.DELTA_INVERTED):
+            positions = np.cumsum(MaskMessage._decode_varint(payload)).astype(np.int64)
+            is_delta = encoding == MaskMessage.DELTA
+            mask = np.full(n, not is_delta)
+            mask[positions] = is_delta
+            return mask
+        if encoding == MaskMessage.RUN_LENGTH:
+            runs = MaskMessage._decode_varint(payload).astype(np.int64)
+            return np.repeat(np.arange(len(runs)) % 2 == 1, runs)
+        raise ValueError(f"Unsupported mask encoding: {encoding}")
+
+    @staticmethod
+    def encode_index(index) -> bytes:
+        index = np.asarray(index, dtype=np.int64)
+        deltas = np.diff(index, prepend=0)
+        candidates = [(MaskMessage.INDEX_DELTA, MaskMessage._encode_varint(
+            (deltas << 1) ^ (deltas >> 63)))]
+        # 下标范围过大时掩码不会更短
+        if len(index) > 0 and index[0] >= 0 and np.all(deltas[1:] > 0) and \
+                index[-1] < 64 * len(index):
+            mask = np.zeros(index[-1] + 1, dtype=bool)
+            mask[index] = True
+            candidates.append(
+                (MaskMessage.INDEX_MASK, MaskMessage.encode_mask(mask)))
+        encoding, payload = min(candidates, key=lambda item: len(item[1]))
+        return MaskMessage._HEADER.pack(encoding, len(index)) + payload
+
+    @staticmethod
+    def decode_index(data) -> np.ndarray:
+        encoding, n = MaskMessage._HEADER.unpack_from(data)
+        payload = memoryview(data)[MaskMessage._HEADER.size:]
+        if encoding == MaskMessage.INDEX_MASK:
+            return np.flatnonzero(MaskMessage.decode_mask(payload)).astype(np.int64)
+        if encoding == MaskMessage.INDEX_DELTA:
+            zigzag = MaskMessage._decode_varint(payload)
+            deltas = (zigzag >> np.uint64(1)).astype(np.int64) ^ - \
+                (zigzag & np.uint64(1)).astype(np.int64)
+            return np.cumsum(deltas)
+        raise ValueError(f"Unsupported index encoding: {encoding}")
+
+
 LOG_START_FLAG_FORMATTER = "$$$StartModelJob:{job_id}"
 LOG_END_FLAG_FORMATTER = "$$$EndModelJob:{job_id}"
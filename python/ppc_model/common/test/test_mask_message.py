@@ -0,0 +1,64 @@
+import unittest
+
+import numpy as np
+
+from ppc_model.common.protocol import MaskMessage
+
+
+class TestMaskMessage(unittest.TestCase):
+
+    def _check_mask(self, mask, encoding=None):
+        data = MaskMessage.encode_mask(mask)
+        decoded = MaskMessage.decode_mask(data)
+        self.assertEqual(bool, decoded.dtype)
+        self.assertTrue(np.array_equal(mask, decoded))
+        if encoding is not None:
+            self.assertEqual(encoding, data[0])
+        return data
+
+    def _check_index(self, index, encoding=None):
+        data = MaskMessage.encode_index(index)
+        decoded = MaskMessage.decode_index(data)
+        self.assertEqual(np.int64, decoded.dtype)
+        self.assertTrue(np.array_equal(index, decoded))
+        if encoding is not None:
+            self.assertEqual(encoding, data[0])
+        return data
+
+    def test_varint(self):
+        values = [0, 1, 127, 128, 300, 2**63]
+        data = MaskMessage._encode_varint(values)
+        self.assertEqual('00017f8001ac02' + '80' * 9 + '01', data.hex())
+        self.assertListEqual(values, MaskMessage._decode_varint(data).tolist())
+
+    def test_mask(self):
+        for n in [0, 1, 7, 8, 9, 1000]:
+            for rate in [0, 0.01, 0.5, 0.99, 1]:
+                self._check_mask(np.random.rand(n) < rate)
+
+        n = 100000
+        self._check_mask(np.random.rand(n) < 0.5, MaskMessage.PACKBITS)
+        self._check_mask(np.random.rand(n) < 0.01, MaskMessage.DELTA)
+        self._check_mask(np.random.rand(n) < 0.99, MaskMessage.DELTA_INVERTED)
+        mask = np.zeros(n, dtype=bool)
+        mask[n // 3:n // 2] = True
+        data = self._check_mask(mask, MaskMessage.RUN_LENGTH)
+        self.assertLess(len(data), 20)
+
+    def test_index(self):
+        for n in [0, 1, 1000]:
+            self._check_index(np.arange(n))
+            self._check_index(np.random.permutation(n))
+            self._check_index(np.random.randint(-2**40, 2**40, size=n))
+
+        n = 100000
+        data = self._check_index(np.arange(n), MaskMessage.INDEX_MASK)
+        self.assertLess(len(data), 30)
+        # 抽样后的有序下标按掩码编码
+        self._check_index(np.sort(np.random.choice(n, n // 2, replace=False)),
+                          MaskMessage.INDEX_MASK)
+        self._check_index(np.random.permutation(n), MaskMessage.INDEX_DELTA)
+
+
+if __name__ == '__main__':
+    unittest.main()
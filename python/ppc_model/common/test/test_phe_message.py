@@ -0,0 +1,85 @@
+import time
+import unittest
+
+import numpy as np
+
+from ppc_common.ppc_crypto.ihc_cipher import IhcCipher
+from ppc_common.ppc_crypto.ihc_codec import IhcCodec
+from ppc_common.ppc_crypto.paillier_cipher import PaillierCipher
+from ppc_common.ppc_crypto.paillier_codec import PaillierCodec
+from ppc_model.common.protocol import PheMessage
+
+
+class TestPheMessage(unittest.TestCase):
+
+    def _check_roundtrip(self, phe, codec, ciphers, expected, legacy=True):
+        data = PheMessage.packing_data(codec, phe.public_key, ciphers)
+        self.assertTrue(data.startswith(PheMessage.FLAT_MAGIC))
+        _, enc_data = PheMessage.unpacking_data(codec, data)
+        self.assertListEqual(expected, phe.decrypt_batch(enc_data))
+
+        cipher_2d_list = [ciphers[:3], [], ciphers[3:]]
+        data = PheMessage.packing_2dim_data(
+            codec, phe.public_key, cipher_2d_list)
+        _, enc_data = PheMessage.unpacking_2dim_data(codec, data)
+        self.assertListEqual([3, 0, len(ciphers) - 3],
+                             [len(row) for row in enc_data])
+        self.assertListEqual(expected, [value for row in enc_data
+                                        for value in phe.decrypt_batch(row)])
+
+        if not legacy:
+            return
+        # 兼容旧的protobuf格式
+        data = PheMessage.packing_legacy_data(codec, phe.public_key, ciphers)
+        _, enc_data = PheMessage.unpacking_data(codec, data)
+        self.assertListEqual(expected, phe.decrypt_batch(enc_data))
+        data = PheMessage.packing_legacy_2dim_data(
+            codec, phe.public_key, cipher_2d_list)
+        _, enc_data = PheMessage.unpacking_2dim_data(codec, data)
+        self.assertListEqual(expected[:3], phe.decrypt_batch(enc_data[0]))
+
+    def test_ihc_message(self):
+        phe = IhcCipher()
+        inputs = list(np.random.randint(-10**6, 10**6, size=100))
+        ciphers = phe.encrypt_batch(inputs)
+        # 同态运算后密文宽度不一致
+        ciphers[0] = ciphers[0] + ciphers[0]
+        inputs[0] = 2 * inputs[0]
+        self._check_roundtrip(phe, IhcCodec, ciphers, inputs)
+
+    def test_paillier_message(self):
+        phe = PaillierCipher(key_length=512)
+        inputs = list(np.random.randint(-10**6, 10**6, size=20))
+        ciphers = [phe.encrypt(value) for value in inputs]
+        self._check_roundtrip(phe, PaillierCodec, ciphers, inputs)
+
+        # 浮点数明文的指数不为0, 旧格式不支持负指数
+        inputs = [0.5, -1.25, 3]
+        ciphers = [phe.public_key.encrypt(value) for value in inputs] * 2
+        self._check_roundtrip(phe, PaillierCodec, ciphers, inputs * 2, legacy=False)
+
+    def test_empty_message(self):
+        phe = IhcCipher()
+        _, enc_data = PheMessage.unpacking_data(
+            IhcCodec, PheMessage.packing_data(IhcCodec, phe.public_key, []))
+        self.assertListEqual([], enc_data)
+
+    def test_ihc_message_size(self):
+        phe = IhcCipher()
+        ciphers = phe.encrypt_batch(np.random.randint(0, 10**6, size=100000))
+        start_time = time.time()
+        data = PheMessage.packing_data(IhcCodec, phe.public_key, ciphers)
+        _, enc_data = PheMessage.unpacking_data(IhcCodec, data)
+        print("flat:", time.time() - start_time, "seconds,", len(data), "bytes")
+        start_time = time.time()
+        legacy_data = PheMessage.packing_legacy_data(
+            IhcCodec, phe.public_key, ciphers)
+        PheMessage.unpacking_data(IhcCodec, legacy_data)
+        print("legacy:", time.time() - start_time,
+              "seconds,", len(legacy_data), "bytes")
+        self.assertLess(len(data), len(legacy_data))
+        self.assertEqual(ciphers[-1], enc_data[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import numpy as np
+from scipy import sparse
+
+
+class MiniBatch:
+    """按batch_size依次取样本, 第i个批次从第 i * batch_size 个位置开始, 可以跨越epoch边界
+
+    不打乱时每个epoch按原顺序取样本, 不跨越边界的批次是原数组的切片视图;
+    打乱时每个epoch的样本顺序由共享的种子和epoch编号确定, 各参与方得到相同的排列。
+    需要按下标取样本时写入复用的缓冲区, 迭代过程中不再分配批次数组。
+    """
+
+    def __init__(self, n: int, batch_size: int, shuffle: bool = False, seed: int = None):
+        self.n = n
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = 0 if seed is None else seed
+        self._orders = {}
+        self._buffers = []
+
+    def _order(self, epoch: int) -> np.ndarray:
+        if epoch not in self._orders:
+            # 只保留相邻的两个epoch
+            self._orders = {key: value for key, value in self._orders.items() if key == epoch - 1}
+            self._orders[epoch] = np.random.default_rng(
+                [self.seed, epoch]).permutation(self.n)
+        return self._orders[epoch]
+
+    def batch_index(self, i: int):
+        """第i个批次的样本位置, 返回slice或下标数组"""
+        start = i * self.batch_size
+        epoch, offset = divmod(start, self.n)
+        if offset + self.batch_size <= self.n:
+            if not self.shuffle:
+                return slice(offset, offset + self.batch_size)
+            return self._order(epoch)[offset:offset + self.batch_size]
+        epochs, offsets = np.divmod(np.arange(start, start + self.batch_size), self.n)
+        if not self.shuffle:
+            return offsets
+        return np.concatenate([self._order(epoch)[offsets[epochs == epoch]]
+                               for epoch in np.unique(epochs)])
+
+    def _buffer(self, k, shape, dtype):
+        if k == len(self._buffers):
+            self._buffers.append(None)
+        buffer = self._buffers[k]
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[k] = buffer
+        return buffer
+
+    def take(self, index, *arrays) -> list:
+        """按batch_index的结果取出各数组的批次, 下标数组的结果在下一次take时会被覆盖"""
+        if isinstance(index, slice):
+            return [array[index] for array in arrays]
+        result = []
+        for k, array in enumerate(arrays):
+            if sparse.issparse(array):
+                result.append(array[index])
+                continue
+            buffer = self._buffer(k, (len(index),) + array.shape[1:], array.dtype)
+            np.take(array, index, axis=0, out=buffer)
+            result.append(buffer)
+        return result
@@ -0,0 +1,66 @@
+import unittest
+
+import numpy as np
+from scipy import sparse
+
+from ppc_model.datasets.data_reduction.mini_batch import MiniBatch
+
+
+def sample_idx(i, n, size):
+    # 原先按位置循环取样本的方式
+    start_idx = (i * size) % n
+    end_idx = start_idx + size
+    if end_idx <= n:
+        return list(range(start_idx, end_idx))
+    return list(range(start_idx, n)) + list(range(end_idx - n))
+
+
+class TestMiniBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.X = np.random.rand(103, 4)
+        self.y = np.random.randint(0, 2, 103)
+
+    def test_sequential(self):
+        mini_batch = MiniBatch(103, 16)
+        for i in range(30):
+            index = mini_batch.batch_index(i)
+            x_, y_ = mini_batch.take(index, self.X, self.y)
+            self.assertTrue(np.array_equal(self.X[sample_idx(i, 103, 16)], x_))
+            self.assertTrue(np.array_equal(self.y[sample_idx(i, 103, 16)], y_))
+            if isinstance(index, slice):
+                self.assertIs(self.X, x_.base)
+
+    def test_shuffle(self):
+        mini_batch = MiniBatch(96, 16, shuffle=True, seed=7)
+        other = MiniBatch(96, 16, shuffle=True, seed=7)
+        epochs = []
+        for epoch in range(3):
+            index = np.concatenate([mini_batch.batch_index(i) for i in range(epoch * 6, epoch * 6 + 6)])
+            self.assertListEqual(list(range(96)), sorted(index))
+            self.assertListEqual(list(index), list(np.concatenate(
+                [other.batch_index(i) for i in range(epoch * 6, epoch * 6 + 6)])))
+            epochs.append(index)
+        self.assertFalse(np.array_equal(epochs[0], epochs[1]))
+
+        # 跨越epoch边界的批次由前一个epoch的末尾和后一个epoch的开头组成
+        mini_batch = MiniBatch(100, 16, shuffle=True, seed=7)
+        index = mini_batch.batch_index(6)
+        self.assertListEqual(list(mini_batch._order(0)[96:]) + list(mini_batch._order(1)[:12]),
+                             list(index))
+
+    def test_take_buffer(self):
+        mini_batch = MiniBatch(103, 16, shuffle=True)
+        x_, y_ = mini_batch.take(mini_batch.batch_index(0), self.X, self.y)
+        index = mini_batch.batch_index(1)
+        x_next, y_next = mini_batch.take(index, self.X, self.y)
+        self.assertIs(x_, x_next)
+        self.assertIs(y_, y_next)
+        self.assertTrue(np.array_equal(self.X[index], x_next))
+
+        x_sparse, = mini_batch.take(index, sparse.csr_matrix(self.X))
+        self.assertTrue(np.array_equal(self.X[index], x_sparse.toarray()))
+
+
+if __name__ == '__main__':
+    unittest.main()
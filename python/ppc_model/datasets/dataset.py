@@ -1,6 +1,7 @@
 import os
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.model_selection import train_test_split
 
 from ppc_common.ppc_utils.exception import PpcException, PpcErrorCode
@@ -24,6 +25,10 @@ class SecureDataset:
         self.eval_set_column = ctx.model_params.eval_set_column
         self.train_set_value = ctx.model_params.train_set_value
         self.eval_set_value = ctx.model_params.eval_set_value
+        self.compact_dataset = ctx.model_params.compact_dataset
+        self.dataset_mmap = ctx.model_params.dataset_mmap
+        # 仅LR支持稀疏特征
+        self.sparse_features = ctx.model_params.sparse_features
 
         self.ctx = ctx
         self.train_X = None
@@ -114,7 +119,26 @@ class SecureDataset:
 
         return train_data, test_data
 
+    def _random_split_position(self):
+        # 与 _random_split_dataset 的划分相同, 只返回样本位置
+        train_pos, test_pos = train_test_split(
+            np.arange(len(self.model_data)), test_size=self.test_size, random_state=self.random_state)
+
+        return train_pos, test_pos
+
     def _customized_split_dataset(self):
+        train_mask, test_mask = self._customized_split_mask()
+        train_data = self.model_data[train_mask]
+        test_data = self.model_data[test_mask]
+
+        return train_data, test_data
+
+    def _customized_split_position(self):
+        train_mask, test_mask = self._customized_split_mask()
+
+        return np.flatnonzero(train_mask.values), np.flatnonzero(test_mask.values)
+
+    def _customized_split_mask(self):
         if self.ctx.role == TaskRole.ACTIVE_PARTY:
             for partner_index in range(1, len(self.ctx.participant_id_list)):
                 byte_data = SendMessage._receive_byte_data(self.ctx.model_router, self.ctx,
@@ -142,12 +166,10 @@ class SecureDataset:
                     f.write(byte_data)
 
         eval_set_df = pd.read_csv(self.eval_column_file, header=0)
-        train_data = self.model_data[eval_set_df[self.eval_set_column]
-                                     == self.train_set_value]
-        test_data = self.model_data[eval_set_df[self.eval_set_column]
-                                    == self.eval_set_value]
+        train_mask = eval_set_df[self.eval_set_column] == self.train_set_value
+        test_mask = eval_set_df[self.eval_set_column] == self.eval_set_value
 
-        return train_data, test_data
+        return train_mask, test_mask
 
     def _construct_model_dataset(self, train_data, test_data):
 
@@ -178,6 +200,86 @@ class SecureDataset:
             self.test_X = test_data.drop(columns=['id']).values
             self.feature_name = test_data.drop(columns=['id']).columns.tolist()
 
+    @staticmethod
+    def _compact_dtype(columns):
+        """所有特征列共用的最窄无损类型
+
+        没有缺失值的整数列取能容纳取值范围的最小整型, 否则 float32 无损时取 float32,
+        有非数值列时返回 None。
+        """
+        is_integer, is_float32 = True, True
+        value_min, value_max = 0, 0
+        for values in columns:
+            if values.dtype == bool:
+                values = values.astype(np.int8)
+            if not np.issubdtype(values.dtype, np.number):
+                return None
+            if len(values) == 0:
+                continue
+            if is_integer and (np.issubdtype(values.dtype, np.integer) or
+                               (np.all(np.isfinite(values)) and np.array_equal(values, np.round(values)))):
+                value_min = min(value_min, values.min())
+                value_max = max(value_max, values.max())
+            else:
+                is_integer = False
+            if is_float32:
+                as_float32 = values.astype(np.float32)
+                is_float32 = bool(np.all((as_float32 == values) |
+                                         (np.isnan(as_float32) & np.isnan(values))))
+        if is_integer:
+            for dtype in [np.int8, np.int16, np.int32]:
+                if np.iinfo(dtype).min <= value_min and value_max <= np.iinfo(dtype).max:
+                    return np.dtype(dtype)
+            return np.dtype(np.int64)
+        return np.dtype(np.float32) if is_float32 else np.dtype(np.float64)
+
+    def _compact_features(self, feature_name, positions):
+        """把 positions 位置的样本按列写入一个列优先数组, 可选写入npy文件并以内存映射读取"""
+        dtype = self._compact_dtype(
+            [self.model_data[column].values for column in feature_name])
+        if dtype is None:
+            return self.model_data[feature_name].values[positions]
+        shape = (len(positions), len(feature_name))
+        if self.dataset_mmap:
+            X = np.lib.format.open_memmap(self.ctx.model_feature_file, mode='w+',
+                                          dtype=dtype, shape=shape, fortran_order=True)
+        else:
+            X = np.empty(shape, dtype=dtype, order='F')
+        for j, column in enumerate(feature_name):
+            X[:, j] = self.model_data[column].values[positions]
+        if self.dataset_mmap:
+            X.flush()
+            del X
+            X = np.load(self.ctx.model_feature_file, mmap_mode='r')
+        return X
+
+    def _construct_compact_dataset(self, train_pos, test_pos):
+        """训练集和验证集连续存放在同一个数组中, train_X/test_X 为切片视图, 构造后释放原始数据"""
+        drop_columns = ['id', 'y'] if self.is_label_holder and 'y' in self.model_data.columns else ['id']
+        self.feature_name = [column for column in self.model_data.columns
+                             if column not in drop_columns]
+        if train_pos is not None:
+            self.train_idx = self.model_data['id'].values[train_pos]
+        self.test_idx = self.model_data['id'].values[test_pos]
+        if 'y' in drop_columns:
+            if train_pos is not None:
+                self.train_y = self.model_data['y'].values[train_pos]
+            self.test_y = self.model_data['y'].values[test_pos]
+
+        train_num = 0 if train_pos is None else len(train_pos)
+        positions = test_pos if train_pos is None else np.concatenate([train_pos, test_pos])
+        X = self._compact_features(self.feature_name, positions)
+        if train_pos is not None:
+            self.train_X = X[:train_num]
+        self.test_X = X[train_num:]
+        self.model_data = None
+
+    def _construct_sparse_dataset(self):
+        """特征转为CSR稀疏矩阵, 适用于独热编码后以0为主的宽表"""
+        if self.train_X is not None:
+            self.train_X = sparse.csr_matrix(self.train_X)
+        self.test_X = sparse.csr_matrix(self.test_X)
+
     def _dataset_fe_selected(self, file_path, feature_name):
         iv_selected = pd.read_csv(file_path, header=0)
         selected_list = iv_selected[feature_name][iv_selected['iv_selected'] == 1].tolist(
@@ -232,7 +334,18 @@ class SecureDataset:
                                       'id']).sort_values(by='id', ascending=True)
             self.model_data = pd.concat([dataset_id, self.model_data], axis=1)
 
-        if self.algorithm_type == AlgorithmType.Train.name:
+        if self.algorithm_type == AlgorithmType.Train.name and self.compact_dataset:
+            if self.eval_set_column:
+                train_pos, test_pos = self._customized_split_position()
+            else:
+                train_pos, test_pos = self._random_split_position()
+            self._construct_compact_dataset(train_pos, test_pos)
+
+        elif self.algorithm_type == AlgorithmType.Predict.name and self.compact_dataset:
+            self._construct_compact_dataset(
+                None, np.arange(len(self.model_data)))
+
+        elif self.algorithm_type == AlgorithmType.Train.name:
             if self.eval_set_column:
                 train_data, test_data = self._customized_split_dataset()
             else:
@@ -245,3 +358,6 @@ class SecureDataset:
         else:
             raise PpcException(PpcErrorCode.ALGORITHM_TYPE_ERROR.get_code(),
                                PpcErrorCode.ALGORITHM_TYPE_ERROR.get_message())
+
+        if self.sparse_features:
+            self._construct_sparse_dataset()
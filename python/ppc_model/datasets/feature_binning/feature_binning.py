@@ -1,11 +1,19 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
 
 from ppc_common.ppc_utils.utils import AlgorithmType
 from ppc_model.common.context import Context
+from ppc_model.datasets.feature_binning.quantile_sketch import QuantileSketch
 
 
 class FeatureBinning:
+    # 分位数草图分箱时每次读取的样本行数
+    CHUNK_SIZE = 65536
+    MAX_UNIQUE_NUM = 1000
+
     def __init__(self, ctx: Context):
         self.ctx = ctx
         self.params = ctx.model_params
@@ -62,13 +70,18 @@ class FeatureBinning:
 
         return Xk_bin, Xk_split
 
-    def data_binning(self, data: np.ndarray, data_split=None):
-
+    def data_binning(self, data, data_split=None):
+        """data 为特征数组或npy文件路径, 文件以内存映射方式打开"""
+        if isinstance(data, str):
+            data = np.load(data, mmap_mode='r')
         self.data = data
         self.data_split = data_split
 
         if self.ctx.algorithm_type == AlgorithmType.Train.name and self.data_split is None:
-            self._generate_data_binning()
+            if self.params.quantile_sketch:
+                self._generate_sketch_binning()
+            else:
+                self._generate_data_binning()
         else:
             self._reuse_data_binning(data_split)
 
@@ -98,34 +111,84 @@ class FeatureBinning:
         self.data_bin = X_bin.T
         self.data_split = X_split
 
-    def _reuse_data_binning(self, data_split):
-
-        self.data_split = data_split
+    def _generate_sketch_binning(self):
+        """分块流式分箱, 每次只把 CHUNK_SIZE 行转换为float64
 
-        n = self.data.shape[0]
+        第一遍按块更新每个特征的分位数草图和不同取值集合(按特征并行),
+        第二遍按块把样本映射到分箱。分箱点格式与 binning_continuous_feature 一致。
+        数据为 np.memmap (dataset_mmap 写入的特征文件) 或npy文件路径时, 每块从文件读取,
+        特征矩阵不需要整体在内存中。
+        """
         d = self.data.shape[1]
+        sketches = [QuantileSketch() for _ in range(d)]
+        unique_values = [np.empty(0) for _ in range(d)]
+
+        def update(k, column):
+            sketches[k].update(column)
+            if unique_values[k] is not None:
+                values = np.union1d(unique_values[k], column[~np.isnan(column)])
+                if k in self.params.my_categorical_idx or len(values) <= self.MAX_UNIQUE_NUM:
+                    unique_values[k] = values
+                else:
+                    unique_values[k] = None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(d, os.cpu_count()))) as executor:
+            for chunk in self._iter_chunks():
+                list(executor.map(update, range(d), chunk))
+
+            self.data_split = [self._sketch_split(
+                k, sketches[k], unique_values[k]) for k in range(d)]
+        self._apply_data_binning()
+
+    def _apply_data_binning(self):
+        """按块把样本映射到分箱, 所有特征的分箱点只转换一次, 按特征并行"""
+        n, d = self.data.shape
+        edges = [np.asarray(split[1:-1], dtype=float) for split in self.data_split]
+        X_bin = np.zeros((d, n), dtype='int16')
+        with ThreadPoolExecutor(max_workers=max(1, min(d, os.cpu_count()))) as executor:
+            start = 0
+            for chunk in self._iter_chunks():
+                end = start + chunk.shape[1]
+                for k, Xk_bin in enumerate(executor.map(self._split_to_bin, chunk, edges)):
+                    X_bin[k, start:end] = Xk_bin
+                start = end
 
-        test_X_bin = np.zeros((d, n), dtype='int16')
-
-        for k in range(d):
-            bin_min = min(self.data[:, k]) - 1
-            bin_max = max(self.data[:, k]) + 1
-            if np.isnan(bin_min):
-                bin_min = min(self.data_split[k])
-            if np.isnan(bin_max):
-                bin_max = max(self.data_split[k])
+        self.data_bin = X_bin.T
 
-            bin_min = min(bin_min, min(self.data_split[k])) - 1
-            bin_max = max(bin_max, max(self.data_split[k])) + 1
+    def _iter_chunks(self):
+        # 每块转置为 (特征, 样本), 每个特征在块内连续; 内存映射的数据只读取当前块
+        for start in range(0, self.data.shape[0], self.CHUNK_SIZE):
+            yield np.ascontiguousarray(
+                np.asarray(self.data[start:start + self.CHUNK_SIZE], dtype=float).T)
+
+    def _sketch_split(self, k, sketch: QuantileSketch, unique_values):
+        if sketch.count == 0:
+            # 全部缺失
+            return [-0.01, 0.0]
+        if k in self.params.my_categorical_idx:
+            if len(unique_values) > self.MAX_UNIQUE_NUM:
+                raise Exception(
+                    'Features with more than 1000 groups are not supported.')
+            return [unique_values[0] - 0.01] + unique_values.tolist()
+        if unique_values is not None and len(unique_values) <= self.params.max_bin:
+            # 取值较少的特征每个取值一个分箱
+            if len(unique_values) == 2 and 0 in unique_values and 1 in unique_values:
+                return [unique_values[0] - 0.01, 0.5, unique_values[1]]
+            return [unique_values[0] - 0.01] + unique_values.tolist()
+        # 等频分箱, 重复的分箱点合并
+        split = np.unique(sketch.quantiles(
+            np.linspace(0, 1, self.params.max_bin + 1)))
+        return split.tolist()
 
-            if len(self.data_split[k]) > 2:
-                bins = np.concatenate(
-                    ([bin_min], self.data_split[k][1:-1], [bin_max]), axis=0)
-            else:
-                bins = np.concatenate(([bin_min], [bin_max]), axis=0)
-            test_Xk_bin = pd.cut(self.data[:, k], bins, labels=False)
-            test_Xk_bin[np.isnan(test_Xk_bin)] = -1
+    @staticmethod
+    def _split_to_bin(feature: np.ndarray, edges: np.ndarray):
+        # edges 为去掉首尾的分箱点, 与 pd.cut(right=True) 一致: edges[i-1] < x <= edges[i] 属于第i个分箱,
+        # 首尾分箱向两侧无限延伸, 缺失值为 -1
+        Xk_bin = np.searchsorted(edges, feature, side='left')
+        Xk_bin[np.isnan(feature)] = -1
+        return Xk_bin
 
-            test_X_bin[k] = test_Xk_bin
+    def _reuse_data_binning(self, data_split):
 
-        self.data_bin = test_X_bin.T
+        self.data_split = data_split
+        self._apply_data_binning()
@@ -0,0 +1,74 @@
+import numpy as np
+
+
+class QuantileSketch:
+    """KLL分位数草图
+
+    第h层的每个元素代表 2^h 个原始样本, 某层超过容量时排序后隔一个取一个升到上一层。
+    草图可以分块更新, 也可以与其他草图合并, 内存与样本数无关。
+    缺失值不计入草图, 最小值和最大值精确记录。
+    """
+
+    def __init__(self, k: int = 1024, seed: int = 0):
+        self.k = k
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(self.levels[level])
+                # 奇数个时保留一个在本层, 其余两两取一个升层
+                keep = len(items) % 2
+                offset = self._rng.integers(2)
+                self.levels[level + 1] = np.concatenate(
+                    [self.levels[level + 1], items[keep + offset::2]])
+                self.levels[level] = items[:keep]
+            level += 1
+
+    def update(self, values: np.ndarray):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other: 'QuantileSketch'):
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._compress()
+
+    def quantiles(self, q) -> np.ndarray:
+        """返回分位点, q=0 和 q=1 对应精确的最小值和最大值"""
+        q = np.asarray(q, dtype=float)
+        if self.count == 0:
+            return np.full(q.shape, np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_items), 2 ** level)
+                                  for level, level_items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items, cum_weights = items[order], np.cumsum(weights[order])
+        index = np.searchsorted(cum_weights, q * cum_weights[-1], side='left')
+        result = items[np.clip(index, 0, len(items) - 1)]
+        result[q <= 0] = self.min
+        result[q >= 1] = self.max
+        return result
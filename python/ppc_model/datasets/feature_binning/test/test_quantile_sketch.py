@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from ppc_common.ppc_utils.utils import AlgorithmType
+from ppc_model.datasets.feature_binning.feature_binning import FeatureBinning
+from ppc_model.datasets.feature_binning.quantile_sketch import QuantileSketch
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def _check_rank_error(self, sketch, values, tolerance):
+        values = np.sort(values)
+        q = np.linspace(0, 1, 21)
+        result = sketch.quantiles(q)
+        self.assertEqual(values[0], result[0])
+        self.assertEqual(values[-1], result[-1])
+        rank = np.searchsorted(values, result, side='right') / len(values)
+        self.assertLess(np.max(np.abs(rank - q)), tolerance)
+
+    def test_update(self):
+        values = np.random.randn(200000)
+        sketch = QuantileSketch(k=256)
+        for chunk in np.array_split(values, 37):
+            sketch.update(chunk)
+        self.assertEqual(len(values), sketch.count)
+        self.assertLess(sum(len(items) for items in sketch.levels), 2000)
+        self._check_rank_error(sketch, values, 0.02)
+
+    def test_merge(self):
+        values = np.random.exponential(size=100000)
+        values[::7] = np.nan
+        sketches = [QuantileSketch(k=256) for _ in range(4)]
+        for sketch, chunk in zip(sketches, np.array_split(values, 4)):
+            sketch.update(chunk)
+        for sketch in sketches[1:]:
+            sketches[0].merge(sketch)
+        self._check_rank_error(
+            sketches[0], values[~np.isnan(values)], 0.02)
+
+    def test_sketch_binning(self):
+        n = 5000
+        data = np.column_stack([np.random.randn(n), np.random.randint(0, 2, n),
+                                np.random.randint(0, 30, n), np.random.randint(0, 5, n)]).astype(float)
+        data[::13, 0] = np.nan
+        ctx = SimpleNamespace(algorithm_type=AlgorithmType.Train.name, model_params=SimpleNamespace(
+            quantile_sketch=True, max_bin=10, my_categorical_idx=[2]))
+        feat_bin = FeatureBinning(ctx)
+        feat_bin.CHUNK_SIZE = 999
+        data_bin, data_split = feat_bin.data_binning(data)
+
+        self.assertEqual(data.shape, data_bin.shape)
+        self.assertTrue(np.all(data_bin[np.isnan(data[:, 0]), 0] == -1))
+        self.assertEqual(11, len(data_split[0]))
+        counts = np.bincount(data_bin[data_bin[:, 0] >= 0, 0])
+        self.assertLess(counts.max() - counts.min(), n * 0.02)
+        self.assertListEqual([-0.01, 0.5, 1.0], data_split[1])
+        self.assertListEqual(list(data[:, 2]), list(data_bin[:, 2]))
+        self.assertListEqual(list(data[:, 3]), list(data_bin[:, 3]))
+
+        # 预测时复用分箱点得到相同的分箱
+        ctx.algorithm_type = AlgorithmType.Predict.name
+        reuse_bin, _ = FeatureBinning(ctx).data_binning(data, data_split)
+        self.assertTrue(np.array_equal(data_bin, reuse_bin))
+
+    def test_sketch_split_qcut(self):
+        # 含缺失值时, 草图分箱点与 pd.qcut 分箱点的排序位置误差有界
+        n = 50000
+        feature = np.random.lognormal(size=n)
+        feature[::11] = np.nan
+        ctx = SimpleNamespace(algorithm_type=AlgorithmType.Train.name, model_params=SimpleNamespace(
+            quantile_sketch=True, max_bin=20, my_categorical_idx=[]))
+        feat_bin = FeatureBinning(ctx)
+        feat_bin.CHUNK_SIZE = 4999
+        data_bin, data_split = feat_bin.data_binning(feature[:, np.newaxis])
+        _, expected = pd.qcut(feature, q=20, retbins=True, labels=False)
+
+        values = np.sort(feature[~np.isnan(feature)])
+        self.assertEqual(len(expected), len(data_split[0]))
+        self.assertEqual(expected[0], data_split[0][0])
+        self.assertEqual(expected[-1], data_split[0][-1])
+        rank = np.searchsorted(values, data_split[0], side='right') / len(values)
+        expected_rank = np.searchsorted(values, expected, side='right') / len(values)
+        self.assertLess(np.max(np.abs(rank - expected_rank)), 0.01)
+        self.assertTrue(np.all(data_bin[np.isnan(feature), 0] == -1))
+
+    def test_memmap_binning(self):
+        # 特征文件以内存映射方式按块读取, 与内存中的数组结果一致
+        n = 3000
+        data = np.column_stack([np.random.randn(n), np.random.randint(0, 5, n)]).astype(np.float32)
+        data[::7, 0] = np.nan
+        path = os.path.join(tempfile.mkdtemp(), 'model_feature.npy')
+        np.save(path, np.asfortranarray(data))
+        ctx = SimpleNamespace(algorithm_type=AlgorithmType.Train.name, model_params=SimpleNamespace(
+            quantile_sketch=True, max_bin=10, my_categorical_idx=[]))
+
+        results = []
+        for source in [data, path, np.load(path, mmap_mode='r')]:
+            feat_bin = FeatureBinning(ctx)
+            feat_bin.CHUNK_SIZE = 512
+            results.append(feat_bin.data_binning(source))
+            self.assertEqual(source is not data, isinstance(feat_bin.data, np.memmap))
+        for data_bin, data_split in results[1:]:
+            self.assertTrue(np.array_equal(results[0][0], data_bin))
+            self.assertEqual(results[0][1], data_split)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from ppc_common.ppc_utils.utils import AlgorithmType
+from ppc_model.datasets.feature_binning.feature_binning import FeatureBinning
+
+
+def cut_reference(feature, split):
+    # 首尾分箱点向两侧扩展后用 pd.cut 分箱
+    bins = np.concatenate(([-np.inf], split[1:-1], [np.inf]))
+    Xk_bin = pd.cut(feature, bins, labels=False)
+    Xk_bin[np.isnan(Xk_bin)] = -1
+    return Xk_bin
+
+
+class TestReuseBinning(unittest.TestCase):
+
+    def test_reuse_binning(self):
+        n = 3000
+        train_X = np.column_stack([np.random.randn(n), np.random.randint(0, 2, n),
+                                   np.random.randint(0, 7, n), np.random.exponential(size=n)])
+        ctx = SimpleNamespace(algorithm_type=AlgorithmType.Train.name, model_params=SimpleNamespace(
+            quantile_sketch=False, max_bin=10, my_categorical_idx=[2]))
+        _, data_split = FeatureBinning(ctx).data_binning(train_X)
+
+        # 超出训练集范围的值落入首尾分箱, 分箱点上的值属于左侧分箱
+        test_X = np.vstack([train_X * 1.5, [[np.nan] * 4, [1e9] * 4, [-1e9] * 4],
+                            [[split[1] if len(split) > 2 else 0 for split in data_split]]])
+        test_X[::7, 0] = np.nan
+        ctx.algorithm_type = AlgorithmType.Predict.name
+        feat_bin = FeatureBinning(ctx)
+        feat_bin.CHUNK_SIZE = 1000
+        test_X_bin, _ = feat_bin.data_binning(test_X, data_split)
+
+        self.assertEqual(np.int16, test_X_bin.dtype)
+        for k in range(test_X.shape[1]):
+            self.assertListEqual(list(cut_reference(test_X[:, k], data_split[k])),
+                                 list(test_X_bin[:, k]))
+
+
+if __name__ == '__main__':
+    unittest.main()
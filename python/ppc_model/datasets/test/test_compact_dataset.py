@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from ppc_common.ppc_utils.utils import AlgorithmType
+from ppc_model.common.protocol import TaskRole
+from ppc_model.datasets.dataset import SecureDataset
+
+
+def make_ctx(workspace, algorithm_type, compact_dataset, dataset_mmap=False):
+    model_params = SimpleNamespace(
+        test_size=0.3, random_state=2024, eval_set_column=None, train_set_value=None,
+        eval_set_value=None, compact_dataset=compact_dataset, dataset_mmap=dataset_mmap,
+        sparse_features=False)
+    return SimpleNamespace(
+        eval_column_file=os.path.join(workspace, 'model_eval_column.csv'),
+        iv_selected_file=os.path.join(workspace, 'iv_selected.csv'),
+        selected_col_file=os.path.join(workspace, 'selected_col.csv'),
+        model_feature_file=os.path.join(workspace, 'model_feature.npy'),
+        is_label_holder=True, algorithm_type=algorithm_type, role=TaskRole.ACTIVE_PARTY,
+        model_params=model_params)
+
+
+class TestCompactDataset(unittest.TestCase):
+
+    def setUp(self):
+        n = 1000
+        X = np.column_stack([np.random.randint(0, 100, n), np.random.rand(n).astype(np.float32),
+                             np.random.randint(-5, 5, n)]).astype(float)
+        X[::9, 1] = np.nan
+        self.df = SecureDataset.assembling_dataset(X, np.random.randint(0, 2, n))
+        self.workspace = tempfile.mkdtemp()
+
+    def _check_dataset(self, dataset, compact):
+        for name in ['train_idx', 'test_idx', 'train_y', 'test_y']:
+            self.assertTrue(np.array_equal(getattr(dataset, name), getattr(compact, name)))
+        self.assertEqual(dataset.feature_name, compact.feature_name)
+        self.assertTrue(np.array_equal(dataset.train_X, compact.train_X, equal_nan=True))
+        self.assertTrue(np.array_equal(dataset.test_X, compact.test_X, equal_nan=True))
+        self.assertEqual(np.float32, compact.train_X.dtype)
+        # 列优先存放, 切片后每列仍然连续
+        self.assertEqual(compact.train_X.itemsize, compact.train_X.strides[0])
+        self.assertIs(compact.train_X.base, compact.test_X.base)
+        self.assertIsNone(compact.model_data)
+
+    def test_compact_dataset(self):
+        dataset = SecureDataset(make_ctx(
+            self.workspace, AlgorithmType.Train.name, False), self.df.copy())
+        compact = SecureDataset(make_ctx(
+            self.workspace, AlgorithmType.Train.name, True), self.df.copy())
+        self._check_dataset(dataset, compact)
+
+        compact = SecureDataset(make_ctx(
+            self.workspace, AlgorithmType.Train.name, True, True), self.df.copy())
+        self._check_dataset(dataset, compact)
+        self.assertIsInstance(compact.train_X, np.memmap)
+
+    def test_compact_dtype(self):
+        self.assertEqual(np.int8, SecureDataset._compact_dtype(
+            [np.array([1., 2.]), np.array([-128, 127])]))
+        self.assertEqual(np.int32, SecureDataset._compact_dtype([np.array([70000.])]))
+        self.assertEqual(np.float32, SecureDataset._compact_dtype(
+            [np.array([1., np.nan]), np.array([0.5, np.inf])]))
+        self.assertEqual(np.float64, SecureDataset._compact_dtype(
+            [np.array([0.1]), np.array([1])]))
+        self.assertEqual(np.float64, SecureDataset._compact_dtype(
+            [np.array([2 ** 40 + 1]), np.array([0.5])]))
+        self.assertIsNone(SecureDataset._compact_dtype([np.array(['a'], dtype=object)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
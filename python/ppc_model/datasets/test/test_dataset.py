@@ -1,3 +1,5 @@
+import os
+import tempfile
 import unittest
 import numpy as np
 import pandas as pd
@@ -25,10 +27,11 @@ class TestSecureDataset(unittest.TestCase):
     assert (df_without_y.columns == ['id'] +
             [f'x{i + 16}' for i in range(15)]).all()
 
-    # 模拟自定义分组
-    import os
+    # 测试文件写入临时目录
+    workspace = tempfile.mkdtemp()
 
-    eval_column_file = './model_eval_column.csv'
+    # 模拟自定义分组
+    eval_column_file = os.path.join(workspace, 'model_eval_column.csv')
     if not os.path.exists(eval_column_file):
         # 创建一个包含569行，2列的数据，其中415个为'INS'，154个为'OOS'
         group_set = np.concatenate([['INS'] * 415, ['OOS'] * 154])
@@ -37,15 +40,15 @@ class TestSecureDataset(unittest.TestCase):
             {'id': np.arange(1, 570), 'group': group_set})
         eval_set_df.to_csv(eval_column_file, index=None)
 
-    df_with_y_file = './df_with_y.csv'
+    df_with_y_file = os.path.join(workspace, 'df_with_y.csv')
     if not os.path.exists(df_with_y_file):
         df_with_y.to_csv(df_with_y_file, index=None, sep=' ')
 
-    df_without_y_file = './df_without_y.csv'
+    df_without_y_file = os.path.join(workspace, 'df_without_y.csv')
     if not os.path.exists(df_without_y_file):
         df_without_y.to_csv(df_without_y_file, index=None, sep=' ')
 
-    iv_selected_file = './iv_selected.csv'
+    iv_selected_file = os.path.join(workspace, 'iv_selected.csv')
     if not os.path.exists(iv_selected_file):
         iv_selected = pd.DataFrame(
             {'feature': [f'x{i + 1}' for i in range(30)],
@@ -188,7 +191,7 @@ class TestSecureDataset(unittest.TestCase):
 
         # 模拟构造主动方数据集
         task_info.model_prepare_file = self.df_with_y_file
-        task_info.iv_selected_file = './iv_selected.csv'
+        task_info.iv_selected_file = self.iv_selected_file
         dataset_with_y = SecureDataset(task_info)
 
         self.assertEqual(dataset_with_y.train_X, None)
@@ -201,7 +204,7 @@ class TestSecureDataset(unittest.TestCase):
         origin_data = np.random.randint(0, 100, size=(100, 10))
         columns = ['id'] + [f"x{i}" for i in range(2, 11)]
         df = pd.DataFrame(origin_data, columns=columns)
-        csv_file = '/tmp/data_x1_to_x10.csv'
+        csv_file = os.path.join(self.workspace, 'data_x1_to_x10.csv')
         df.to_csv(csv_file, index=False)
         field_list, label, feature = SecureDataset.read_dataset(
             csv_file, False, delimiter=',')
@@ -38,7 +38,8 @@ class FeatureEngineeringContext(Context):
         self.feature = feature
         self.label = label
         self.phe = PheCipherFactory.build_phe(
-            components.homo_algorithm, components.public_key_length)
+            components.homo_algorithm, components.public_key_length,
+            components.obfuscator_pool_size)
         self.codec = PheCipherFactory.build_codec(components.homo_algorithm)
         self.model_setting = ModelSetting(self.model_dict)
         self._parse_model_dict()
@@ -46,4 +46,7 @@ class FeatureEngineeringEngine(TaskEngine):
                 label=None
             )
             vfe = VerticalFeatureEngineeringPassiveParty(context)
-        vfe.fit()
+        try:
+            vfe.fit()
+        finally:
+            context.phe.shutdown()
@@ -4,6 +4,7 @@ import time
 
 import pandas as pd
 
+from ppc_common.ppc_crypto.slot_packing_codec import SlotPackingCodec
 from ppc_common.ppc_protos.generated.ppc_model_pb2 import EncAggrLabelsList
 from ppc_common.ppc_utils import utils
 from ppc_model.common.protocol import PheMessage
@@ -122,7 +123,10 @@ class VerticalFeatureEngineeringActiveParty(VerticalModel):
 
     @staticmethod
     def _process_one_feature(phe, field, count_list, enc_aggr_labels):
-        pos_event = phe.decrypt_batch(enc_aggr_labels)
+        packing_codec = SlotPackingCodec.from_cipher(
+            enc_aggr_labels[0], sum(count_list))
+        pos_event = packing_codec.unpack(
+            phe.decrypt_batch(enc_aggr_labels), len(count_list))
         field_woe_iv_df = pd.DataFrame({'bins': range(len(count_list)), 'count': count_list,
                                         'pos_event': pos_event, 'feature': field})
         field_woe_iv_df, iv_total = calculate_woe_iv_with_pos_event(
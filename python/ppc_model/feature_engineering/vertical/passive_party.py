@@ -2,6 +2,10 @@ import multiprocessing
 import os
 import time
 
+import numpy as np
+
+from ppc_common.ppc_crypto.cipher_array import encrypted_bincount
+from ppc_common.ppc_crypto.slot_packing_codec import SlotPackingCodec
 from ppc_common.ppc_protos.generated.ppc_model_pb2 import ModelCipher, EncAggrLabels, EncAggrLabelsList
 from ppc_common.ppc_utils import utils
 from ppc_model.common.protocol import PheMessage
@@ -46,7 +50,7 @@ class VerticalFeatureEngineeringPassiveParty(VerticalModel):
         data = self.ctx.model_router.pop(
             task_id=self.ctx.task_id, task_type=FeMessage.ENC_LABELS.value, from_inst=active_party)
         public_key, enc_labels = PheMessage.unpacking_data(
-            self.ctx.codec, data)
+            self.ctx.codec, data, as_array=True)
         log.info(f"All enc labels received, task_id: {self.ctx.task_id}, label_num: {len(enc_labels)}, "
                  f"size: {len(data) / 1024}KB, timecost: {time.time() - start_time}s")
         return public_key, enc_labels
@@ -93,19 +97,16 @@ class VerticalFeatureEngineeringPassiveParty(VerticalModel):
             bins = FeatureBinning.binning_categorical_feature(feature)[0]
 
         enc_labels = param['enc_labels']
-        data_dict = {}
-        for key, value in zip(bins, enc_labels):
-            if key in data_dict:
-                data_dict[key]['count'] += 1
-                # 执行同态加法
-                data_dict[key]['sum'] = data_dict[key]['sum'] + value
-            else:
-                data_dict[key] = {'count': 1, 'sum': value}
-
-        count_list = [data_dict[key]['count']
-                      for key in sorted(data_dict.keys())]
-        aggr_enc_labels = [data_dict[key]['sum']
-                           for key in sorted(data_dict.keys())]
+        # 按分箱一次性执行同态加法
+        keys, bin_index, count_list = np.unique(
+            bins, return_inverse=True, return_counts=True)
+        aggr_enc_labels = encrypted_bincount(
+            bin_index, enc_labels, len(keys)).to_ciphers()
+        count_list = count_list.tolist()
+        # 每个分箱的正样本数不超过样本总数, 按槽位打包减少密文数量
+        packing_codec = SlotPackingCodec.from_cipher(
+            aggr_enc_labels[0], len(enc_labels))
+        aggr_enc_labels = packing_codec.pack_ciphers(aggr_enc_labels)
 
         return VerticalFeatureEngineeringPassiveParty._encode_enc_aggr_labels(
             param['codec'], param['field'], count_list, aggr_enc_labels)
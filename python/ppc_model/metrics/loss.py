@@ -37,7 +37,8 @@ class BinaryLoss(Loss):
             x.reshape(1, len(x))
         if theta.ndim == 1:
             theta.reshape(len(theta), 1)
-        g = np.matmul(x, theta)
+        # 兼容scipy稀疏矩阵
+        g = x @ theta
         return g
 
     @staticmethod
@@ -63,7 +63,9 @@ class ModelTaskParams(LGBMModel):
         self,
         test_size: float = 0.3,
         max_bin: int = 10,
+        quantile_sketch: bool = False,
         use_goss: bool = False,
+        level_wise: bool = False,
         top_rate: float = 0.2,
         other_rate: float = 0.1,
         feature_rate: float = 1.0,
@@ -78,6 +80,9 @@ class ModelTaskParams(LGBMModel):
         eval_metric: str = 'auc',
         verbose_eval: int = 1,
         categorical_feature: list = [],
+        compact_dataset: bool = False,
+        dataset_mmap: bool = False,
+        sparse_features: bool = False,
         silent: bool = False
     ):
 
@@ -85,7 +90,11 @@ class ModelTaskParams(LGBMModel):
 
         self.test_size = test_size
         self.max_bin = max_bin
+        # 用分位数草图分块流式分箱, 适用于内存放不下整列float64的数据
+        self.quantile_sketch = quantile_sketch
         self.use_goss = use_goss
+        # 按层构建树, 每层只做一轮直方图/分裂信息/样本划分交互
+        self.level_wise = level_wise
         self.top_rate = top_rate
         self.other_rate = other_rate
         self.feature_rate = feature_rate
@@ -103,6 +112,11 @@ class ModelTaskParams(LGBMModel):
         self.λ = self.reg_lambda
         self.lr = self.learning_rate
         self.categorical_feature = categorical_feature
+        # 特征按列存放在一个压缩类型的数组中, 训练集和验证集为其切片, 可选用npy文件内存映射
+        self.compact_dataset = compact_dataset
+        self.dataset_mmap = dataset_mmap
+        # 稀疏特征只用于LR, LGBM按分箱训练时保持False
+        self.sparse_features = sparse_features
         self.categorical_idx = []
         self.my_categorical_idx = []
 
@@ -127,7 +141,8 @@ class SecureLGBMContext(SecureModelContext):
         super().__init__(task_id, args, components)
 
         self.phe = PheCipherFactory.build_phe(
-            components.homo_algorithm, components.public_key_length)
+            components.homo_algorithm, components.public_key_length,
+            components.obfuscator_pool_size)
         self.codec = PheCipherFactory.build_codec(components.homo_algorithm)
 
     def create_model_param(self):
@@ -173,9 +188,13 @@ class LGBMMessage(Enum):
     ENC_GH_HIST = "ENC_GH_HIST"
     SPLIT_INFO = 'SPLIT_INFO'
     INSTANCE_MASK = "INSTANCE_MASK"
+    LEVEL_GH_HIST = "LEVEL_GH_HIST"
+    LEVEL_SPLIT_INFO = "LEVEL_SPLIT_INFO"
+    LEVEL_INSTANCE_MASK = "LEVEL_INSTANCE_MASK"
     PREDICT_LEAF_MASK = "PREDICT_LEAF_MASK"
     TEST_LEAF_MASK = "PREDICT_TEST_LEAF_MASK"
     VALID_LEAF_MASK = "PREDICT_VALID_LEAF_MASK"
+    VALID_SPLIT_MASKS = "PREDICT_VALID_SPLIT_MASKS"
     STOP_ITERATION = "STOP_ITERATION"
     PREDICT_PRABA = "PREDICT_PRABA"
     MODEL_DATA = "MODEL_DATA"
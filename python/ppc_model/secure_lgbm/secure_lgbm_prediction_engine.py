@@ -16,23 +16,26 @@ class SecureLGBMPredictionEngine(TaskEngine):
     def run(task_id, args):
 
         task_info = SecureLGBMContext(task_id, args, components)
-        secure_dataset = SecureDataset(task_info)
+        try:
+            secure_dataset = SecureDataset(task_info)
 
-        if task_info.role == TaskRole.ACTIVE_PARTY:
-            booster = VerticalLGBMActiveParty(task_info, secure_dataset)
-        elif task_info.role == TaskRole.PASSIVE_PARTY:
-            booster = VerticalLGBMPassiveParty(task_info, secure_dataset)
-        else:
-            raise PpcException(PpcErrorCode.ROLE_TYPE_ERROR.get_code(),
-                               PpcErrorCode.ROLE_TYPE_ERROR.get_message())
+            if task_info.role == TaskRole.ACTIVE_PARTY:
+                booster = VerticalLGBMActiveParty(task_info, secure_dataset)
+            elif task_info.role == TaskRole.PASSIVE_PARTY:
+                booster = VerticalLGBMPassiveParty(task_info, secure_dataset)
+            else:
+                raise PpcException(PpcErrorCode.ROLE_TYPE_ERROR.get_code(),
+                                   PpcErrorCode.ROLE_TYPE_ERROR.get_message())
 
-        booster.load_model()
-        booster.predict()
+            booster.load_model()
+            booster.predict()
 
-        # 获取测试集的预测概率值
-        test_praba = booster.get_test_praba()
+            # 获取测试集的预测概率值
+            test_praba = booster.get_test_praba()
 
-        # 获取测试集的预测值评估指标
-        Evaluation(task_info, secure_dataset, test_praba=test_praba)
+            # 获取测试集的预测值评估指标
+            Evaluation(task_info, secure_dataset, test_praba=test_praba)
 
-        ResultFileHandling(task_info)
+            ResultFileHandling(task_info)
+        finally:
+            task_info.phe.shutdown()
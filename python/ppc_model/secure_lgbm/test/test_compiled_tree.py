@@ -0,0 +1,159 @@
+import json
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from ppc_common.ppc_protos.generated.ppc_model_pb2 import BestSplitInfo
+from ppc_model.secure_lgbm.vertical.booster import VerticalBooster
+
+
+def build_tree(max_depth, depth=0, weight=0.0, counter=None):
+    counter = [0] if counter is None else counter
+    if depth == max_depth or (depth > 0 and np.random.rand() < 0.3):
+        return weight
+    counter[0] += 1
+    best_split_info = BestSplitInfo(
+        tree_id=1,
+        leaf_id=counter[0],
+        feature=np.random.randint(0, 10),
+        value=np.random.randint(0, 4),
+        best_gain=np.random.rand(),
+        w_left=np.random.rand(),
+        w_right=np.random.rand(),
+        agency_idx=np.random.randint(0, 2),
+        agency_feature=np.random.randint(0, 3))
+    left_tree = build_tree(max_depth, depth + 1, best_split_info.w_left, counter)
+    right_tree = build_tree(max_depth, depth + 1, best_split_info.w_right, counter)
+    return [(best_split_info, left_tree, right_tree)]
+
+
+def predict_reference(tree, X_bin, categorical_idx):
+    # 逐节点递归, 所有分裂节点都由本方计算
+    if not isinstance(tree, list):
+        return np.full(X_bin.shape[0], tree)
+    best_split_info, left_tree, right_tree = tree[0]
+    column = X_bin[:, best_split_info.agency_feature]
+    if best_split_info.agency_feature in categorical_idx:
+        left_mask = column == best_split_info.value
+    else:
+        left_mask = column <= best_split_info.value
+    return np.where(left_mask, predict_reference(left_tree, X_bin, categorical_idx),
+                    predict_reference(right_tree, X_bin, categorical_idx))
+
+
+def legacy_serial_tree(tree):
+    if isinstance(tree, list):
+        best_split_info, left_tree, right_tree = tree[0]
+        return [getattr(best_split_info, field.name) for field in best_split_info.DESCRIPTOR.fields] + \
+            [legacy_serial_tree(left_tree), legacy_serial_tree(right_tree)]
+    return tree
+
+
+class TestCompiledTree(unittest.TestCase):
+
+    def test_serial_tree(self):
+        for _ in range(20):
+            tree = build_tree(4)
+            serial_tree = json.loads(json.dumps(VerticalBooster._serial_tree(tree)))
+            self.assertEqual(tree, VerticalBooster._deserial_tree(serial_tree))
+            # 旧版本的嵌套列表格式
+            legacy_tree = json.loads(json.dumps(legacy_serial_tree(tree)))
+            self.assertEqual(tree, VerticalBooster._deserial_tree(legacy_tree))
+        self.assertEqual(0.5, VerticalBooster._deserial_tree(
+            VerticalBooster._serial_tree(0.5)))
+
+    def test_predict(self):
+        X_bin = np.random.randint(0, 4, size=(200, 3))
+        categorical_idx = [1]
+        booster = SimpleNamespace(
+            ctx=SimpleNamespace(participant_id_list=['a', 'b'],
+                                components=SimpleNamespace(config_data={'AGENCY_ID': 'a'})),
+            params=SimpleNamespace(my_categorical_idx=categorical_idx))
+        for _ in range(20):
+            tree = build_tree(5)
+            compiled = VerticalBooster._compile_tree(tree)
+            split_nodes = np.flatnonzero(compiled['left'] >= 0)
+            my_nodes, my_masks = VerticalBooster._compute_split_masks(
+                booster, compiled, X_bin)
+            self.assertListEqual(
+                list(split_nodes[compiled['agency_idx'][split_nodes] == 0]), list(my_nodes))
+
+            # 另一方的节点用相同的规则计算
+            booster.ctx.components.config_data['AGENCY_ID'] = 'b'
+            other_nodes, other_masks = VerticalBooster._compute_split_masks(
+                booster, compiled, X_bin)
+            booster.ctx.components.config_data['AGENCY_ID'] = 'a'
+            left_masks = np.empty((len(split_nodes), X_bin.shape[0]), dtype=bool)
+            left_masks[np.searchsorted(split_nodes, my_nodes)] = my_masks
+            left_masks[np.searchsorted(split_nodes, other_nodes)] = other_masks
+
+            leaf = VerticalBooster._tree_leaf_index(compiled, left_masks)
+            self.assertTrue(np.all(compiled['left'][leaf] < 0))
+            self.assertListEqual(list(predict_reference(tree, X_bin, categorical_idx)),
+                                 list(compiled['weight'][leaf]))
+
+    def test_pack_split_masks(self):
+        X_bin = np.random.randint(0, 4, size=(101, 3))
+        booster = SimpleNamespace(
+            ctx=SimpleNamespace(participant_id_list=['a', 'b'],
+                                components=SimpleNamespace(config_data={'AGENCY_ID': 'b'})),
+            params=SimpleNamespace(my_categorical_idx=[]))
+        booster._compute_split_masks = lambda compiled, X: VerticalBooster._compute_split_masks(
+            booster, compiled, X)
+        compiled_trees = [VerticalBooster._compile_tree(build_tree(4)) for _ in range(5)]
+        expected = np.vstack([booster._compute_split_masks(compiled, X_bin)[1]
+                              for compiled in compiled_trees])
+
+        packed = VerticalBooster._pack_trees_split_masks(booster, compiled_trees, X_bin)
+        self.assertEqual(len(expected) * 13, len(packed))
+        packed = np.frombuffer(packed, dtype=np.uint8).reshape(-1, 13)
+        rows = np.arange(len(expected))[::-2]
+        self.assertTrue(np.array_equal(
+            expected[rows], VerticalBooster._unpack_split_masks(packed, rows, 101)))
+
+    def test_record_leaf(self):
+        X_bin = np.random.randint(0, 4, size=(300, 3))
+        booster = VerticalBooster.__new__(VerticalBooster)
+        booster.ctx = SimpleNamespace(participant_id_list=['a'],
+                                      components=SimpleNamespace(config_data={'AGENCY_ID': 'a'}))
+        booster.params = SimpleNamespace(
+            my_categorical_idx=[1], max_depth=6, lr=0.1, min_split_gain=0,
+            min_child_weight=0, min_child_samples=0)
+        booster._X_bin = X_bin
+        booster._tree_id = 1
+        booster._leaf_id = 0
+        tree = build_tree(5)
+
+        def own_tree(node):
+            if isinstance(node, list):
+                node[0][0].agency_idx = 0
+                own_tree(node[0][1])
+                own_tree(node[0][2])
+        own_tree(tree)
+
+        # 抽样样本和未抽样样本一起按层划分
+        instance = np.sort(np.random.choice(300, 200, replace=False))
+        rest = booster._init_tree_rows(instance)
+        self.assertEqual(100, len(rest))
+        nodes = [{'instance': instance, 'rest': rest, 'weight': 0,
+                  'hist_context': None, 'is_left': True, 'subtree': tree}]
+        depth = 0
+        while len(nodes) > 0:
+            nodes = booster._open_level_nodes(nodes, depth)
+            split_info_list = [node['subtree'][0][0] if isinstance(node['subtree'], list)
+                               else BestSplitInfo(best_gain=0) for node in nodes]
+            children = booster._split_level_nodes(
+                nodes, split_info_list, depth, ('instance',))
+            for node in nodes:
+                if 'split' in node:
+                    node['split'][1]['subtree'] = node['subtree'][0][1]
+                    node['split'][2]['subtree'] = node['subtree'][0][2]
+            nodes = children
+            depth += 1
+        self.assertListEqual(list(predict_reference(tree, X_bin, [1])),
+                             list(booster._tree_weights))
+
+
+if __name__ == '__main__':
+    unittest.main()
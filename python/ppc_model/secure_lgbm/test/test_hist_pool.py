@@ -0,0 +1,48 @@
+import unittest
+import numpy as np
+
+from ppc_common.ppc_crypto.cipher_array import CipherArray, encrypted_bincount
+from ppc_common.ppc_crypto.ihc_cipher import IhcCipher
+from ppc_common.ppc_crypto.ihc_codec import IhcCodec
+from ppc_common.ppc_crypto.paillier_cipher import PaillierCipher
+from ppc_common.ppc_crypto.paillier_codec import PaillierCodec
+from ppc_model.secure_lgbm.vertical.booster import VerticalBooster
+from ppc_model.secure_lgbm.vertical.hist_pool import HistWorkerPool
+
+
+class TestHistWorkerPool(unittest.TestCase):
+
+    def _check_pool(self, phe, codec, n):
+        X_bin = np.random.randint(0, 5, size=(n, 5))
+        bin_index, bin_num = VerticalBooster._dense_bin_index(X_bin)
+        bin_rows = VerticalBooster._csr_bin_index(bin_index)
+        pool = HistWorkerPool(bin_index, bin_rows, bin_num, processes=2)
+        try:
+            for tree_id in range(2):
+                instance = np.random.choice(n, n // 2, replace=False)
+                values = np.random.randint(-1000, 1000, size=len(instance))
+                ghlist = CipherArray.from_ciphers(
+                    [phe.encrypt(int(value)) for value in values])
+                pool.set_tree(tree_id, instance, ghlist,
+                              codec, phe.public_key)
+                # 根节点和一个子节点
+                for mask in [np.ones(len(instance), dtype=bool), values > 0]:
+                    gh_hist = pool.calculate_hist(instance[mask])
+                    expected = encrypted_bincount(
+                        bin_index[:, instance[mask]], ghlist[mask], bin_num)
+                    self.assertEqual(len(bin_num), len(gh_hist))
+                    for hist, expected_hist in zip(gh_hist, expected):
+                        self.assertListEqual(phe.decrypt_batch(expected_hist.to_ciphers()),
+                                             phe.decrypt_batch(hist.to_ciphers()))
+        finally:
+            pool.close()
+
+    def test_ihc_pool(self):
+        self._check_pool(IhcCipher(), IhcCodec(), 500)
+
+    def test_paillier_pool(self):
+        self._check_pool(PaillierCipher(key_length=512), PaillierCodec(), 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
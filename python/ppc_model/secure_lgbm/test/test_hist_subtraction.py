@@ -0,0 +1,48 @@
+import unittest
+import numpy as np
+
+from ppc_model.secure_lgbm.vertical.active_party import VerticalLGBMActiveParty
+from ppc_model.secure_lgbm.vertical.booster import VerticalBooster
+
+
+class TestHistSubtraction(unittest.TestCase):
+
+    def test_init_hist_context(self):
+        left_mask = np.array([True, False, False, True, False])
+        context = VerticalBooster._init_hist_context(left_mask, ~left_mask)
+        self.assertTrue(context['small_is_left'])
+        self.assertIs(left_mask, context['small_mask'])
+
+        context = VerticalBooster._init_hist_context(~left_mask, left_mask)
+        self.assertFalse(context['small_is_left'])
+        assert np.array_equal(left_mask, context['small_mask'])
+
+        # 样本数相同时选择左子节点
+        left_mask = np.array([True, False])
+        self.assertTrue(VerticalBooster._init_hist_context(
+            left_mask, ~left_mask)['small_is_left'])
+
+    def test_subtract_hist(self):
+        X_bin = np.random.randint(0, 5, size=(100, 3))
+        glist = np.random.randint(-1000, 1000, size=100) / 1000
+        hlist = np.random.randint(0, 1000, size=100) / 1000
+        instance = np.arange(100)
+        left_mask = X_bin[:, 0] <= 1
+        bin_index, bin_num = VerticalBooster._dense_bin_index(X_bin)
+
+        parent_hist = VerticalLGBMActiveParty._calculate_hist(
+            bin_index, bin_num, instance, glist, hlist)
+        left_hist = VerticalLGBMActiveParty._calculate_hist(
+            bin_index, bin_num, instance[left_mask], glist[left_mask], hlist[left_mask])
+        right_hist = VerticalLGBMActiveParty._calculate_hist(
+            bin_index, bin_num, instance[~left_mask], glist[~left_mask], hlist[~left_mask])
+
+        ghist, hhist = VerticalLGBMActiveParty._subtract_hist(
+            parent_hist, left_hist)
+        for k in range(X_bin.shape[1]):
+            assert np.allclose(right_hist[0][k], ghist[k])
+            assert np.allclose(right_hist[1][k], hhist[k])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import numpy as np
+
+from ppc_common.ppc_protos.generated.ppc_model_pb2 import BestSplitInfo
+from ppc_model.secure_lgbm.vertical.booster import VerticalBooster
+
+
+class TestLevelWise(unittest.TestCase):
+
+    def test_pack_split_info_list(self):
+        split_info_list = [BestSplitInfo(tree_id=1, leaf_id=i, feature=i * 2, value=3,
+                                         best_gain=0.5 * i, w_left=-0.25, w_right=0.125)
+                           for i in range(4)]
+        # 没有增益的分裂信息序列化后长度为0
+        split_info_list.append(BestSplitInfo())
+        byte_data = VerticalBooster._pack_split_info_list(split_info_list)
+        self.assertEqual(split_info_list,
+                         VerticalBooster._unpack_split_info_list(byte_data))
+        self.assertEqual([], VerticalBooster._unpack_split_info_list(b''))
+
+    def test_level_hist_tasks(self):
+        instance = np.arange(10)
+        ghlist = np.arange(10) * 10
+        root = {'instance': instance, 'ghlist': ghlist, 'hist_context': None}
+        tasks = VerticalBooster._level_hist_tasks([root], ('instance', 'ghlist'))
+        self.assertEqual(1, len(tasks))
+        self.assertEqual(0, root['hist_task'])
+
+        left_mask = instance >= 7
+        context = VerticalBooster._init_hist_context(left_mask, ~left_mask)
+        context.update({'instance': instance, 'ghlist': ghlist})
+        nodes = [{'instance': instance[left_mask], 'hist_context': context},
+                 {'instance': instance[~left_mask], 'hist_context': context},
+                 root]
+        tasks = VerticalBooster._level_hist_tasks(nodes, ('instance', 'ghlist'))
+        # 兄弟节点共用较小子节点的任务
+        self.assertEqual(2, len(tasks))
+        self.assertEqual([0, 0, 1], [node['hist_task'] for node in nodes])
+        assert np.array_equal([7, 8, 9], tasks[0]['instance'])
+        assert np.array_equal([70, 80, 90], tasks[0]['ghlist'])
+
+    def test_assemble_tree(self):
+        split_info = BestSplitInfo(leaf_id=1)
+        left_node = {'tree': 0.5}
+        right_split_info = BestSplitInfo(leaf_id=2)
+        right_node = {'split': (right_split_info, {'tree': -1}, {'tree': 1})}
+        root = {'split': (split_info, left_node, right_node)}
+        self.assertEqual([(split_info, 0.5, [(right_split_info, -1, 1)])],
+                         VerticalBooster._assemble_tree(root))
+
+
+if __name__ == '__main__':
+    unittest.main()
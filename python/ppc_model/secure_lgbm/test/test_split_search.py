@@ -0,0 +1,100 @@
+import unittest
+import numpy as np
+
+from ppc_model.secure_lgbm.vertical.active_party import VerticalLGBMActiveParty
+from ppc_model.secure_lgbm.vertical.booster import VerticalBooster
+
+
+def loop_hist(X_bin, instance, glist, hlist):
+    g_hist, h_hist = [], []
+    for k in range(X_bin.shape[1]):
+        Xk_bin = X_bin[instance, k]
+        sorted_x = sorted(set(X_bin[:, k]))
+        g_hist.append([glist[Xk_bin == v].sum() for v in sorted_x])
+        h_hist.append([hlist[Xk_bin == v].sum() for v in sorted_x])
+    return g_hist, h_hist
+
+
+def loop_best_split(feature_select, categorical_idx, glist, hlist, grad_hist, hess_hist,
+                    lr, λ, reg_alpha):
+    # 逐个 (特征, 分桶) 比较的参考实现
+    best = (None, None, 0, None, None)
+    g, h = np.sum(glist), np.sum(hlist)
+    for feature in feature_select:
+        gl, hl = 0, 0
+        for value in range(len(grad_hist[feature])):
+            gl, hl = VerticalBooster._compute_gh_sum(
+                feature, value, categorical_idx, gl, hl, grad_hist, hess_hist)
+            gain = VerticalBooster._compute_gain(g, h, gl, hl, g - gl, h - hl, λ)
+            wl, wr = VerticalBooster._compute_leaf_weight(
+                lr, λ, gl, hl, g - gl, h - hl, reg_alpha)
+            if gain > best[2]:
+                best = (feature, value, gain, wl, wr)
+    return best
+
+
+class TestSplitSearch(unittest.TestCase):
+
+    def test_calculate_hist(self):
+        X_bin = np.random.randint(0, 6, size=(300, 4))
+        X_bin[:, 2] = X_bin[:, 2] * 2
+        glist = np.random.rand(300) - 0.5
+        hlist = np.random.rand(300)
+        instance = np.sort(np.random.choice(300, 120, replace=False))
+        bin_index, bin_num = VerticalBooster._dense_bin_index(X_bin)
+        g_hist, h_hist = VerticalLGBMActiveParty._calculate_hist(
+            bin_index, bin_num, instance, glist[instance], hlist[instance])
+        expected_g, expected_h = loop_hist(
+            X_bin, instance, glist[instance], hlist[instance])
+        for k in range(X_bin.shape[1]):
+            assert np.allclose(expected_g[k], g_hist[k])
+            assert np.allclose(expected_h[k], h_hist[k])
+
+    def test_node_bin_order(self):
+        X_bin = np.random.randint(0, 6, size=(300, 4))
+        bin_index, bin_num = VerticalBooster._dense_bin_index(X_bin)
+        bin_rows = VerticalBooster._csr_bin_index(bin_index)
+        # 节点样本无序, 与按特征偏移后的组号排序结果一致
+        instance = np.random.choice(300, 120, replace=False)
+        order = VerticalBooster._node_bin_order(bin_rows, instance)
+        group_ids = (bin_index[:, instance] +
+                     np.arange(4)[:, np.newaxis] * bin_num.max()).ravel()
+        self.assertListEqual(sorted(order), list(range(group_ids.size)))
+        self.assertListEqual(list(np.sort(group_ids)), list(group_ids[order]))
+
+    def _check_best_split(self, categorical_idx, λ, reg_alpha):
+        feature_num = 6
+        grad_hist = [np.random.randint(-50, 50, size=np.random.randint(1, 8)) / 10
+                     for _ in range(feature_num)]
+        hess_hist = [np.random.randint(0, 50, size=len(gk)) / 10 for gk in grad_hist]
+        glist = np.concatenate(grad_hist[:1])
+        hlist = np.concatenate(hess_hist[:1])
+        feature_select = [4, 0, 1, 3, 5]
+
+        g, h = np.sum(glist), np.sum(hlist)
+        feature, value, gain, gl, hl = VerticalBooster._compute_best_split(
+            feature_select, categorical_idx, g, h, λ, grad_hist, hess_hist)
+        expected = loop_best_split(feature_select, categorical_idx, glist, hlist,
+                                   grad_hist, hess_hist, 0.1, λ, reg_alpha)
+        self.assertEqual(expected[:3], (feature, value, gain))
+        if feature is not None:
+            self.assertEqual(expected[3:], VerticalBooster._compute_leaf_weight(
+                0.1, λ, gl, hl, g - gl, h - hl, reg_alpha))
+
+    def test_best_split(self):
+        for _ in range(50):
+            self._check_best_split([], 1, 0)
+            self._check_best_split([1, 4], 1, 0)
+            self._check_best_split([0, 3], 0.5, 0.3)
+            # λ为0时部分分桶的 hl + λ 为0
+            self._check_best_split([5], 0, 1)
+
+    def test_no_split(self):
+        grad_hist = [np.zeros(3)]
+        hess_hist = [np.ones(3)]
+        self.assertEqual((None, None, 0, None, None), VerticalBooster._compute_best_split(
+            [0], [], 0, 3, 1, grad_hist, hess_hist))
+
+
+if __name__ == '__main__':
+    unittest.main()
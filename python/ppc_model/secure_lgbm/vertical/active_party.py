@@ -10,6 +10,7 @@ from ppc_common.ppc_ml.feature.feature_importance import FeatureImportanceStore
 from ppc_common.ppc_ml.feature.feature_importance import FeatureImportanceType
 from ppc_common.ppc_protos.generated.ppc_model_pb2 import BestSplitInfo, IterationRequest
 from ppc_common.ppc_utils import utils
+from ppc_model.common.protocol import MaskMessage
 from ppc_model.datasets.data_reduction.feature_selection import FeatureSelection
 from ppc_model.datasets.data_reduction.sampling import Sampling
 from ppc_model.datasets.dataset import SecureDataset
@@ -63,14 +64,18 @@ class VerticalLGBMActiveParty(VerticalBooster):
                           f'feature select: {len(feature_select)}, {feature_select}.')
 
             # 构建
-            tree = self._build_tree(
-                feature_select, instance, used_glist, used_hlist)
+            rest = self._init_tree_rows(instance)
+            if self.params.level_wise:
+                tree = self._build_tree_level_wise(
+                    feature_select, instance, used_glist, used_hlist, rest)
+            else:
+                tree = self._build_tree(
+                    feature_select, instance, used_glist, used_hlist, rest)
             self._trees.append(tree)
             # print('tree', tree)
 
-            # 预测
-            self._train_weights += self._predict_tree(
-                tree, self._X_bin, np.ones(self._X_bin.shape[0], dtype=bool), LGBMMessage.PREDICT_LEAF_MASK.value)
+            # 训练样本的叶子在建树时已确定
+            self._train_weights += self._tree_weights
             self._train_praba = self._loss_func.sigmoid(self._train_weights)
             # print('train_praba', set(self._train_praba))
 
@@ -85,9 +90,7 @@ class VerticalLGBMActiveParty(VerticalBooster):
 
             # 预测验证集
             self._test_weights += self._predict_tree(
-                tree, self._test_X_bin, np.ones(
-                    self._test_X_bin.shape[0], dtype=bool),
-                LGBMMessage.TEST_LEAF_MASK.value)
+                tree, self._test_X_bin, LGBMMessage.TEST_LEAF_MASK.value)
             self._test_praba = self._loss_func.sigmoid(self._test_weights)
             if not self.params.silent and self.dataset.test_y is not None:
                 auc = Evaluation.fevaluation(
@@ -116,9 +119,8 @@ class VerticalLGBMActiveParty(VerticalBooster):
         test_X_bin = self._split_test_data(
             self.ctx, dataset.test_X, self._X_split)
 
-        for tree in self._trees:
-            test_weights += self._predict_tree(
-                tree, test_X_bin, np.ones(test_X_bin.shape[0], dtype=bool), LGBMMessage.VALID_LEAF_MASK.value)
+        test_weights += self._predict_trees(self._trees, test_X_bin,
+                                            LGBMMessage.VALID_SPLIT_MASKS.value)
         test_praba = self._loss_func.sigmoid(test_weights)
         self._test_praba = test_praba
 
@@ -164,6 +166,7 @@ class VerticalLGBMActiveParty(VerticalBooster):
         feat_bin = FeatureBinning(self.ctx)
         self._X_bin, self._X_split = feat_bin.data_binning(
             self.dataset.train_X)
+        self._bin_index, self._bin_num = self._dense_bin_index(self._X_bin)
 
     def _init_each_tree(self):
 
@@ -195,98 +198,167 @@ class VerticalLGBMActiveParty(VerticalBooster):
         enc_ghlist = self.ctx.phe.encrypt_batch_parallel(
             (gh_list).astype('object'))
         self.log.info(f'task {self.ctx.task_id}: Finished n_estimators-{self._tree_id} '
-                      f'encrypt gradient & hessian time_costs: {time.time() - start_time}.')
+                      f'encrypt gradient & hessian time_costs: {time.time() - start_time}, '
+                      f'phe metrics: {self.ctx.phe.metrics()}.')
 
         for partner_index in range(1, len(self.ctx.participant_id_list)):
             self._send_byte_data(self.ctx, f'{LGBMMessage.INSTANCE.value}_{self._tree_id}',
-                                 instance.astype('int64').tobytes(), partner_index)
+                                 MaskMessage.encode_index(instance), partner_index)
             self._send_enc_data(self.ctx, f'{LGBMMessage.ENC_GH_LIST.value}_{self._tree_id}',
                                 enc_ghlist, partner_index)
 
-    def _build_tree(self, feature_select, instance, glist, hlist, depth=0, weight=0):
+    def _build_tree(self, feature_select, instance, glist, hlist, rest, depth=0, weight=0,
+                    hist_context=None, is_left=True):
 
         if depth == self.params.max_depth:
-            return weight
+            return self._record_leaf(instance, rest, weight)
         if self.params.max_depth < 0 and self._leaf_id >= self.params.num_leaves:
-            return weight
+            return self._record_leaf(instance, rest, weight)
 
         self._leaf_id += 1
+        grad_hist, hess_hist = self._get_node_hist(
+            instance, glist, hlist, hist_context, is_left)
         if self.params.colsample_bylevel > 0 and self.params.colsample_bylevel < 1:
             feature_select_level = sorted(np.random.choice(
                 feature_select, size=int(len(feature_select) * self.params.colsample_bylevel), replace=False))
             best_split_info = self._find_best_split(
-                feature_select_level, instance, glist, hlist)
+                feature_select_level, glist, hlist, grad_hist, hess_hist)
         else:
             best_split_info = self._find_best_split(
-                feature_select, instance, glist, hlist)
+                feature_select, glist, hlist, grad_hist, hess_hist)
 
         if best_split_info.best_gain > 0 and best_split_info.best_gain > self.params.min_split_gain:
             gain_list = {FeatureImportanceType.GAIN: best_split_info.best_gain,
                          FeatureImportanceType.WEIGHT: 1}
             self.feature_importance_store.update_feature_importance(
                 best_split_info.feature, gain_list)
-            left_mask, right_mask = self._get_leaf_mask(
-                best_split_info, instance)
+            left_mask, rest_mask = self._split_node_rows(
+                best_split_info, instance, rest)
+            right_mask = ~left_mask
 
             if (abs(best_split_info.w_left) * sum(left_mask) / self.params.lr) < self.params.min_child_weight or \
                     (abs(best_split_info.w_right) * sum(right_mask) / self.params.lr) < self.params.min_child_weight:
-                return weight
+                return self._record_leaf(instance, rest, weight)
             if sum(left_mask) < self.params.min_child_samples or sum(right_mask) < self.params.min_child_samples:
-                return weight
+                return self._record_leaf(instance, rest, weight)
 
+            child_context = self._init_hist_context(left_mask, right_mask)
+            child_context.update({'instance': instance, 'glist': glist, 'hlist': hlist,
+                                  'hist': (grad_hist, hess_hist), 'small_hist': None})
             left_tree = self._build_tree(
                 feature_select, instance[left_mask], glist[left_mask],
-                hlist[left_mask], depth + 1, best_split_info.w_left)
+                hlist[left_mask], rest[rest_mask], depth + 1, best_split_info.w_left,
+                child_context, True)
             right_tree = self._build_tree(
                 feature_select, instance[right_mask], glist[right_mask],
-                hlist[right_mask], depth + 1, best_split_info.w_right)
+                hlist[right_mask], rest[~rest_mask], depth + 1, best_split_info.w_right,
+                child_context, False)
 
             return [(best_split_info, left_tree, right_tree)]
         else:
-            return weight
-
-    def _predict_tree(self, tree, X_bin, leaf_mask, key_type):
-        if not isinstance(tree, list):
-            return tree * leaf_mask
-        else:
-            best_split_info, left_subtree, right_subtree = tree[0]
-            if self.ctx.participant_id_list[best_split_info.agency_idx] == \
-                    self.ctx.components.config_data['AGENCY_ID']:
-                if best_split_info.agency_feature in self.params.my_categorical_idx:
-                    left_mask = X_bin[:,
-                                      best_split_info.agency_feature] == best_split_info.value
-                else:
-                    left_mask = X_bin[:,
-                                      best_split_info.agency_feature] <= best_split_info.value
-            else:
-                left_mask = np.frombuffer(
-                    self._receive_byte_data(
-                        self.ctx,
-                        f'{key_type}_{best_split_info.tree_id}_{best_split_info.leaf_id}',
-                        best_split_info.agency_idx), dtype='bool')
-            right_mask = ~left_mask
-            left_weight = self._predict_tree(
-                left_subtree, X_bin, leaf_mask * left_mask, key_type)
-            right_weight = self._predict_tree(
-                right_subtree, X_bin, leaf_mask * right_mask, key_type)
-            return left_weight + right_weight
-
-    def _find_best_split(self, feature_select, instance, glist, hlist):
+            return self._record_leaf(instance, rest, weight)
+
+    def _build_tree_level_wise(self, feature_select, instance, glist, hlist, rest):
+        """按层构建树, 每层的直方图、分裂信息、样本划分各只交互一次"""
+        data_keys = ('instance', 'glist', 'hlist')
+        root = {'instance': instance, 'glist': glist, 'hlist': hlist, 'rest': rest,
+                'weight': 0, 'hist_context': None, 'is_left': True}
+        nodes = [root]
+        depth = 0
+        while len(nodes) > 0:
+            nodes = self._open_level_nodes(nodes, depth)
+            if len(nodes) == 0:
+                break
+            self.log.info(f'task {self.ctx.task_id}: Starting n_estimators-{self._tree_id} '
+                          f'level-{depth} in active party, node_num: {len(nodes)}.')
+            task_hist = self._get_level_hist(
+                self._level_hist_tasks(nodes, data_keys), depth)
+
+            feature_select_level = feature_select
+            if self.params.colsample_bylevel > 0 and self.params.colsample_bylevel < 1:
+                feature_select_level = sorted(np.random.choice(
+                    feature_select, size=int(len(feature_select) * self.params.colsample_bylevel), replace=False))
+
+            split_info_list = []
+            for node in nodes:
+                node['hist'] = self._get_level_node_hist(node, task_hist)
+                best_split_info = self._get_best_split_point(
+                    feature_select_level, node['glist'], node['hlist'], *node['hist'])
+                self._fill_split_info(best_split_info, node['leaf_id'])
+                if best_split_info.best_gain > 0 and best_split_info.best_gain > self.params.min_split_gain:
+                    gain_list = {FeatureImportanceType.GAIN: best_split_info.best_gain,
+                                 FeatureImportanceType.WEIGHT: 1}
+                    self.feature_importance_store.update_feature_importance(
+                        best_split_info.feature, gain_list)
+                split_info_list.append(best_split_info)
+
+            byte_data = self._pack_split_info_list(split_info_list)
+            for partner_index in range(1, len(self.ctx.participant_id_list)):
+                self._send_byte_data(
+                    self.ctx, f'{LGBMMessage.LEVEL_SPLIT_INFO.value}_{self._tree_id}_{depth}',
+                    byte_data, partner_index)
+            nodes = self._split_level_nodes(
+                nodes, split_info_list, depth, data_keys)
+            depth += 1
+
+        return self._assemble_tree(root)
+
+    def _predict_tree(self, tree, X_bin, key_type):
+        compiled = self._compile_tree(tree)
+        split_nodes = np.flatnonzero(compiled['left'] >= 0)
+        left_masks = np.empty((len(split_nodes), X_bin.shape[0]), dtype=bool)
+        my_nodes, my_masks = self._compute_split_masks(compiled, X_bin)
+        left_masks[np.searchsorted(split_nodes, my_nodes)] = my_masks
+        for row, node in enumerate(split_nodes):
+            if node in my_nodes:
+                continue
+            left_masks[row] = MaskMessage.decode_mask(
+                self._receive_byte_data(
+                    self.ctx,
+                    f'{key_type}_{compiled["tree_id"][node]}_{compiled["leaf_id"][node]}',
+                    compiled['agency_idx'][node]))
+        return compiled['weight'][self._tree_leaf_index(compiled, left_masks)]
+
+    def _predict_trees(self, trees, X_bin, key_type):
+        """批量预测: 每个合作方所有树上的分裂节点掩码只接收一次, 再在本地逐棵树路由样本"""
+        n = X_bin.shape[0]
+        my_agency_id = self.ctx.components.config_data['AGENCY_ID']
+        compiled_trees = [self._compile_tree(tree) for tree in trees]
+        packed_masks = {}
+        for partner_index, partner_id in enumerate(self.ctx.participant_id_list):
+            if partner_id != my_agency_id:
+                packed_masks[partner_index] = np.frombuffer(
+                    self._receive_byte_data(self.ctx, key_type, partner_index),
+                    dtype=np.uint8).reshape(-1, (n + 7) // 8)
+
+        # 合作方的节点在其打包掩码中按 (树, 先序) 排列
+        partner_offsets = dict.fromkeys(packed_masks, 0)
+        weights = np.zeros(n)
+        for compiled in compiled_trees:
+            split_nodes = np.flatnonzero(compiled['left'] >= 0)
+            left_masks = np.empty((len(split_nodes), n), dtype=bool)
+            my_nodes, my_masks = self._compute_split_masks(compiled, X_bin)
+            left_masks[np.searchsorted(split_nodes, my_nodes)] = my_masks
+            for partner_index in packed_masks:
+                rows = np.flatnonzero(
+                    compiled['agency_idx'][split_nodes] == partner_index)
+                offset = partner_offsets[partner_index]
+                left_masks[rows] = self._unpack_split_masks(
+                    packed_masks[partner_index], np.arange(offset, offset + len(rows)), n)
+                partner_offsets[partner_index] += len(rows)
+            weights += compiled['weight'][self._tree_leaf_index(
+                compiled, left_masks)]
+        return weights
+
+    def _find_best_split(self, feature_select, glist, hlist, grad_hist, hess_hist):
 
         self.log.info(f'task {self.ctx.task_id}: Starting n_estimators-{self._tree_id} '
                       f'leaf-{self._leaf_id} in active party.')
-        grad_hist, hess_hist = self._get_gh_hist(instance, glist, hlist)
         best_split_info = self._get_best_split_point(
             feature_select, glist, hlist, grad_hist, hess_hist)
         # print('grad_hist_sum', [sum(sublist) for sublist in grad_hist])
 
-        best_split_info.tree_id = self._tree_id
-        best_split_info.leaf_id = self._leaf_id
-        if best_split_info.best_gain > 0:
-            agency_idx, agency_feature = self._get_best_split_agency(
-                self._all_feature_name, best_split_info.feature)
-            best_split_info.agency_idx = agency_idx
-            best_split_info.agency_feature = agency_feature
+        self._fill_split_info(best_split_info, self._leaf_id)
 
         for partner_index in range(1, len(self.ctx.participant_id_list)):
             self._send_byte_data(
@@ -299,79 +371,115 @@ class VerticalLGBMActiveParty(VerticalBooster):
         # print('best_split_info', best_split_info)
         return best_split_info
 
+    def _fill_split_info(self, best_split_info, leaf_id):
+        best_split_info.tree_id = self._tree_id
+        best_split_info.leaf_id = leaf_id
+        if best_split_info.best_gain > 0:
+            agency_idx, agency_feature = self._get_best_split_agency(
+                self._all_feature_name, best_split_info.feature)
+            best_split_info.agency_idx = agency_idx
+            best_split_info.agency_feature = agency_feature
+
+    def _get_node_hist(self, instance, glist, hlist, hist_context=None, is_left=True):
+        if hist_context is None:
+            return self._get_gh_hist(instance, glist, hlist)
+        if hist_context['small_hist'] is None:
+            # 较大的子节点先构建时, 提前计算较小的兄弟节点的直方图
+            small_mask = hist_context['small_mask']
+            hist_context['small_hist'] = self._get_gh_hist(
+                hist_context['instance'][small_mask],
+                hist_context['glist'][small_mask], hist_context['hlist'][small_mask])
+        if is_left == hist_context['small_is_left']:
+            return hist_context['small_hist']
+        return self._subtract_hist(hist_context['hist'], hist_context['small_hist'])
+
+    @staticmethod
+    def _subtract_hist(parent_hist, child_hist):
+        # 兄弟节点的直方图 = 父节点直方图 - 子节点直方图
+        return tuple([np.asarray(parent_k) - np.asarray(child_k)
+                      for parent_k, child_k in zip(parent, child)]
+                     for parent, child in zip(parent_hist, child_hist))
+
     def _get_gh_hist(self, instance, glist, hlist):
         ghist, hhist = self._calculate_hist(
-            self._X_bin, instance, glist, hlist)
+            self._bin_index, self._bin_num, instance, glist, hlist)
 
         for partner_index in range(1, len(self.ctx.participant_id_list)):
-            partner_feature_name = self._all_feature_name[partner_index]
-
-            partner_ghist = [None] * len(partner_feature_name)
-            partner_hhist = [None] * len(partner_feature_name)
             _, gh_hist = self._receive_enc_data(
                 self.ctx, f'{LGBMMessage.ENC_GH_HIST.value}_{self._tree_id}_{self._leaf_id}',
                 partner_index, matrix_data=True)
-
-            for feature_index in range(len(partner_feature_name)):
-                ghk_hist = np.array(self.ctx.phe.decrypt_batch(
-                    gh_hist[feature_index]), dtype='object')
-                gk_hist, hk_hist = self.unpacking_gh(ghk_hist)
-                partner_ghist[feature_index] = gk_hist
-                partner_hhist[feature_index] = hk_hist
+            partner_ghist, partner_hhist = self._decrypt_partner_hist(gh_hist)
 
             ghist.extend(partner_ghist)
             hhist.extend(partner_hhist)
 
         return ghist, hhist
 
+    def _get_level_hist(self, tasks, depth):
+        level_hist = [self._calculate_hist(self._bin_index, self._bin_num,
+                                           task['instance'], task['glist'], task['hlist'])
+                      for task in tasks]
+
+        for partner_index in range(1, len(self.ctx.participant_id_list)):
+            feature_num = len(self._all_feature_name[partner_index])
+            # 合作方一次发送本层所有任务的直方图, 按 任务 x 特征 排列
+            _, gh_hist = self._receive_enc_data(
+                self.ctx, f'{LGBMMessage.LEVEL_GH_HIST.value}_{self._tree_id}_{depth}',
+                partner_index, matrix_data=True)
+            partner_ghist, partner_hhist = self._decrypt_partner_hist(gh_hist)
+
+            for i, (ghist, hhist) in enumerate(level_hist):
+                ghist.extend(
+                    partner_ghist[i * feature_num:(i + 1) * feature_num])
+                hhist.extend(
+                    partner_hhist[i * feature_num:(i + 1) * feature_num])
+
+        return level_hist
+
+    def _get_level_node_hist(self, node, task_hist):
+        context = node['hist_context']
+        hist = task_hist[node['hist_task']]
+        if context is None or node['is_left'] == context['small_is_left']:
+            return hist
+        return self._subtract_hist(context['hist'], hist)
+
+    def _decrypt_partner_hist(self, gh_hist):
+        partner_ghist = []
+        partner_hhist = []
+        gh_hist = self.ctx.phe.decrypt_matrix(gh_hist)
+        for ghk_hist in gh_hist:
+            gk_hist, hk_hist = self.unpacking_gh(
+                np.array(ghk_hist, dtype='object'))
+            partner_ghist.append(gk_hist)
+            partner_hhist.append(hk_hist)
+        return partner_ghist, partner_hhist
+
     @staticmethod
-    def _calculate_hist(X_bin, instance, used_glist, used_hlist):
-
-        g_hist = []
-        h_hist = []
-        for k in range(X_bin.shape[1]):
-            Xk_bin = X_bin[instance, k]
-            gk_hist = []
-            hk_hist = []
-            sorted_x = sorted(set(X_bin[:, k]))
-            for v in sorted_x:
-                gk_hist.append(used_glist[Xk_bin == v].sum())
-                hk_hist.append(used_hlist[Xk_bin == v].sum())
-            g_hist.append(gk_hist)
-            h_hist.append(hk_hist)
-
-        return g_hist, h_hist
+    def _calculate_hist(bin_index, bin_num, instance, used_glist, used_hlist):
+        # 各特征的分桶下标偏移后拼接, 一次bincount得到所有特征的直方图
+        offsets = np.concatenate([[0], np.cumsum(bin_num)])
+        group_ids = (bin_index[:, instance] + offsets[:-1, np.newaxis]).ravel()
+        feature_num = len(bin_num)
+        g_hist = np.bincount(group_ids, weights=np.tile(used_glist, feature_num),
+                             minlength=offsets[-1])
+        h_hist = np.bincount(group_ids, weights=np.tile(used_hlist, feature_num),
+                             minlength=offsets[-1])
+        return [g_hist[offsets[k]:offsets[k + 1]] for k in range(feature_num)], \
+            [h_hist[offsets[k]:offsets[k + 1]] for k in range(feature_num)]
 
     def _get_best_split_point(self, feature_select, glist, hlist, grad_hist, hess_hist):
 
-        beat_feature, best_value, best_gain, best_wl, best_wr = None, None, 0, None, None
         g = np.sum(glist)
         h = np.sum(hlist)
+        best_feature, best_value, best_gain, gl, hl = self._compute_best_split(
+            feature_select, self.params.categorical_idx, g, h, self.params.λ, grad_hist, hess_hist)
+
+        best_wl, best_wr = None, None
+        if best_feature is not None:
+            best_wl, best_wr = self._compute_leaf_weight(
+                self.params.lr, self.params.λ, gl, hl, g - gl, h - hl, self.params.reg_alpha)
 
-        for feature in feature_select:
-            gl = 0
-            hl = 0
-            for value in range(len(grad_hist[feature])):
-                gl, hl = self._compute_gh_sum(
-                    feature, value, self.params.categorical_idx, gl, hl, grad_hist, hess_hist)
-                gr = g - gl
-                hr = h - hl
-
-                gain = self._compute_gain(g, h, gl, hl, gr, hr, self.params.λ)
-                wl, wr = self._compute_leaf_weight(
-                    self.params.lr, self.params.λ, gl, hl, gr, hr, self.params.reg_alpha)
-                compare = bool(gain > best_gain)
-                # print('f', feature, 'v', value, 'gl', gl, 'gr', gr, 'hl', hl, 'hr', hr,
-                #       'gain', gain, 'wl', wl, 'wr', wr, 'compare', compare)
-
-                if compare:
-                    beat_feature = feature
-                    best_value = value
-                    best_wl = wl
-                    best_wr = wr
-                    best_gain = gain
-
-        return BestSplitInfo(feature=beat_feature,
+        return BestSplitInfo(feature=best_feature,
                              value=best_value,
                              best_gain=best_gain,
                              w_left=best_wl,
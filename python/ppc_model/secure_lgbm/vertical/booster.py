@@ -1,15 +1,18 @@
 import os
+import struct
 import time
 import random
 import json
 import numpy as np
 
+from ppc_common.ppc_crypto.cipher_array import PaillierCipherArray
 from ppc_common.ppc_protos.generated.ppc_model_pb2 import BestSplitInfo
+from ppc_common.ppc_utils import utils
 from ppc_common.ppc_utils.utils import AlgorithmType
 from ppc_model.model_crypto.crypto_aes import encrypt_data, decrypt_data, cipher_to_base64, base64_to_cipher
 from ppc_model.interface.model_base import VerticalModel
 from ppc_model.datasets.dataset import SecureDataset
-from ppc_model.common.protocol import PheMessage
+from ppc_model.common.protocol import MaskMessage, PheMessage
 from ppc_model.common.model_result import ResultFileHandling
 from ppc_model.datasets.feature_binning.feature_binning import FeatureBinning
 from ppc_model.secure_model_base.secure_model_booster import SecureModelBooster
@@ -58,6 +61,44 @@ class VerticalBooster(SecureModelBooster):
                     categorical_idx.append(feature_name.index(i))
         return categorical_idx
 
+    @staticmethod
+    def _dense_bin_index(X_bin):
+        # 每个特征的分桶值映射为 [0, bin_num) 的连续下标, 按特征行存放
+        bin_index = np.empty(X_bin.shape[::-1], dtype=np.int32)
+        bin_num = np.empty(X_bin.shape[1], dtype=np.int64)
+        for i in range(X_bin.shape[1]):
+            sorted_bins, bin_index[i] = np.unique(
+                X_bin[:, i], return_inverse=True)
+            bin_num[i] = len(sorted_bins)
+        return bin_index, bin_num
+
+    @staticmethod
+    def _csr_bin_index(bin_index):
+        # 每个特征的样本下标按分桶排序(CSR的列下标), 第i行中分桶v的样本是连续的一段
+        return np.argsort(bin_index, axis=1, kind='stable').astype(np.int32)
+
+    @staticmethod
+    def _node_bin_order(bin_rows, instance):
+        """节点样本按(特征, 分桶)排序后的展开下标, 即 bin_index[:, instance] 展开后的排序下标
+
+        以样本位置表作为节点的位图, 每个特征只需按已排序的样本过滤一遍, 不需要重新排序。
+        """
+        feature_num, n = bin_rows.shape
+        position = np.full(n, -1, dtype=np.int64)
+        position[instance] = np.arange(len(instance))
+        node_position = position[bin_rows]
+        node_position = node_position[node_position >= 0].reshape(
+            feature_num, len(instance))
+        return (node_position + np.arange(feature_num)[:, np.newaxis] * len(instance)).ravel()
+
+    @staticmethod
+    def _hist_order(bin_rows, instance, ghlist):
+        # Paillier按组累乘前需要排序, 样本较多的节点从CSR分桶索引直接得到排序结果;
+        # IHC按limb做bincount不需要排序
+        if isinstance(ghlist, PaillierCipherArray) and len(instance) * 4 >= bin_rows.shape[1]:
+            return VerticalBooster._node_bin_order(bin_rows, instance)
+        return None
+
     @staticmethod
     def _compute_gh_sum(feature, value, categorical_idx, gl, hl, grad_hist, hess_hist):
         if feature in categorical_idx:
@@ -96,6 +137,45 @@ class VerticalBooster(SecureModelBooster):
 
         return weight
 
+    @staticmethod
+    def _compute_best_split(feature_select, categorical_idx, g, h, λ, grad_hist, hess_hist):
+        """在所有候选 (特征, 分桶) 上一次计算增益, 返回最大增益的 (feature, value, gain, gl, hl)
+
+        与逐个比较 gain > best_gain 的结果一致: 增益都不大于0时feature为None,
+        增益相同时取特征顺序、分桶顺序在前的分裂点。
+        """
+        gl_list, hl_list, feature_list, value_list = [], [], [], []
+        for feature in feature_select:
+            gk_hist = np.asarray(grad_hist[feature], dtype=float)
+            hk_hist = np.asarray(hess_hist[feature], dtype=float)
+            if feature in categorical_idx:
+                # 类别特征: 左子节点只包含当前类别
+                gl_list.append(gk_hist)
+                hl_list.append(hk_hist)
+            else:
+                gl_list.append(np.cumsum(gk_hist))
+                hl_list.append(np.cumsum(hk_hist))
+            feature_list.append(np.full(len(gk_hist), feature))
+            value_list.append(np.arange(len(gk_hist)))
+        if len(gl_list) == 0 or h + λ == 0:
+            return None, None, 0, None, None
+
+        gl = np.concatenate(gl_list)
+        hl = np.concatenate(hl_list)
+        gr = g - gl
+        hr = h - hl
+        # 数组的 x**2 按 x*x 计算, 与标量 x**2 调用的pow可能在最后一位不同;
+        # 指数为数组时逐个元素调用pow, 增益与 _compute_gain 逐位一致
+        two = np.full(len(gl), 2.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gain = np.power(gl, two) / (hl + λ) + np.power(gr, two) / (hr + λ) - g**2 / (h + λ)
+        gain[(hl + λ == 0) | (hr + λ == 0) | np.isnan(gain)] = 0
+        best_index = int(np.argmax(gain))
+        if not gain[best_index] > 0:
+            return None, None, 0, None, None
+        return int(np.concatenate(feature_list)[best_index]), int(np.concatenate(value_list)[best_index]), \
+            gain[best_index], gl[best_index], hl[best_index]
+
     @staticmethod
     def _get_leaf_instance(X, instance, feature, value, my_categorical_idx):
 
@@ -108,6 +188,17 @@ class VerticalBooster(SecureModelBooster):
 
         return left_mask, right_mask
 
+    @staticmethod
+    def _init_hist_context(left_mask, right_mask):
+        """子节点共享的直方图状态
+
+        只对样本较少的子节点计算(密文)直方图, 另一个子节点的直方图由父节点直方图相减得到。
+        两方根据相同的分裂结果得到相同的选择, 样本数相同时选择左子节点。
+        """
+        small_is_left = bool(np.sum(left_mask) <= np.sum(right_mask))
+        return {'small_is_left': small_is_left,
+                'small_mask': left_mask if small_is_left else right_mask}
+
     def _get_leaf_mask(self, split_info, instance):
 
         if self.ctx.participant_id_list[split_info.agency_idx] == self.ctx.components.config_data['AGENCY_ID']:
@@ -117,16 +208,179 @@ class VerticalBooster(SecureModelBooster):
                 if self.ctx.participant_id_list[partner_index] != self.ctx.components.config_data['AGENCY_ID']:
                     self._send_byte_data(
                         self.ctx, f'{LGBMMessage.INSTANCE_MASK.value}_{self._tree_id}_{self._leaf_id}',
-                        left_mask.astype('bool').tobytes(), partner_index)
+                        MaskMessage.encode_mask(left_mask), partner_index)
         else:
-            left_mask = np.frombuffer(
+            left_mask = MaskMessage.decode_mask(
                 self._receive_byte_data(
                     self.ctx, f'{LGBMMessage.INSTANCE_MASK.value}_{self._tree_id}_{self._leaf_id}',
-                    split_info.agency_idx), dtype='bool')
+                    split_info.agency_idx))
             right_mask = ~left_mask
 
         return left_mask, right_mask
 
+    def _init_tree_rows(self, instance):
+        """开始一棵树: 清空训练样本的叶子权重, 返回未抽样的样本
+
+        未抽样的样本在建树时与抽样样本一起划分, 不参与直方图计算,
+        建树结束时所有训练样本的叶子已经确定, 不需要再对训练集预测。
+        """
+        n = self._X_bin.shape[0]
+        self._tree_weights = self._init_weight(n)
+        return np.setdiff1d(np.arange(n), instance)
+
+    def _record_leaf(self, instance, rest, weight):
+        # 记录叶子上抽样与未抽样样本的权重
+        self._tree_weights[instance] = weight
+        self._tree_weights[rest] = weight
+        return weight
+
+    def _split_node_rows(self, split_info, instance, rest):
+        """划分节点的抽样样本和未抽样样本, 两者的掩码合并为一条消息"""
+        rows = instance if len(rest) == 0 else np.concatenate([instance, rest])
+        left_mask, _ = self._get_leaf_mask(split_info, rows)
+        return left_mask[:len(instance)], left_mask[len(instance):]
+
+    def _open_level_nodes(self, nodes, depth):
+        # 达到深度或叶子数上限的节点直接作为叶子, 其余节点依次分配leaf_id
+        open_nodes = []
+        for node in nodes:
+            if depth == self.params.max_depth or \
+                    (self.params.max_depth < 0 and self._leaf_id >= self.params.num_leaves):
+                node['tree'] = self._record_leaf(
+                    node['instance'], node['rest'], node['weight'])
+                continue
+            self._leaf_id += 1
+            node['leaf_id'] = self._leaf_id
+            open_nodes.append(node)
+        return open_nodes
+
+    @staticmethod
+    def _level_hist_tasks(nodes, data_keys):
+        """一层中需要计算直方图的样本集合: 根节点, 以及每对兄弟节点中样本较少的子节点
+
+        兄弟节点共用同一个任务, 任务下标记录在 node['hist_task']。
+        """
+        tasks = []
+        task_contexts = []
+        for node in nodes:
+            context = node['hist_context']
+            task_index = next((i for i, task_context in enumerate(task_contexts)
+                               if context is not None and task_context is context), None)
+            if task_index is None:
+                task_index = len(tasks)
+                if context is None:
+                    tasks.append({key: node[key] for key in data_keys})
+                else:
+                    small_mask = context['small_mask']
+                    tasks.append({key: context[key][small_mask]
+                                  for key in data_keys})
+                task_contexts.append(context)
+            node['hist_task'] = task_index
+        return tasks
+
+    def _split_level_nodes(self, nodes, split_info_list, depth, data_keys):
+        """根据一层的分裂信息划分样本, 返回下一层的节点"""
+        split_nodes = []
+        for node, split_info in zip(nodes, split_info_list):
+            if split_info.best_gain > 0 and split_info.best_gain > self.params.min_split_gain:
+                split_nodes.append((node, split_info))
+            else:
+                node['tree'] = self._record_leaf(
+                    node['instance'], node['rest'], node['weight'])
+
+        left_masks = self._get_level_leaf_mask(split_nodes, depth)
+        children = []
+        for (node, split_info), node_mask in zip(split_nodes, left_masks):
+            size = len(node['instance'])
+            left_mask, rest_mask = node_mask[:size], node_mask[size:]
+            right_mask = ~left_mask
+            if (abs(split_info.w_left) * sum(left_mask) / self.params.lr) < self.params.min_child_weight or \
+                    (abs(split_info.w_right) * sum(right_mask) / self.params.lr) < self.params.min_child_weight or \
+                    sum(left_mask) < self.params.min_child_samples or sum(right_mask) < self.params.min_child_samples:
+                node['tree'] = self._record_leaf(
+                    node['instance'], node['rest'], node['weight'])
+                continue
+            context = self._init_hist_context(left_mask, right_mask)
+            context.update({key: node[key] for key in data_keys})
+            context['hist'] = node.get('hist')
+            left_node = {key: node[key][left_mask] for key in data_keys}
+            left_node.update({'rest': node['rest'][rest_mask], 'weight': split_info.w_left,
+                             'hist_context': context, 'is_left': True})
+            right_node = {key: node[key][right_mask] for key in data_keys}
+            right_node.update({'rest': node['rest'][~rest_mask], 'weight': split_info.w_right,
+                              'hist_context': context, 'is_left': False})
+            node['split'] = (split_info, left_node, right_node)
+            children.extend([left_node, right_node])
+        return children
+
+    def _get_level_leaf_mask(self, split_nodes, depth):
+        """一层所有节点的样本划分, 每个参与方把自己特征上的划分结果合并为一条消息发送
+
+        每个节点的掩码依次覆盖抽样样本和未抽样样本。
+        """
+        key_type = f'{LGBMMessage.LEVEL_INSTANCE_MASK.value}_{self._tree_id}_{depth}'
+        my_index = self.ctx.participant_id_list.index(
+            self.ctx.components.config_data['AGENCY_ID'])
+        left_masks = [None] * len(split_nodes)
+        for i, (node, split_info) in enumerate(split_nodes):
+            if split_info.agency_idx == my_index:
+                left_masks[i], _ = self._get_leaf_instance(
+                    self._X_bin, np.concatenate([node['instance'], node['rest']]),
+                    split_info.agency_feature,
+                    split_info.value, self.params.my_categorical_idx)
+
+        my_masks = [mask for mask in left_masks if mask is not None]
+        if len(my_masks) > 0:
+            byte_data = MaskMessage.encode_mask(np.concatenate(my_masks))
+            for partner_index in range(0, len(self.ctx.participant_id_list)):
+                if partner_index != my_index:
+                    self._send_byte_data(
+                        self.ctx, key_type, byte_data, partner_index)
+
+        partner_index_list = sorted(set(split_info.agency_idx for _, split_info in split_nodes
+                                        if split_info.agency_idx != my_index))
+        for partner_index in partner_index_list:
+            masks = MaskMessage.decode_mask(self._receive_byte_data(
+                self.ctx, key_type, partner_index))
+            offset = 0
+            for i, (node, split_info) in enumerate(split_nodes):
+                if split_info.agency_idx == partner_index:
+                    size = len(node['instance']) + len(node['rest'])
+                    left_masks[i] = masks[offset:offset + size]
+                    offset += size
+        return left_masks
+
+    @staticmethod
+    def _assemble_tree(node):
+        # 把按层构建的节点还原为与逐节点构建相同的嵌套结构
+        if 'split' not in node:
+            return node['tree']
+        split_info, left_node, right_node = node['split']
+        return [(split_info, VerticalBooster._assemble_tree(left_node),
+                 VerticalBooster._assemble_tree(right_node))]
+
+    @staticmethod
+    def _pack_split_info_list(split_info_list):
+        # 每个BestSplitInfo前加4字节长度
+        byte_data = b''
+        for split_info in split_info_list:
+            split_info_bytes = utils.pb_to_bytes(split_info)
+            byte_data += struct.pack('>I', len(split_info_bytes)) + split_info_bytes
+        return byte_data
+
+    @staticmethod
+    def _unpack_split_info_list(byte_data):
+        split_info_list = []
+        offset = 0
+        while offset < len(byte_data):
+            length = struct.unpack_from('>I', byte_data, offset)[0]
+            offset += 4
+            split_info = BestSplitInfo()
+            utils.bytes_to_pb(split_info, byte_data[offset:offset + length])
+            split_info_list.append(split_info)
+            offset += length
+        return split_info_list
+
     def _send_enc_data(self, ctx, key_type, enc_data, partner_index, matrix_data=False):
         start_time = time.time()
         partner_id = ctx.participant_id_list[partner_index]
@@ -144,7 +398,7 @@ class VerticalBooster(SecureModelBooster):
             f"task {ctx.task_id}: Sending {key_type} to {partner_id} finished, "
             f"data_length: {len(enc_data)}, time_costs: {time.time() - start_time}s")
 
-    def _receive_enc_data(self, ctx, key_type, partner_index, matrix_data=False):
+    def _receive_enc_data(self, ctx, key_type, partner_index, matrix_data=False, as_array=False):
         start_time = time.time()
         partner_id = ctx.participant_id_list[partner_index]
         # send without payload
@@ -155,7 +409,7 @@ class VerticalBooster(SecureModelBooster):
                 ctx.codec, byte_data)
         else:
             public_key, enc_data = PheMessage.unpacking_data(
-                ctx.codec, byte_data)
+                ctx.codec, byte_data, as_array)
 
         self.logger.info(
             f"task {ctx.task_id}: Received {key_type} from {partner_id} finished, "
@@ -308,23 +562,108 @@ class VerticalBooster(SecureModelBooster):
         # self.my_feature_name = feature_name
         self._trees = trees
 
+    @staticmethod
+    def _compile_tree(tree):
+        """把嵌套的树转换为按先序排列的扁平数组
+
+        left/right为子节点下标, 叶子节点为-1; weight为叶子节点的权重;
+        其余为分裂节点BestSplitInfo的各字段, 叶子节点为0。
+        """
+        fields = BestSplitInfo.DESCRIPTOR.fields
+        columns = {key: [] for key in ['left', 'right', 'weight'] +
+                   [field.name for field in fields]}
+        stack = [(tree, -1, None)]
+        while len(stack) > 0:
+            subtree, parent, side = stack.pop()
+            node = len(columns['left'])
+            if parent >= 0:
+                columns[side][parent] = node
+            columns['left'].append(-1)
+            columns['right'].append(-1)
+            if isinstance(subtree, list):
+                split_info, left_tree, right_tree = subtree[0]
+                columns['weight'].append(0)
+                for field in fields:
+                    columns[field.name].append(getattr(split_info, field.name))
+                stack.append((right_tree, node, 'right'))
+                stack.append((left_tree, node, 'left'))
+            else:
+                columns['weight'].append(subtree)
+                for field in fields:
+                    columns[field.name].append(0)
+
+        compiled = {'left': np.array(columns['left'], dtype=np.int64),
+                    'right': np.array(columns['right'], dtype=np.int64),
+                    'weight': np.array(columns['weight'], dtype=np.float64)}
+        for field in fields:
+            dtype = np.float64 if field.type == field.TYPE_FLOAT else np.int64
+            compiled[field.name] = np.array(columns[field.name], dtype=dtype)
+        return compiled
+
+    @staticmethod
+    def _decompile_tree(compiled, node=0):
+        if compiled['left'][node] < 0:
+            return compiled['weight'][node].item()
+        best_split_info = BestSplitInfo()
+        for field in best_split_info.DESCRIPTOR.fields:
+            setattr(best_split_info, field.name,
+                    compiled[field.name][node].item())
+        left_tree = VerticalBooster._decompile_tree(
+            compiled, compiled['left'][node])
+        right_tree = VerticalBooster._decompile_tree(
+            compiled, compiled['right'][node])
+        return [(best_split_info, left_tree, right_tree)]
+
+    def _compute_split_masks(self, compiled, X_bin):
+        """本方持有的分裂节点一次算出所有样本是否进入左子树, 返回节点下标和 (节点数, n) 的掩码"""
+        agency_id = np.array(self.ctx.participant_id_list)[
+            compiled['agency_idx']]
+        nodes = np.flatnonzero((compiled['left'] >= 0) & (
+            agency_id == self.ctx.components.config_data['AGENCY_ID']))
+        feature = compiled['agency_feature'][nodes]
+        value = compiled['value'][nodes]
+        columns = X_bin[:, feature]
+        is_categorical = np.isin(feature, self.params.my_categorical_idx)
+        masks = np.where(is_categorical, columns == value, columns <= value)
+        return nodes, masks.T
+
+    @staticmethod
+    def _tree_leaf_index(compiled, left_masks):
+        """所有样本从根节点一起向下走, 每轮未到叶子的样本前进一层, 返回每个样本所在叶子的节点下标
+
+        left_masks的第i行为先序第i个分裂节点的左子树掩码。
+        """
+        left, right = compiled['left'], compiled['right']
+        split_row = np.cumsum(left >= 0) - 1
+        node = np.zeros(left_masks.shape[1], dtype=np.int64)
+        rows = np.flatnonzero(left[node] >= 0)
+        while len(rows) > 0:
+            current = node[rows]
+            node[rows] = np.where(left_masks[split_row[current], rows],
+                                  left[current], right[current])
+            rows = rows[left[node[rows]] >= 0]
+        return node
+
+    def _pack_trees_split_masks(self, compiled_trees, X_bin):
+        """本方在所有树上的分裂节点按 (树, 先序) 排列, 每个节点的掩码打包为 ceil(n/8) 字节"""
+        return b''.join(np.packbits(self._compute_split_masks(compiled, X_bin)[1], axis=1).tobytes()
+                        for compiled in compiled_trees)
+
+    @staticmethod
+    def _unpack_split_masks(packed_masks, rows, n):
+        # packed_masks为 (节点数, ceil(n/8)) 的打包掩码, 只解开需要的行
+        return np.unpackbits(packed_masks[rows], axis=1, count=n).astype(bool)
+
     @staticmethod
     def _serial_tree(tree):
-        if isinstance(tree, list):
-            best_split_info, left_tree, right_tree = tree[0]
-            best_split_info_list = []
-            for field in best_split_info.DESCRIPTOR.fields:
-                best_split_info_list.append(
-                    getattr(best_split_info, field.name))
-            left_tree = VerticalBooster._serial_tree(left_tree)
-            right_tree = VerticalBooster._serial_tree(right_tree)
-            best_split_info_list.extend([left_tree, right_tree])
-            return best_split_info_list
-        else:
-            return tree
+        return {key: value.tolist() for key, value in VerticalBooster._compile_tree(tree).items()}
 
     @staticmethod
     def _deserial_tree(tree_list):
+        if isinstance(tree_list, dict):
+            return VerticalBooster._decompile_tree(
+                {key: np.array(value) for key, value in tree_list.items()})
+        # 兼容旧版本保存的嵌套列表格式
         if isinstance(tree_list, list):
             best_split_info_list = tree_list[:-2]
             left_tree, right_tree = tree_list[-2:]
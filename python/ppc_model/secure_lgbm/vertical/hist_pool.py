@@ -0,0 +1,148 @@
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ppc_common.ppc_crypto.cipher_array import CipherArray, encrypted_bincount
+from ppc_model.secure_lgbm.vertical.booster import VerticalBooster
+
+# 工作进程内的共享数据, 由 _init_worker 和 _load_tree 设置
+_worker_data = {}
+
+
+def _attach_array(meta):
+    name, shape, dtype = meta
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _init_worker(bin_index_meta, bin_rows_meta, bin_num):
+    _worker_data['bin_index'] = _attach_array(bin_index_meta)
+    _worker_data['bin_rows'] = _attach_array(bin_rows_meta)
+    _worker_data['bin_num'] = bin_num
+
+
+def _load_tree(tree):
+    # 每棵树的加密梯度只解码一次, 缓存在工作进程中
+    if _worker_data.get('tree_name') == tree['name']:
+        return
+    if 'tree_shm' in _worker_data:
+        _worker_data.pop('tree_shm').close()
+    shm = shared_memory.SharedMemory(name=tree['name'])
+    root_num, width = tree['root_num'], tree['width']
+    instance_bytes = root_num * 8
+    cipher_bytes = root_num * width
+    instance = np.ndarray(root_num, dtype=np.int64, buffer=shm.buf).copy()
+    buffer = shm.buf[instance_bytes:instance_bytes + cipher_bytes]
+    exponent_buffer = None
+    if tree['has_exponent']:
+        exponent_buffer = shm.buf[instance_bytes + cipher_bytes:
+                                  instance_bytes + cipher_bytes + 4 * root_num]
+    ghlist = tree['codec'].decode_cipher_array(
+        tree['public_key'], buffer, root_num, width, exponent_buffer, as_array=True)
+    del buffer, exponent_buffer
+    _worker_data.update({'tree_name': tree['name'], 'tree_shm': shm,
+                         'instance': instance, 'ghlist': ghlist})
+
+
+def _calculate_hist(task):
+    tree = task['tree']
+    _load_tree(tree)
+    positions = np.flatnonzero(np.unpackbits(
+        task['bitmap'], count=tree['root_num']))
+    instance = _worker_data['instance'][positions]
+    ghlist = _worker_data['ghlist'][positions]
+    start, end = task['feature_range']
+    bin_index = _worker_data['bin_index'][1][start:end, instance]
+    bin_rows = _worker_data['bin_rows'][1][start:end]
+    hist = encrypted_bincount(bin_index, ghlist, _worker_data['bin_num'][start:end],
+                              VerticalBooster._hist_order(bin_rows, instance, ghlist))
+    return CipherArray.concatenate(hist).encode(be_secure=False)
+
+
+class HistWorkerPool:
+    """被动方直方图计算的常驻进程池
+
+    分桶下标在任务内只放入共享内存一次, 加密梯度每棵树放入一次,
+    每个节点只下发特征区间和节点样本在树样本中的位图, 结果以密文buffer返回。
+    """
+
+    def __init__(self, bin_index: np.ndarray, bin_rows: np.ndarray, bin_num: np.ndarray,
+                 processes: int = None) -> None:
+        self.processes = processes or os.cpu_count()
+        self.bin_num = bin_num
+        self.sample_num = bin_index.shape[1]
+        self._shm_list = []
+        bin_index_meta = self._share(bin_index)
+        bin_rows_meta = self._share(bin_rows)
+        self._tree_shm = None
+        self._tree = None
+        self._tree_position = None
+        self._pool = multiprocessing.Pool(self.processes, initializer=_init_worker,
+                                          initargs=(bin_index_meta, bin_rows_meta, bin_num))
+
+    def _share(self, array: np.ndarray):
+        shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        self._shm_list.append(shm)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+        return shm.name, array.shape, array.dtype
+
+    def _release_tree(self):
+        if self._tree_shm is not None:
+            self._tree_shm.close()
+            self._tree_shm.unlink()
+            self._tree_shm = None
+            self._tree = None
+
+    def set_tree(self, tree_id, instance: np.ndarray, ghlist: CipherArray, codec, public_key):
+        """放入一棵树的样本和加密梯度, 同一棵树只放入一次"""
+        if self._tree is not None and self._tree['tree_id'] == tree_id:
+            return
+        self._release_tree()
+        instance = np.asarray(instance, dtype=np.int64)
+        width, buffer, exponent_buffer = ghlist.encode(be_secure=False)
+        data = [instance.tobytes(), buffer, exponent_buffer]
+        self._tree_shm = shared_memory.SharedMemory(
+            create=True, size=max(1, sum(len(item) for item in data)))
+        offset = 0
+        for item in data:
+            self._tree_shm.buf[offset:offset + len(item)] = item
+            offset += len(item)
+        self._tree = {'tree_id': tree_id, 'name': self._tree_shm.name, 'root_num': len(instance),
+                      'width': width, 'has_exponent': len(exponent_buffer) > 0,
+                      'codec': codec, 'public_key': public_key}
+        # 树内节点的样本互不重复, 节点样本由其在树样本中的位置表示
+        self._tree_position = np.full(self.sample_num, -1, dtype=np.int64)
+        self._tree_position[instance] = np.arange(len(instance))
+
+    def calculate_hist(self, instance: np.ndarray) -> list:
+        """计算当前树中一个节点所有特征的直方图, 返回每个特征的CipherArray"""
+        bitmap = np.zeros(self._tree['root_num'], dtype=bool)
+        bitmap[self._tree_position[instance]] = True
+        bitmap = np.packbits(bitmap)
+        feature_num = len(self.bin_num)
+        chunks = np.array_split(np.arange(feature_num), min(feature_num, self.processes))
+        tasks = [{'tree': self._tree, 'bitmap': bitmap,
+                  'feature_range': (chunk[0], chunk[-1] + 1)} for chunk in chunks]
+
+        codec, public_key = self._tree['codec'], self._tree['public_key']
+        gh_hist = []
+        for chunk, (width, buffer, exponent_buffer) in zip(
+                chunks, self._pool.map(_calculate_hist, tasks)):
+            bin_num = self.bin_num[chunk]
+            hist = codec.decode_cipher_array(public_key, buffer, int(bin_num.sum()), width,
+                                             exponent_buffer or None, as_array=True)
+            offsets = np.concatenate([[0], np.cumsum(bin_num)])
+            gh_hist.extend([hist[offsets[i]:offsets[i + 1]]
+                            for i in range(len(chunk))])
+        return gh_hist
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        self._release_tree()
+        for shm in self._shm_list:
+            shm.close()
+            shm.unlink()
+        self._shm_list = []
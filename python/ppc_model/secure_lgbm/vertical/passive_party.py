@@ -1,15 +1,17 @@
-import multiprocessing
 import time
 import json
 import numpy as np
 from pandas import DataFrame
 
+from ppc_common.ppc_crypto.cipher_array import CipherArray, encrypted_bincount
 from ppc_common.ppc_utils import utils
 from ppc_common.ppc_protos.generated.ppc_model_pb2 import BestSplitInfo, IterationRequest
+from ppc_model.common.protocol import MaskMessage
 from ppc_model.datasets.dataset import SecureDataset
 from ppc_model.datasets.feature_binning.feature_binning import FeatureBinning
 from ppc_model.secure_lgbm.secure_lgbm_context import SecureLGBMContext, LGBMMessage
 from ppc_model.secure_lgbm.vertical.booster import VerticalBooster
+from ppc_model.secure_lgbm.vertical.hist_pool import HistWorkerPool
 
 
 class VerticalLGBMPassiveParty(VerticalBooster):
@@ -18,6 +20,7 @@ class VerticalLGBMPassiveParty(VerticalBooster):
         super().__init__(ctx, dataset)
         self.params = ctx.model_params
         self._all_feature_name = []
+        self._hist_pool = None
         self.log = ctx.components.logger()
         self.log.info(
             f'task {self.ctx.task_id}: print all params: {self.params.get_all_params()}')
@@ -33,35 +36,39 @@ class VerticalLGBMPassiveParty(VerticalBooster):
         self._test_X_bin = self._split_test_data(
             self.ctx, self.dataset.test_X, self._X_split)
 
-        for _ in range(self.params.n_estimators):
-            self._tree_id += 1
-            start_time = time.time()
-            self.log.info(
-                f'task {self.ctx.task_id}: Starting n_estimators-{self._tree_id} in passive party.')
-
-            # 初始化
-            instance, used_ghlist, public_key = self._receive_gh_instance_list()
-            self.ctx.phe.public_key = public_key
-            self.log.info(
-                f'task {self.ctx.task_id}: Sampling number: {len(instance)}.')
-
-            # 构建
-            tree = self._build_tree(instance, used_ghlist)
-            self._trees.append(tree)
-
-            # 预测
-            self._predict_tree(tree, self._X_bin,
-                               LGBMMessage.PREDICT_LEAF_MASK.value)
-            self.log.info(f'task {self.ctx.task_id}: Ending n_estimators-{self._tree_id}, '
-                          f'time_costs: {time.time() - start_time}s.')
-
-            # 预测验证集
-            self._predict_tree(tree, self._test_X_bin,
-                               LGBMMessage.TEST_LEAF_MASK.value)
-            if self._iteration_early_stop():
+        try:
+            for _ in range(self.params.n_estimators):
+                self._tree_id += 1
+                start_time = time.time()
                 self.log.info(
-                    f"task {self.ctx.task_id}: lgbm early stop after {self._tree_id} iterations.")
-                break
+                    f'task {self.ctx.task_id}: Starting n_estimators-{self._tree_id} in passive party.')
+
+                # 初始化
+                instance, used_ghlist, public_key = self._receive_gh_instance_list()
+                self.ctx.phe.public_key = public_key
+                self._tree_instance, self._tree_ghlist = instance, used_ghlist
+                self.log.info(
+                    f'task {self.ctx.task_id}: Sampling number: {len(instance)}.')
+
+                # 构建, 训练样本的叶子在建树时已确定
+                rest = self._init_tree_rows(instance)
+                if self.params.level_wise:
+                    tree = self._build_tree_level_wise(instance, used_ghlist, rest)
+                else:
+                    tree = self._build_tree(instance, used_ghlist, rest)
+                self._trees.append(tree)
+                self.log.info(f'task {self.ctx.task_id}: Ending n_estimators-{self._tree_id}, '
+                              f'time_costs: {time.time() - start_time}s.')
+
+                # 预测验证集
+                self._predict_tree(tree, self._test_X_bin,
+                                   LGBMMessage.TEST_LEAF_MASK.value)
+                if self._iteration_early_stop():
+                    self.log.info(
+                        f"task {self.ctx.task_id}: lgbm early stop after {self._tree_id} iterations.")
+                    break
+        finally:
+            self._close_hist_pool()
 
         self._end_passive_data()
 
@@ -79,8 +86,10 @@ class VerticalLGBMPassiveParty(VerticalBooster):
         test_X_bin = self._split_test_data(
             self.ctx, dataset.test_X, self._X_split)
 
-        [self._predict_tree(
-            tree, test_X_bin, LGBMMessage.VALID_LEAF_MASK.value) for tree in self._trees]
+        # 所有树上本方分裂节点的掩码一次发送
+        compiled_trees = [self._compile_tree(tree) for tree in self._trees]
+        self._send_byte_data(self.ctx, LGBMMessage.VALID_SPLIT_MASKS.value,
+                             self._pack_trees_split_masks(compiled_trees, test_X_bin), 0)
         self.log.info(
             f'task {self.ctx.task_id}: Ending predict, time_costs: {time.time() - start_time}s.')
 
@@ -104,81 +113,99 @@ class VerticalLGBMPassiveParty(VerticalBooster):
         feat_bin = FeatureBinning(self.ctx)
         self._X_bin, self._X_split = feat_bin.data_binning(
             self.dataset.train_X)
+        self._bin_index, self._bin_num = self._dense_bin_index(self._X_bin)
+        self._bin_rows = self._csr_bin_index(self._bin_index)
 
     def _receive_gh_instance_list(self):
 
         self._leaf_id = 0
 
-        instance = np.frombuffer(
+        instance = MaskMessage.decode_index(
             self._receive_byte_data(
-                self.ctx, f'{LGBMMessage.INSTANCE.value}_{self._tree_id}', 0), dtype=np.int64)
+                self.ctx, f'{LGBMMessage.INSTANCE.value}_{self._tree_id}', 0))
         public_key, gh = self._receive_enc_data(
-            self.ctx, f'{LGBMMessage.ENC_GH_LIST.value}_{self._tree_id}', 0)
+            self.ctx, f'{LGBMMessage.ENC_GH_LIST.value}_{self._tree_id}', 0, as_array=True)
 
-        return instance, np.array(gh), public_key
+        return instance, gh, public_key
 
-    def _build_tree(self, instance, ghlist, depth=0, weight=0):
+    def _build_tree(self, instance, ghlist, rest, depth=0, weight=0, hist_context=None):
 
         if depth == self.params.max_depth:
-            return weight
+            return self._record_leaf(instance, rest, weight)
         if self.params.max_depth < 0 and self._leaf_id >= self.params.num_leaves:
-            return weight
+            return self._record_leaf(instance, rest, weight)
 
         self._leaf_id += 1
-        best_split_info = self._find_best_split(instance, ghlist)
+        best_split_info = self._find_best_split(instance, ghlist, hist_context)
 
         if best_split_info.best_gain > 0 and best_split_info.best_gain > self.params.min_split_gain:
-            left_mask, right_mask = self._get_leaf_mask(
-                best_split_info, instance)
+            left_mask, rest_mask = self._split_node_rows(
+                best_split_info, instance, rest)
+            right_mask = ~left_mask
 
             if (abs(best_split_info.w_left) * sum(left_mask) / self.params.lr) < self.params.min_child_weight or \
                     (abs(best_split_info.w_right) * sum(right_mask) / self.params.lr) < self.params.min_child_weight:
-                return weight
+                return self._record_leaf(instance, rest, weight)
             if sum(left_mask) < self.params.min_child_samples or sum(right_mask) < self.params.min_child_samples:
-                return weight
+                return self._record_leaf(instance, rest, weight)
 
+            child_context = self._init_hist_context(left_mask, right_mask)
+            child_context.update(
+                {'instance': instance, 'ghlist': ghlist, 'hist_sent': False})
             left_tree = self._build_tree(
-                instance[left_mask], ghlist[left_mask],
-                depth + 1, best_split_info.w_left)
+                instance[left_mask], ghlist[left_mask], rest[rest_mask],
+                depth + 1, best_split_info.w_left, child_context)
             right_tree = self._build_tree(
-                instance[right_mask], ghlist[right_mask],
-                depth + 1, best_split_info.w_right)
+                instance[right_mask], ghlist[right_mask], rest[~rest_mask],
+                depth + 1, best_split_info.w_right, child_context)
 
             return [(best_split_info, left_tree, right_tree)]
         else:
-            return weight
+            return self._record_leaf(instance, rest, weight)
+
+    def _build_tree_level_wise(self, instance, ghlist, rest):
+        """按层构建树, 每层的直方图、分裂信息、样本划分各只交互一次"""
+        data_keys = ('instance', 'ghlist')
+        root = {'instance': instance, 'ghlist': ghlist, 'rest': rest,
+                'weight': 0, 'hist_context': None, 'is_left': True}
+        nodes = [root]
+        depth = 0
+        while len(nodes) > 0:
+            nodes = self._open_level_nodes(nodes, depth)
+            if len(nodes) == 0:
+                break
+            self.log.info(f'task {self.ctx.task_id}: Starting n_estimators-{self._tree_id} '
+                          f'level-{depth} in passive party, node_num: {len(nodes)}.')
+            self._send_level_hist(
+                self._level_hist_tasks(nodes, data_keys), depth)
+            split_info_list = self._unpack_split_info_list(self._receive_byte_data(
+                self.ctx, f'{LGBMMessage.LEVEL_SPLIT_INFO.value}_{self._tree_id}_{depth}', 0))
+            nodes = self._split_level_nodes(
+                nodes, split_info_list, depth, data_keys)
+            depth += 1
+
+        return self._assemble_tree(root)
 
     def _predict_tree(self, tree, X_bin, key_type):
-        if not isinstance(tree, list):
-            return None
-        else:
-            best_split_info, left_subtree, right_subtree = tree[0]
-            if self.ctx.participant_id_list[best_split_info.agency_idx] == \
-                    self.ctx.components.config_data['AGENCY_ID']:
-                if best_split_info.agency_feature in self.params.my_categorical_idx:
-                    left_mask = X_bin[:,
-                                      best_split_info.agency_feature] == best_split_info.value
-                else:
-                    left_mask = X_bin[:,
-                                      best_split_info.agency_feature] <= best_split_info.value
-                self._send_byte_data(
-                    self.ctx,
-                    f'{key_type}_{best_split_info.tree_id}_{best_split_info.leaf_id}',
-                    left_mask.astype('bool').tobytes(), 0)
-            else:
-                pass
-            left_weight = self._predict_tree(left_subtree, X_bin, key_type)
-            right_weight = self._predict_tree(right_subtree, X_bin, key_type)
-            return [left_weight, right_weight]
+        compiled = self._compile_tree(tree)
+        for node, left_mask in zip(*self._compute_split_masks(compiled, X_bin)):
+            self._send_byte_data(
+                self.ctx,
+                f'{key_type}_{compiled["tree_id"][node]}_{compiled["leaf_id"][node]}',
+                MaskMessage.encode_mask(left_mask), 0)
 
-    def _find_best_split(self, instance, ghlist):
+    def _find_best_split(self, instance, ghlist, hist_context=None):
 
         self.log.info(f'task {self.ctx.task_id}: Starting n_estimators-{self._tree_id} '
                       f'leaf-{self._leaf_id} in passive party.')
-        if len(instance) > 200000:
-            self._get_gh_hist_parallel(instance, ghlist)
-        else:
-            self._get_gh_hist(instance, ghlist)
+        if hist_context is None:
+            self._send_gh_hist(instance, ghlist)
+        elif not hist_context['hist_sent']:
+            # 只发送样本较少的子节点的直方图, 另一个子节点的直方图由主动方相减得到
+            small_mask = hist_context['small_mask']
+            self._send_gh_hist(
+                hist_context['instance'][small_mask], hist_context['ghlist'][small_mask])
+            hist_context['hist_sent'] = True
 
         best_split_info_byte = self._receive_byte_data(
             self.ctx, f'{LGBMMessage.SPLIT_INFO.value}_{self._tree_id}_{self._leaf_id}', 0)
@@ -189,31 +216,26 @@ class VerticalLGBMPassiveParty(VerticalBooster):
                       f'leaf-{self._leaf_id} in passive party.')
         return best_split_info
 
+    def _send_gh_hist(self, instance, ghlist):
+        if len(instance) > 200000:
+            self._get_gh_hist_parallel(instance, ghlist)
+        else:
+            self._get_gh_hist(instance, ghlist)
+
     def _get_gh_hist_parallel(self, instance, ghlist):
 
-        params = []
-        for i in range(len(self.dataset.feature_name)):
-            params.append({
-                'bins': self._X_bin[:, i],
-                'xk_bin': self._X_bin[:, i][instance],
-                'enc_gh_list': ghlist,
-                'phe': self.ctx.phe
-            })
+        # 常驻进程池, 分桶下标和本棵树的加密梯度在共享内存中, 每个节点只下发样本位图
+        if self._hist_pool is None:
+            self._hist_pool = HistWorkerPool(
+                self._bin_index, self._bin_rows, self._bin_num)
+        self._hist_pool.set_tree(self._tree_id, self._tree_instance, self._tree_ghlist,
+                                 self.ctx.codec, self.ctx.phe.public_key)
 
         start_time = time.time()
         self.log.info(f'task {self.ctx.task_id}: Start n_estimators-{self._tree_id} '
                       f'leaf-{self._leaf_id} calculate hist in passive party.')
 
-        # gh_hist = []
-        # with ProcessPoolExecutor() as executor:
-        #     futures = [executor.submit(self._calculate_hist, context) for context in params]
-        # for future in as_completed(futures):
-        #     gh_hist.append(future.result())
-
-        pool = multiprocessing.Pool()
-        gh_hist = pool.map(self._calculate_hist, params)
-        pool.close()
-        pool.join()
+        gh_hist = self._hist_pool.calculate_hist(instance)
 
         self.log.info(f'task {self.ctx.task_id}: End n_estimators-{self._tree_id} '
                       f'leaf-{self._leaf_id} calculate hist time_costs: {time.time() - start_time}s.')
@@ -221,21 +243,24 @@ class VerticalLGBMPassiveParty(VerticalBooster):
                             f'{LGBMMessage.ENC_GH_HIST.value}_{self._tree_id}_{self._leaf_id}',
                             gh_hist, 0, matrix_data=True)
 
+    def _close_hist_pool(self):
+        if self._hist_pool is not None:
+            self._hist_pool.close()
+            self._hist_pool = None
+
     def _get_gh_hist(self, instance, ghlist):
 
-        gh_hist = []
         start_time = time.time()
         self.log.info(f'task {self.ctx.task_id}: Start n_estimators-{self._tree_id} '
                       f'leaf-{self._leaf_id} calculate hist in passive party.')
 
-        for i in range(len(self.dataset.feature_name)):
-            param = {
-                'bins': self._X_bin[:, i],
-                'xk_bin': self._X_bin[:, i][instance],
-                'enc_gh_list': ghlist,
-                'phe': self.ctx.phe
-            }
-            gh_hist.append(self._calculate_hist(param))
+        param = {
+            'bin_index': self._bin_index[:, instance],
+            'bin_num': self._bin_num,
+            'enc_gh_list': ghlist,
+            'order': self._hist_order(self._bin_rows, instance, ghlist)
+        }
+        gh_hist = self._calculate_hist(param)
 
         self.log.info(f'task {self.ctx.task_id}: Start n_estimators-{self._tree_id} '
                       f'leaf-{self._leaf_id} calculate hist time_costs: {time.time() - start_time}s.')
@@ -243,21 +268,32 @@ class VerticalLGBMPassiveParty(VerticalBooster):
                             f'{LGBMMessage.ENC_GH_HIST.value}_{self._tree_id}_{self._leaf_id}',
                             gh_hist, 0, matrix_data=True)
 
+    def _send_level_hist(self, tasks, depth):
+
+        start_time = time.time()
+        # 本层所有任务拼接后一次分组求和, 第t个任务的分桶下标偏移 t * bin_num
+        task_num = len(tasks)
+        instance = np.concatenate([task['instance'] for task in tasks])
+        ghlist = CipherArray.concatenate([task['ghlist'] for task in tasks])
+        task_ids = np.repeat(np.arange(task_num), [
+                             len(task['instance']) for task in tasks])
+        bin_index = self._bin_index[:, instance] + \
+            task_ids * self._bin_num[:, np.newaxis]
+        hist = encrypted_bincount(bin_index, ghlist, self._bin_num * task_num)
+        gh_hist = [hist[k][t * self._bin_num[k]:(t + 1) * self._bin_num[k]]
+                   for t in range(task_num) for k in range(len(hist))]
+
+        self.log.info(f'task {self.ctx.task_id}: n_estimators-{self._tree_id} level-{depth} '
+                      f'calculate hist task_num: {task_num}, time_costs: {time.time() - start_time}s.')
+        self._send_enc_data(self.ctx,
+                            f'{LGBMMessage.LEVEL_GH_HIST.value}_{self._tree_id}_{depth}',
+                            gh_hist, 0, matrix_data=True)
+
     @staticmethod
     def _calculate_hist(param):
-        bins = param['bins']
-        gh_list = param['enc_gh_list']
-        phe = param['phe']
-        xk_bin = param['xk_bin']
-        ghk_hist = []
-        sorted_bins = sorted(set(bins))
-        for v in sorted_bins:
-            # 处理gk_hist中部分分桶没有样本，直接结算值为明文0的情况
-            if len(gh_list[xk_bin == v]) == 0:
-                ghk_hist.append(phe.encrypt(0))
-            else:
-                ghk_hist.append(gh_list[xk_bin == v].sum())
-        return ghk_hist
+        # 所有特征一次分组求和, 没有样本的分桶结果为明文0的密文
+        return encrypted_bincount(param['bin_index'], param['enc_gh_list'], param['bin_num'],
+                                  param.get('order'))
 
     def _iteration_early_stop(self):
 
@@ -41,6 +41,14 @@ class ModelTaskParams(LRModel):
         train_feats: str = None,
         verbose_eval: int = 1,
         categorical_feature: list = [],
+        compact_dataset: bool = False,
+        dataset_mmap: bool = False,
+        sparse_features: bool = False,
+        optimizer: str = 'sgd',
+        max_iter: int = 20,
+        tol: float = 1e-3,
+        lbfgs_memory: int = 10,
+        shuffle: bool = False,
         silent: bool = False
     ):
 
@@ -56,6 +64,18 @@ class ModelTaskParams(LRModel):
         self.silent = silent
         self.lr = self.learning_rate
         self.categorical_feature = categorical_feature
+        # 特征按列存放在一个压缩类型的数组中, 训练集和验证集为其切片, 可选用npy文件内存映射
+        self.compact_dataset = compact_dataset
+        self.dataset_mmap = dataset_mmap
+        # 特征以CSR稀疏矩阵存放, 加密梯度计算跳过零元素
+        self.sparse_features = sparse_features
+        # sgd: 按batch_size的小批量梯度下降; lbfgs: 全量样本梯度上的L-BFGS, 梯度范数小于tol或达到max_iter轮时停止
+        self.optimizer = optimizer
+        self.max_iter = max_iter
+        self.tol = tol
+        self.lbfgs_memory = lbfgs_memory
+        # 每个epoch按random_state和epoch编号确定的排列打乱样本, 各参与方的顺序一致
+        self.shuffle = shuffle
         self.categorical_idx = []
         self.my_categorical_idx = []
 
@@ -80,7 +100,8 @@ class SecureLRContext(SecureModelContext):
         super().__init__(task_id, args, components)
 
         self.phe = PheCipherFactory.build_phe(
-            components.homo_algorithm, components.public_key_length)
+            components.homo_algorithm, components.public_key_length,
+            components.obfuscator_pool_size)
         self.codec = PheCipherFactory.build_codec(components.homo_algorithm)
 
     def create_model_param(self):
@@ -120,8 +141,11 @@ class LRMessage(Enum):
     ENC_D_LIST = "ENC_D_LIST"
     ENC_D_HIST = "ENC_D_HIST"
     D_MATMUL = "D_MATMUL"
+    FEATURE_BOUND = "FEATURE_BOUND"
     PREDICT_LEAF_MASK = "PREDICT_LEAF_MASK"
     TEST_LEAF_MASK = "PREDICT_TEST_LEAF_MASK"
     VALID_LEAF_MASK = "PREDICT_VALID_LEAF_MASK"
     PREDICT_PRABA = "PREDICT_PRABA"
     MODEL_DATA = "MODEL_DATA"
+    LBFGS_GRAM = "LBFGS_GRAM"
+    LBFGS_CURVATURE = "LBFGS_CURVATURE"
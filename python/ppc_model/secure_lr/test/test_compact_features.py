@@ -0,0 +1,71 @@
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from ppc_common.ppc_utils.utils import AlgorithmType
+from ppc_model.datasets.dataset import SecureDataset
+from ppc_model.datasets.test.test_compact_dataset import make_ctx
+from ppc_model.secure_lr.test.test_partner_exchange import make_booster
+from ppc_model.secure_lr.vertical.booster import VerticalBooster
+
+
+class TestCompactFeatures(unittest.TestCase):
+
+    def setUp(self):
+        # 紧凑存储后为int8的特征, 包含int8的边界值
+        n = 200
+        X = np.random.randint(-128, 128, size=(n, 4)).astype(float)
+        X[::10, 0] = -128
+        X[5::10, 0] = 46
+        self.df = SecureDataset.assembling_dataset(X, np.random.randint(0, 2, n))
+        self.workspace = tempfile.mkdtemp()
+
+    def test_rounding_d(self):
+        dataset = SecureDataset(make_ctx(
+            self.workspace, AlgorithmType.Train.name, False), self.df.copy())
+        compact = SecureDataset(make_ctx(
+            self.workspace, AlgorithmType.Train.name, True), self.df.copy())
+        self.assertEqual(np.int8, compact.train_X.dtype)
+
+        x_, x_compact = dataset.train_X[:32], compact.train_X[:32]
+        expected = VerticalBooster.rounding_d(x_)
+        self.assertTrue(np.array_equal(expected, VerticalBooster.rounding_d(x_compact)))
+        self.assertTrue(np.array_equal(
+            expected, make_booster('a', ['a'], {}, 0)._rounding_buffer('x', x_compact)))
+        self.assertEqual(VerticalBooster._feature_bound(dataset.train_X),
+                         VerticalBooster._feature_bound(compact.train_X))
+        self.assertEqual(128000, VerticalBooster._feature_bound(compact.train_X))
+
+    def test_calculate_deriv(self):
+        compact = SecureDataset(make_ctx(
+            self.workspace, AlgorithmType.Train.name, True), self.df.copy())
+        queues = {}
+        boosters = [make_booster(agency_id, ['a', 'b'], queues, 0) for agency_id in ['a', 'b']]
+        x_list = [compact.train_X[:32], np.random.rand(32, 3)]
+        d_list = [np.random.rand(32) - 0.5 for _ in boosters]
+        result = [None] * len(boosters)
+
+        def run(k):
+            booster = boosters[k]
+            booster._exchange_feature_bound(x_list[k])
+            booster._send_d_instance_list(d_list[k])
+            _, d_other_list, partner_index_list = booster._receive_d_instance_list()
+            result[k] = booster._calculate_deriv(
+                x_list[k], d_list[k], partner_index_list, d_other_list)
+
+        threads = [threading.Thread(target=run, args=(k,)) for k in range(len(boosters))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        d_sum = np.sum(d_list, axis=0)
+        for x, deriv in zip(x_list, result):
+            x = x.astype(float)
+            self.assertTrue(np.allclose(x.T @ d_sum / x.shape[0], deriv, atol=1e-1))
+
+
+if __name__ == '__main__':
+    unittest.main()
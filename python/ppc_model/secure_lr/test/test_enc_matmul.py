@@ -49,7 +49,7 @@ class TestEncMatmul(unittest.TestCase):
         x = np.random.randint(0, 10, size=(15, 8))
         enc_arr = task_info.phe.encrypt_batch_parallel((arr).astype('object'))
         enc_x_d = VerticalBooster.enc_matmul(x, enc_arr)
-        x_d_rec = np.array(task_info.phe.decrypt_batch(enc_x_d), dtype='object')
+        x_d_rec = np.array(task_info.phe.decrypt_batch(enc_x_d.to_ciphers()), dtype='object')
         x_d_rec[x_d_rec > 2**(task_info.phe.key_length-1)] -= 2**(task_info.phe.key_length)
 
         assert (np.matmul(x, arr) == x_d_rec).all()
@@ -58,7 +58,7 @@ class TestEncMatmul(unittest.TestCase):
         x_ = VerticalBooster.rounding_d(x)
         enc_arr = task_info.phe.encrypt_batch_parallel((arr_).astype('object'))
         enc_x_d = VerticalBooster.enc_matmul(x_, enc_arr)
-        x_d_rec = np.array(task_info.phe.decrypt_batch(enc_x_d), dtype='object')
+        x_d_rec = np.array(task_info.phe.decrypt_batch(enc_x_d.to_ciphers()), dtype='object')
         x_d_rec = VerticalBooster.recover_d(task_info, x_d_rec, is_square=True)
 
         assert (np.matmul(x, arr) == x_d_rec).all()
@@ -0,0 +1,121 @@
+import logging
+import threading
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+from sklearn.datasets import load_breast_cancer
+from sklearn.preprocessing import StandardScaler
+
+from ppc_common.ppc_crypto.ihc_cipher import IhcCipher
+from ppc_common.ppc_crypto.ihc_codec import IhcCodec
+from ppc_model.metrics.evaluation import Evaluation
+from ppc_model.metrics.loss import BinaryLoss
+from ppc_model.secure_lr.test.test_partner_exchange import MockRouter
+from ppc_model.secure_lr.vertical.active_party import VerticalLRActiveParty
+from ppc_model.secure_lr.vertical.booster import VerticalBooster
+from ppc_model.secure_lr.vertical.passive_party import VerticalLRPassiveParty
+
+
+def make_party(cls, agency_id, participant_id_list, queues, X, y=None):
+    party = cls.__new__(cls)
+    party.ctx = SimpleNamespace(
+        task_id='t-1234', participant_id_list=participant_id_list, phe=IhcCipher(), codec=IhcCodec,
+        components=SimpleNamespace(config_data={'AGENCY_ID': agency_id}),
+        model_router=MockRouter(agency_id, queues, 0))
+    party.params = SimpleNamespace(max_iter=20, tol=1e-3, lbfgs_memory=10)
+    party.dataset = SimpleNamespace(train_X=X, train_y=y)
+    party.logger = logging.getLogger(__name__)
+    party._loss_func = BinaryLoss()
+    party._train_weights = np.zeros(X.shape[1])
+    party._iter_id = 0
+    party._buffers = {}
+    return party
+
+
+class QuadraticBooster(VerticalBooster):
+    # 梯度为 A * w - b 的单方二次函数
+    def _calculate_iter_deriv(self, idx):
+        return self.A @ self._train_weights - self.b
+
+
+class TestLBFGS(unittest.TestCase):
+
+    def test_lbfgs_direction(self):
+        # 系数空间中的递推与显式向量的双循环递推一致
+        dim, k = 12, 4
+        s_list = [np.random.randn(dim) for _ in range(k)]
+        A = np.random.randn(dim, dim)
+        y_list = [(A @ A.T + np.eye(dim)) @ s for s in s_list]
+        g = np.random.randn(dim)
+
+        q, alpha = g.copy(), []
+        for s, y in zip(reversed(s_list), reversed(y_list)):
+            alpha.append(s @ q / (s @ y))
+            q -= alpha[-1] * y
+        r = q * (s_list[-1] @ y_list[-1]) / (y_list[-1] @ y_list[-1])
+        for (s, y), a in zip(zip(s_list, y_list), reversed(alpha)):
+            r += s * (a - y @ r / (s @ y))
+
+        basis = np.column_stack(s_list + y_list + [g])
+        delta = VerticalBooster._lbfgs_direction(basis.T @ basis, k)
+        self.assertTrue(np.allclose(-r, basis @ delta))
+
+    def test_fit_lbfgs(self):
+        X, y = load_breast_cancer(return_X_y=True)
+        X = StandardScaler().fit_transform(X)
+        participant_id_list = ['a', 'b', 'c']
+        queues = {}
+        columns = np.array_split(np.arange(X.shape[1]), 3)
+        parties = [make_party(VerticalLRActiveParty, 'a', participant_id_list, queues, X[:, columns[0]], y)] + \
+            [make_party(VerticalLRPassiveParty, agency_id, participant_id_list, queues, X[:, column])
+             for agency_id, column in zip(participant_id_list[1:], columns[1:])]
+
+        def fit(party, column):
+            party._exchange_feature_bound(party.dataset.train_X)
+            party._fit_lbfgs(np.arange(len(column)))
+
+        threads = [threading.Thread(target=fit, args=(party, column))
+                   for party, column in zip(parties, columns)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 所有参与方在同一轮停止, 密文交互轮数远少于小批量梯度下降
+        self.assertEqual(1, len({party._iter_id for party in parties}))
+        self.assertLessEqual(parties[0]._iter_id, 21)
+
+        # 收敛到泰勒近似损失的最优解 0.125 * X^T X w = X^T (y - 0.5)
+        weights = np.concatenate([party._train_weights for party in parties])
+        expected = np.linalg.lstsq(0.125 * X.T @ X, X.T @ (y - 0.5), rcond=None)[0]
+        loss = BinaryLoss.compute_loss
+        praba, expected_praba = BinaryLoss.sigmoid(X @ weights), BinaryLoss.sigmoid(X @ expected)
+        self.assertLess(loss(y, praba) - loss(y, expected_praba), 0.01)
+        self.assertGreater(Evaluation.fevaluation(y, praba)['auc'], 0.99)
+
+    def test_negative_curvature(self):
+        # 曲率非正时退回试探步之前的权重
+        party = make_party(QuadraticBooster, 'a', ['a'], {}, np.zeros((1, 3)))
+        party.A, party.b = -np.eye(3), np.ones(3)
+        self.assertEqual(0, party._fit_lbfgs(np.arange(3)))
+        self.assertTrue(np.array_equal(np.zeros(3), party._train_weights))
+
+        party = make_party(QuadraticBooster, 'a', ['a'], {}, np.zeros((1, 3)))
+        party.A, party.b = np.diag([1.0, 2.0, 4.0]), np.ones(3)
+        lbfgs_iter = party._fit_lbfgs(np.arange(3))
+        self.assertTrue(0 < lbfgs_iter <= 3)
+        self.assertTrue(np.allclose(party.b / np.diag(party.A), party._train_weights))
+
+    def test_check_optimizer(self):
+        party = make_party(QuadraticBooster, 'a', ['a'], {}, np.zeros((1, 3)))
+        for optimizer in VerticalBooster.OPTIMIZERS:
+            party.params.optimizer = optimizer
+            party._check_optimizer()
+        party.params.optimizer = 'adam'
+        with self.assertRaises(ValueError):
+            party._check_optimizer()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import logging
+import queue
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from ppc_common.ppc_crypto.ihc_cipher import IhcCipher
+from ppc_common.ppc_crypto.ihc_codec import IhcCodec
+from ppc_model.secure_lr.vertical.booster import VerticalBooster
+
+
+class MockRouter:
+    # 按 (发送方, 接收方, 消息类型) 分别排队, pop时模拟网络延迟, 记录同时等待的pop数
+    def __init__(self, agency_id, queues, delay):
+        self.agency_id = agency_id
+        self.queues = queues
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _queue(self, src, dst, task_type):
+        return self.queues.setdefault((src, dst, task_type), queue.Queue())
+
+    def push(self, task_id, task_type, dst_agency, payload):
+        self._queue(self.agency_id, dst_agency, task_type).put(payload)
+
+    def pop(self, task_id, task_type, from_inst):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            return self._queue(from_inst, self.agency_id, task_type).get(timeout=30)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def make_booster(agency_id, participant_id_list, queues, delay):
+    booster = VerticalBooster.__new__(VerticalBooster)
+    booster.ctx = SimpleNamespace(
+        task_id='t-1234', participant_id_list=participant_id_list, phe=IhcCipher(), codec=IhcCodec,
+        components=SimpleNamespace(config_data={'AGENCY_ID': agency_id}),
+        model_router=MockRouter(agency_id, queues, delay))
+    booster.logger = logging.getLogger(__name__)
+    booster._iter_id = 1
+    booster._buffers = {}
+    return booster
+
+
+class TestPartnerExchange(unittest.TestCase):
+
+    def _run_parties(self, participant_id_list, delay, scale=1):
+        queues = {}
+        boosters = [make_booster(agency_id, participant_id_list, queues, delay)
+                    for agency_id in participant_id_list]
+        x_list = [np.random.rand(32, k) for k in range(3, 3 + len(boosters))]
+        d_list = [(np.random.rand(32) - 0.5) * scale for _ in boosters]
+        result = [None] * len(boosters)
+
+        def run(k):
+            booster = boosters[k]
+            booster._exchange_feature_bound(x_list[k])
+            booster._send_d_instance_list(d_list[k])
+            _, d_other_list, partner_index_list = booster._receive_d_instance_list()
+            result[k] = booster._calculate_deriv(
+                x_list[k], d_list[k], partner_index_list, d_other_list)
+
+        threads = [threading.Thread(target=run, args=(k,)) for k in range(len(boosters))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return x_list, d_list, result, boosters
+
+    def test_calculate_deriv(self):
+        x_list, d_list, result, _ = self._run_parties(['a', 'b', 'c', 'd'], 0)
+        d_sum = np.sum(d_list, axis=0)
+        for x, deriv in zip(x_list, result):
+            self.assertTrue(np.allclose(x.T @ d_sum / x.shape[0], deriv, atol=1e-2))
+
+    def test_clip_d(self):
+        # 槽位宽度由公开的D_BOUND确定, 各参与方的d超出时截断, 本方的梯度项也使用截断后的d
+        d_bound = VerticalBooster.D_BOUND
+        x_list, d_list, result, _ = self._run_parties(['a', 'b', 'c'], 0, scale=8)
+        self.assertLessEqual(np.max(np.abs(d_list)), d_bound)
+        self.assertTrue(np.any(np.abs(d_list) == d_bound))
+        d_sum = np.sum(d_list, axis=0)
+        for x, deriv in zip(x_list, result):
+            self.assertTrue(np.allclose(x.T @ d_sum / x.shape[0], deriv, atol=1e-2))
+
+    def test_concurrent_pops(self):
+        # 与各参与方的交互并发执行, 每个参与方都有多个pop同时在等待
+        _, _, _, boosters = self._run_parties(['a', 'b', 'c', 'd'], 0.05)
+        for booster in boosters:
+            self.assertEqual(0, booster.ctx.model_router.in_flight)
+            self.assertGreater(booster.ctx.model_router.max_in_flight, 1)
+
+    def test_reuse_buffers(self):
+        booster = make_booster('a', ['a', 'b'], {}, 0)
+        booster._train_weights = np.random.randn(5)
+        for x_ in [np.random.randn(16, 5), np.random.randn(16, 5).astype(np.float32),
+                   np.random.randint(-100, 100, size=(16, 5)).astype(np.int8)]:
+            x = booster._rounding_buffer('x', x_)
+            self.assertTrue(np.array_equal(VerticalBooster.rounding_d(x_), x))
+            self.assertIs(x, booster._rounding_buffer('x', x_ * 2))
+            self.assertTrue(np.allclose(x_ @ booster._train_weights, booster._batch_dot(x_)))
+
+
+if __name__ == '__main__':
+    unittest.main()
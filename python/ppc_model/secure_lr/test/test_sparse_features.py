@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+from scipy import sparse
+
+from ppc_common.ppc_crypto.ihc_cipher import IhcCipher
+from ppc_common.ppc_utils.utils import AlgorithmType
+from ppc_model.common.protocol import TaskRole
+from ppc_model.datasets.dataset import SecureDataset
+from ppc_model.metrics.loss import BinaryLoss
+from ppc_model.secure_lr.vertical.booster import VerticalBooster
+
+
+def make_ctx(workspace, sparse_features):
+    model_params = SimpleNamespace(
+        test_size=0.3, random_state=2024, eval_set_column=None, train_set_value=None,
+        eval_set_value=None, compact_dataset=False, dataset_mmap=False,
+        sparse_features=sparse_features)
+    return SimpleNamespace(
+        eval_column_file=os.path.join(workspace, 'model_eval_column.csv'),
+        iv_selected_file=os.path.join(workspace, 'iv_selected.csv'),
+        selected_col_file=os.path.join(workspace, 'selected_col.csv'),
+        is_label_holder=True, algorithm_type=AlgorithmType.Train.name,
+        role=TaskRole.ACTIVE_PARTY, model_params=model_params)
+
+
+class TestSparseFeatures(unittest.TestCase):
+
+    def setUp(self):
+        # 独热编码后的宽表
+        n = 500
+        X = np.eye(40)[np.random.randint(0, 40, size=n)]
+        X[:, 0] = np.random.randint(0, 5, size=n)
+        self.df = SecureDataset.assembling_dataset(X, np.random.randint(0, 2, n))
+        self.workspace = tempfile.mkdtemp()
+
+    def test_sparse_dataset(self):
+        dataset = SecureDataset(make_ctx(self.workspace, False), self.df.copy())
+        sparse_dataset = SecureDataset(make_ctx(self.workspace, True), self.df.copy())
+        self.assertTrue(sparse.isspmatrix_csr(sparse_dataset.train_X))
+        self.assertTrue(np.array_equal(dataset.train_X, sparse_dataset.train_X.toarray()))
+        self.assertTrue(np.array_equal(dataset.test_X, sparse_dataset.test_X.toarray()))
+
+        idx = VerticalBooster._get_sample_idx(3, dataset.train_X.shape[0], 16)
+        x_, x_sparse = dataset.train_X[idx], sparse_dataset.train_X[idx]
+        theta = np.random.randn(x_.shape[1])
+        self.assertTrue(np.allclose(BinaryLoss.dot_product(x_, theta),
+                                    BinaryLoss.dot_product(x_sparse, theta)))
+        self.assertEqual(VerticalBooster._feature_bound(dataset.train_X),
+                         VerticalBooster._feature_bound(sparse_dataset.train_X))
+
+    def test_sparse_enc_matmul(self):
+        phe = IhcCipher()
+        x = np.eye(40)[np.random.randint(0, 40, size=64)] * np.random.randint(-9, 10, size=(64, 1))
+        d = np.random.randint(-1000, 1000, size=64)
+        enc_d = phe.encrypt_batch(d)
+        expected = list(np.matmul(x.T, d).astype(int))
+        for arr in [x.T, sparse.csr_matrix(x).T]:
+            enc_x_d = VerticalBooster.enc_matmul(arr, enc_d, phe)
+            self.assertListEqual(expected, phe.decrypt_batch(enc_x_d.to_ciphers()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -40,11 +40,19 @@ class VerticalLRActiveParty(VerticalBooster):
     ) -> None:
         self.log.info(
             f'task {self.ctx.task_id}: Starting the lr on the active party.')
+        self._check_optimizer()
         self._init_active_data()
 
-        max_iter = self._init_iter(self.dataset.train_X.shape[0],
-                                   self.params.epochs, self.params.batch_size)
-        self.log.info(f"task: {self.ctx.task_id}, max_iter: {max_iter}")
+        if self.params.optimizer == 'lbfgs':
+            start_time = time.time()
+            feature_select = self._select_feature()
+            lbfgs_iter = self._fit_lbfgs(feature_select)
+            self.log.info(f"task: {self.ctx.task_id}, lbfgs_iter: {lbfgs_iter}")
+            max_iter = 0
+        else:
+            max_iter = self._init_iter(self.dataset.train_X.shape[0],
+                                       self.params.epochs, self.params.batch_size)
+            self.log.info(f"task: {self.ctx.task_id}, max_iter: {max_iter}")
         for _ in range(max_iter):
             self._iter_id += 1
             start_time = time.time()
@@ -131,23 +139,31 @@ class VerticalLRActiveParty(VerticalBooster):
         self.params.my_categorical_idx = self._get_categorical_idx(
             self.dataset.feature_name, self.params.categorical_feature)
 
-    def _build_iter(self, feature_select, idx):
-
-        x_, y_ = self.dataset.train_X[idx], self.dataset.train_y[idx]
+        # 交换打包所需的特征上界
+        self._exchange_feature_bound(self.dataset.train_X)
 
-        g = self._loss_func.dot_product(x_, self._train_weights)
-        h = 0.5 + self._loss_func.inference(g)
-        d = h - y_
+    def _build_iter(self, feature_select, idx):
 
-        self._send_d_instance_list(d)
-        public_key_list, d_other_list, partner_index_list = self._receive_d_instance_list()
-        deriv = self._calculate_deriv(x_, d, partner_index_list, d_other_list)
+        deriv = self._calculate_iter_deriv(idx)
 
         self._train_weights -= self.params.learning_rate * \
             deriv.astype('float')
         self._train_weights[~np.isin(
             np.arange(len(self._train_weights)), feature_select)] = 0
 
+    def _calculate_iter_deriv(self, idx):
+
+        x_, y_ = self._take_batch(idx, self.dataset.train_X, self.dataset.train_y)
+
+        g = self._batch_dot(x_)
+        d = self._loss_func.inference(g)
+        d += 0.5
+        d -= y_
+
+        self._send_d_instance_list(d)
+        public_key_list, d_other_list, partner_index_list = self._receive_d_instance_list()
+        return self._calculate_deriv(x_, d, partner_index_list, d_other_list)
+
     def _predict_tree(self, X, key_type):
         train_g = self._loss_func.dot_product(X, self._train_weights)
         for i in range(1, len(self.ctx.participant_id_list)):
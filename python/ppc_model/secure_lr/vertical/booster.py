@@ -3,13 +3,18 @@ import time
 import random
 import json
 import itertools
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
+from ppc_common.ppc_crypto.cipher_array import CipherArray
+from ppc_common.ppc_crypto.slot_packing_codec import SlotPackingCodec
 from ppc_common.ppc_protos.generated.ppc_model_pb2 import BestSplitInfo
 from ppc_common.ppc_utils.utils import AlgorithmType
 from ppc_model.model_crypto.crypto_aes import encrypt_data, decrypt_data, cipher_to_base64, base64_to_cipher
 from ppc_model.interface.model_base import VerticalModel
 from ppc_model.datasets.data_reduction.feature_selection import FeatureSelection
+from ppc_model.datasets.data_reduction.mini_batch import MiniBatch
 from ppc_model.datasets.dataset import SecureDataset
 from ppc_model.common.protocol import PheMessage
 from ppc_model.common.model_result import ResultFileHandling
@@ -21,11 +26,24 @@ from ppc_model.secure_model_base.secure_model_booster import SecureModelBooster
 
 
 class VerticalBooster(SecureModelBooster):
+    # 各参与方d的绝对值上界。泰勒近似 sigmoid(g) ≈ 0.5 + 0.125 * g 只在 |g| <= 4 时落在 [0, 1] 内,
+    # 单方的部分 logit 满足 |g| <= 8 时主动方的 0.5 + 0.125 * g - y 和被动方的 0.125 * g 都不超过该上界。
+    # 超出的d截断并记录日志, 打包的槽位宽度不依赖标签和权重
+    D_BOUND = 1.5
+    OPTIMIZERS = ('sgd', 'lbfgs')
+
     def __init__(self, ctx: SecureLRContext, dataset: SecureDataset) -> None:
         super().__init__(ctx)
         self.dataset = dataset
 
         self._iter_id = None
+        self._mini_batch = None
+        # 迭代中复用的数组, 按名称区分
+        self._buffers = {}
+        # 训练前交换一次的特征上界和特征数
+        self._x_bound = None
+        self._feature_num = None
+        self._partner_bounds = None
 
         self._train_weights = None
         self._train_praba = None
@@ -77,17 +95,67 @@ class VerticalBooster(SecureModelBooster):
 
     def _init_each_iter(self):
 
-        idx = self._get_sample_idx(self._iter_id-1, self.dataset.train_X.shape[0],
-                                   size=self.params.batch_size)
-        feature_select = FeatureSelection.feature_selecting(
+        if self._mini_batch is None:
+            self._mini_batch = MiniBatch(self.dataset.train_X.shape[0], self.params.batch_size,
+                                         self.params.shuffle, self.params.random_state)
+        idx = self._mini_batch.batch_index(self._iter_id - 1)
+        feature_select = self._select_feature()
+
+        return idx, feature_select
+
+    def _check_optimizer(self):
+        if self.params.optimizer not in self.OPTIMIZERS:
+            raise ValueError(f'Unsupported optimizer: {self.params.optimizer}, '
+                             f'expected one of {self.OPTIMIZERS}.')
+
+    def _select_feature(self):
+        return FeatureSelection.feature_selecting(
             list(self.dataset.feature_name),
             self.params.train_feature, self.params.feature_rate)
 
-        return idx, feature_select
+    def _take_batch(self, idx, *arrays):
+        """切片返回视图, 下标数组的批次写入mini batch的缓冲区"""
+        if isinstance(idx, slice):
+            return [array[idx] for array in arrays]
+        return self._mini_batch.take(idx, *arrays)
+
+    def _buffer(self, name, shape, dtype):
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer
+
+    def _batch_dot(self, x_):
+        """x_ * weights, 稠密批次写入复用的缓冲区"""
+        if not isinstance(x_, np.ndarray):
+            return self._loss_func.dot_product(x_, self._train_weights)
+        g = self._buffer('g', (x_.shape[0],), np.result_type(x_.dtype, self._train_weights.dtype))
+        return np.matmul(x_, self._train_weights, out=g)
+
+    def _rounding_buffer(self, name, values, expand=1000):
+        """与rounding_d的结果相同, 稠密数组写入复用的缓冲区"""
+        if not isinstance(values, np.ndarray):
+            return self.rounding_d(values, expand)
+        # 与rounding_d一样先提升为float64再放大
+        scaled = self._buffer(f'{name}_scaled', values.shape, np.dtype('float'))
+        np.multiply(values, expand, out=scaled, dtype='float')
+        result = self._buffer(name, values.shape, np.dtype('int'))
+        np.copyto(result, scaled, casting='unsafe')
+        return result
+
+    def _clip_d(self, d):
+        """d原地截断到 [-D_BOUND, D_BOUND], 本方的梯度项和加密发送的d一致"""
+        clipped_num = np.count_nonzero(np.abs(d) > self.D_BOUND)
+        if clipped_num > 0:
+            self.logger.info(f'task {self.ctx.task_id}: iter-{self._iter_id}, '
+                             f'clip {clipped_num}/{d.size} d to [-{self.D_BOUND}, {self.D_BOUND}].')
+            np.clip(d, -self.D_BOUND, self.D_BOUND, out=d)
+        return d
 
     def _send_d_instance_list(self, d):
 
-        d_list = self.rounding_d(d)
+        d_list = self._rounding_buffer('d', self._clip_d(d))
         my_agency_id = self.ctx.components.config_data['AGENCY_ID']
 
         start_time = time.time()
@@ -96,46 +164,83 @@ class VerticalBooster(SecureModelBooster):
         enc_dlist = self.ctx.phe.encrypt_batch_parallel(
             (d_list).astype('object'))
         self.logger.info(f'task {self.ctx.task_id}: Finished iter-{self._iter_id} '
-                         f'encrypt d time_costs: {time.time() - start_time}.')
+                         f'encrypt d time_costs: {time.time() - start_time}, '
+                         f'phe metrics: {self.ctx.phe.metrics()}.')
 
-        for partner_index in range(len(self.ctx.participant_id_list)):
-            if self.ctx.participant_id_list[partner_index] != my_agency_id:
-                self._send_enc_data(self.ctx, f'{LRMessage.ENC_D_LIST.value}_{self._iter_id}',
-                                    enc_dlist, partner_index)
-
-    def _receive_d_instance_list(self):
+        self._map_partners(
+            lambda _, partner_index: self._send_enc_data(
+                self.ctx, f'{LRMessage.ENC_D_LIST.value}_{self._iter_id}', enc_dlist, partner_index),
+            self._partner_index_list())
 
+    def _partner_index_list(self):
         my_agency_id = self.ctx.components.config_data['AGENCY_ID']
+        return [partner_index for partner_index in range(len(self.ctx.participant_id_list))
+                if self.ctx.participant_id_list[partner_index] != my_agency_id]
 
-        public_key_list = []
-        d_other_list = []
-        partner_index_list = []
-        for partner_index in range(len(self.ctx.participant_id_list)):
-            if self.ctx.participant_id_list[partner_index] != my_agency_id:
-                public_key, enc_d = self._receive_enc_data(
-                    self.ctx, f'{LRMessage.ENC_D_LIST.value}_{self._iter_id}', partner_index)
-                public_key_list.append(public_key)
-                d_other_list.append(np.array(enc_d))
-                partner_index_list.append(partner_index)
+    @staticmethod
+    def _map_partners(func, partner_index_list):
+        """与每个参与方的交互在单独的线程中执行, 结果按partner_index_list的顺序返回
+
+        func(i, partner_index) 只访问第i个参与方的消息, 迭代耗时为各参与方耗时的最大值而不是总和
+        """
+        if len(partner_index_list) <= 1:
+            return [func(i, partner_index) for i, partner_index in enumerate(partner_index_list)]
+        with ThreadPoolExecutor(max_workers=len(partner_index_list)) as executor:
+            return list(executor.map(func, range(len(partner_index_list)), partner_index_list))
+
+    def _receive_d_instance_list(self):
+
+        partner_index_list = self._partner_index_list()
+        received = self._map_partners(
+            lambda _, partner_index: self._receive_enc_data(
+                self.ctx, f'{LRMessage.ENC_D_LIST.value}_{self._iter_id}', partner_index),
+            partner_index_list)
+        public_key_list = [public_key for public_key, _ in received]
+        d_other_list = [np.array(enc_d) for _, enc_d in received]
 
         return public_key_list, d_other_list, partner_index_list
 
+    def _exchange_feature_bound(self, x):
+        """训练前与各参与方交换一次特征的定点数上界和特征数, 迭代中打包的槽位宽度只由公开的量确定"""
+        self._feature_num = x.shape[1]
+        self._x_bound = self._feature_bound(x)
+        message = np.array([self._x_bound, self._feature_num], dtype='int64').tobytes()
+
+        def exchange(_, partner_index):
+            self._send_byte_data(self.ctx, LRMessage.FEATURE_BOUND.value, message, partner_index)
+            return np.frombuffer(self._receive_byte_data(
+                self.ctx, LRMessage.FEATURE_BOUND.value, partner_index), dtype='int64').tolist()
+
+        partner_index_list = self._partner_index_list()
+        self._partner_bounds = dict(zip(partner_index_list, self._map_partners(
+            exchange, partner_index_list)))
+
     def _calculate_deriv(self, x_, d, partner_index_list, d_other_list):
 
-        x = self.rounding_d(x_)
-        deriv = np.matmul(x_.T, d) / x_.shape[0]
-        for i, partner_index in enumerate(partner_index_list):
+        x = self._rounding_buffer('x', x_)
+        # d已在_send_d_instance_list中截断, 与其他参与方收到的d一致
+        deriv = (x_.T @ d) / x_.shape[0]
+        d_bound = self._d_bound()
+
+        def exchange_deriv(i, partner_index):
+            x_bound_i, feature_num_i = self._partner_bounds[partner_index]
+
             # 计算明文*密文 matmul
             # deriv_other_i = np.matmul(x.T, d_other_list[i])
-            deriv_other_i = self.enc_matmul(x.T, d_other_list[i])
+            deriv_other_i = self.enc_matmul(x.T, d_other_list[i], self.ctx.phe)
+            packing_codec = SlotPackingCodec.from_cipher(
+                d_other_list[i][0], max(1, x.shape[0] * self._x_bound * d_bound))
+            deriv_other_i = packing_codec.pack_ciphers(deriv_other_i.to_ciphers())
 
             # 发送密文，接受密文并解密
             self._send_enc_data(self.ctx, f'{LRMessage.ENC_D_HIST.value}_{self._iter_id}',
                                 deriv_other_i, partner_index)
             _, enc_deriv_i = self._receive_enc_data(
                 self.ctx, f'{LRMessage.ENC_D_HIST.value}_{self._iter_id}', partner_index)
-            deriv_i_rec = np.array(
-                self.ctx.phe.decrypt_batch(enc_deriv_i), dtype='object')
+            packing_codec = SlotPackingCodec.from_cipher(
+                enc_deriv_i[0], max(1, x.shape[0] * x_bound_i * d_bound))
+            deriv_i_rec = np.array(packing_codec.unpack(
+                self.ctx.phe.decrypt_batch(enc_deriv_i), feature_num_i), dtype='object')
             deriv_i = self.recover_d(
                 self.ctx, deriv_i_rec, is_square=True) / x_.shape[0]
 
@@ -144,32 +249,118 @@ class VerticalBooster(SecureModelBooster):
                                  deriv_i.astype('float').tobytes(), partner_index)
             deriv_x_i = np.frombuffer(self._receive_byte_data(
                 self.ctx, f'{LRMessage.D_MATMUL.value}_{self._iter_id}', partner_index), dtype=np.float)
-            self.logger.info(
-                f'{self.ctx.components.config_data["AGENCY_ID"]}, deriv size: {deriv.size}.')
             self.logger.info(
                 f'{self.ctx.components.config_data["AGENCY_ID"]}, deriv_x_i size: {deriv_x_i.size}.')
+            return deriv_x_i
+
+        self.logger.info(
+            f'{self.ctx.components.config_data["AGENCY_ID"]}, deriv size: {deriv.size}.')
+        # 按参与方顺序合并, 与串行计算的结果一致
+        for deriv_x_i in self._map_partners(exchange_deriv, partner_index_list):
             deriv += deriv_x_i
         self.logger.info(
             f'{self.ctx.components.config_data["AGENCY_ID"]}, merged deriv size: {deriv.size}.')
         return deriv
 
-    def _calculate_deriv1(self, x_, d, partner_index_list, d_other_list):
+    def _calculate_iter_deriv(self, idx):
+        """计算idx样本上本方特征的梯度, 由各参与方实现"""
+        raise NotImplementedError
 
-        x = self.rounding_d(x_)
-        deriv = np.matmul(x_.T, d) / x_.shape[0]
-        for i, partner_index in enumerate(partner_index_list):
-            # TODO：重载方法，目前支持np.array(enc_dlist).sum()的方式，不支持明文*密文
-            # deriv_other_i = np.matmul(x.T, d_other_list[i])
-            deriv_other_i = self.enc_matmul(x.T, d_other_list[i])
-            self._send_enc_data(self.ctx, f'{LRMessage.ENC_D_HIST.value}_{self._iter_id}',
-                                deriv_other_i, partner_index)
-            _, enc_deriv_i = self._receive_enc_data(
-                self.ctx, f'{LRMessage.ENC_D_HIST.value}_{self._iter_id}', partner_index)
-            deriv_i = np.array(self.ctx.phe.decrypt_batch(
-                enc_deriv_i), dtype='object')
-            deriv += (self.recover_d(self.ctx, deriv_i,
-                      is_square=True) / x_.shape[0])
-        return deriv
+    def _sum_partners(self, key_type, values: np.ndarray) -> np.ndarray:
+        """各参与方的明文向量求和, 由主动方(第0方)汇总后广播, 所有参与方得到完全相同的结果"""
+        values = np.asarray(values, dtype='float')
+        key = f'{key_type}_{self._iter_id}'
+        partner_index_list = self._partner_index_list()
+        if self.ctx.participant_id_list[0] != self.ctx.components.config_data['AGENCY_ID']:
+            self._send_byte_data(self.ctx, key, values.tobytes(), 0)
+            return np.frombuffer(self._receive_byte_data(
+                self.ctx, key, 0), dtype='float').reshape(values.shape)
+
+        received = self._map_partners(lambda _, partner_index: np.frombuffer(
+            self._receive_byte_data(self.ctx, key, partner_index), dtype='float'), partner_index_list)
+        total = values.copy()
+        for value in received:
+            total += value.reshape(values.shape)
+        self._map_partners(lambda _, partner_index: self._send_byte_data(
+            self.ctx, key, total.tobytes(), partner_index), partner_index_list)
+        return total
+
+    @staticmethod
+    def _lbfgs_direction(gram: np.ndarray, memory_num: int) -> np.ndarray:
+        """L-BFGS双循环递推, 在基向量 [s_0..s_k-1, y_0..y_k-1, g] 的系数空间中计算
+
+        gram为全局基向量的内积矩阵, 返回下降方向 -H*g 在基向量上的系数。
+        """
+        k = memory_num
+        delta = np.zeros(2 * k + 1)
+        delta[-1] = -1
+        alpha = np.zeros(k)
+        for i in range(k - 1, -1, -1):
+            alpha[i] = gram[i] @ delta / gram[i, k + i]
+            delta[k + i] -= alpha[i]
+        if k > 0:
+            delta *= gram[k - 1, 2 * k - 1] / gram[2 * k - 1, 2 * k - 1]
+        for i in range(k):
+            beta = gram[k + i] @ delta / gram[i, k + i]
+            delta[i] += alpha[i] - beta
+        return delta
+
+    def _fit_lbfgs(self, feature_select):
+        """全量样本梯度上的联邦L-BFGS, 返回完成的迭代轮数
+
+        每轮只需要一次密文梯度交互。泰勒近似后的损失是二次函数, 梯度关于权重是线性的,
+        试探步之后由梯度差得到方向上的曲率, 精确线搜索步长不需要额外的密文交互。
+        试探步长取上一轮的精确步长, 使修正量较小, 减少定点数舍入误差的放大。
+        各方的权重、梯度和修正对只保存在本地, 只交换基向量内积和曲率这样的标量。
+        """
+        idx = slice(None)
+        mask = np.isin(np.arange(len(self._train_weights)), feature_select)
+
+        def gradient():
+            self._iter_id += 1
+            deriv = self._calculate_iter_deriv(idx).astype('float')
+            deriv[~mask] = 0
+            return deriv
+
+        s_list, y_list = [], []
+        trial_step = 1.0
+        g = gradient()
+        lbfgs_iter = 0
+        while lbfgs_iter < self.params.max_iter:
+            basis = np.column_stack(s_list + y_list + [g])
+            gram = self._sum_partners(LRMessage.LBFGS_GRAM.value, basis.T @ basis)
+            g_norm = np.sqrt(gram[-1, -1])
+            self.logger.info(f'task {self.ctx.task_id}: iter-{self._iter_id}, '
+                             f'lbfgs gradient norm: {g_norm}.')
+            if g_norm < self.params.tol:
+                break
+            delta = self._lbfgs_direction(gram, len(s_list))
+            p = basis @ delta
+            gp = gram[-1] @ delta
+            # 不是下降方向时停止, 由内积矩阵判断, 不需要额外的密文交互
+            if gp >= 0:
+                break
+
+            # 试探步的梯度差 y = trial_step * H*p
+            weights = self._train_weights.copy()
+            self._train_weights += trial_step * p
+            y = (gradient() - g) / trial_step
+            curvature = self._sum_partners(LRMessage.LBFGS_CURVATURE.value, [p @ y])[0]
+            if curvature <= 0:
+                # 退回试探步之前的权重, 即梯度g对应的位置
+                self._train_weights = weights
+                break
+            step = -gp / curvature
+            self._train_weights += (step - trial_step) * p
+            g = g + step * y
+            s_list.append(step * p)
+            y_list.append(step * y)
+            trial_step = step
+            if len(s_list) > self.params.lbfgs_memory:
+                s_list.pop(0)
+                y_list.pop(0)
+            lbfgs_iter += 1
+        return lbfgs_iter
 
     def _send_enc_data(self, ctx, key_type, enc_data, partner_index, matrix_data=False):
         start_time = time.time()
@@ -312,17 +503,32 @@ class VerticalBooster(SecureModelBooster):
     def get_test_praba(self):
         return self._test_praba
 
+    @classmethod
+    def _d_bound(cls, expand=1000):
+        return int(cls.D_BOUND * expand)
+
+    @staticmethod
+    def _feature_bound(x, expand=1000):
+        """rounding_d(x) 的绝对值上界, 按float计算避免整数类型取反溢出"""
+        if x.shape[0] * x.shape[1] == 0:
+            return 0
+        return int(max(float(x.max()), -float(x.min())) * expand)
+
     @staticmethod
-    def enc_matmul(arr, enc):
-        result = []
-        for i in range(len(arr)):
-            # arr[i] * enc  # 需要将密文放在前面
-            result.append((enc * arr[i]).sum())
-        return np.array(result)
+    def enc_matmul(arr, enc, phe=None):
+        """明文整数矩阵乘以密文向量, 返回CipherArray, 可直接用于_send_enc_data
+
+        arr 为稀疏矩阵时跳过零系数, 同态运算量与非零元素个数成正比
+        """
+        enc = CipherArray.from_ciphers(enc)
+        if phe is None:
+            return enc.matmul(arr)
+        return phe.matmul_parallel(arr, enc)
 
     @staticmethod
     def rounding_d(d_list: np.ndarray, expand=1000):
-        return (d_list * expand).astype('int')
+        # 紧凑存储的整数特征先提升为float64, 避免乘以expand时溢出
+        return (d_list.astype('float', copy=False) * expand).astype('int')
 
     @staticmethod
     def recover_d(ctx, d_sum_list: np.ndarray, is_square=False, expand=1000):
@@ -33,10 +33,17 @@ class VerticalLRPassiveParty(VerticalBooster):
     ) -> None:
         self.log.info(
             f'task {self.ctx.task_id}: Starting the lr on the passive party.')
+        self._check_optimizer()
         self._init_passive_data()
 
-        max_iter = self._init_iter(self.dataset.train_X.shape[0], 
-                                   self.params.epochs, self.params.batch_size)
+        if self.params.optimizer == 'lbfgs':
+            start_time = time.time()
+            feature_select = self._select_feature()
+            self._fit_lbfgs(feature_select)
+            max_iter = 0
+        else:
+            max_iter = self._init_iter(self.dataset.train_X.shape[0], 
+                                       self.params.epochs, self.params.batch_size)
         for _ in range(max_iter):
             self._iter_id += 1
             start_time = time.time()
@@ -92,20 +99,27 @@ class VerticalLRPassiveParty(VerticalBooster):
             self.ctx, LRMessage.FEATURE_NAME.value, 0)
         self._all_feature_name = json.loads(feature_name_bytes.decode('utf-8'))
 
+        # 交换打包所需的特征上界
+        self._exchange_feature_bound(self.dataset.train_X)
+
     def _build_iter(self, feature_select, idx):
 
-        x_ = self.dataset.train_X[idx]
+        deriv = self._calculate_iter_deriv(idx)
+
+        self._train_weights -= self.params.learning_rate * deriv.astype('float')
+        self._train_weights[~np.isin(np.arange(len(self._train_weights)), feature_select)] = 0
+
+    def _calculate_iter_deriv(self, idx):
+
+        x_, = self._take_batch(idx, self.dataset.train_X)
 
-        g = self._loss_func.dot_product(x_, self._train_weights)
+        g = self._batch_dot(x_)
         h = self._loss_func.inference(g)
         d = h
 
         self._send_d_instance_list(d)
         public_key_list, d_other_list, partner_index_list = self._receive_d_instance_list()
-        deriv = self._calculate_deriv(x_, d, partner_index_list, d_other_list)
-
-        self._train_weights -= self.params.learning_rate * deriv.astype('float')
-        self._train_weights[~np.isin(np.arange(len(self._train_weights)), feature_select)] = 0
+        return self._calculate_deriv(x_, d, partner_index_list, d_other_list)
 
     def _predict_tree(self, X, key_type):
         train_g = self._loss_func.dot_product(X, self._train_weights)